@@ -1,10 +1,13 @@
 from flask import Blueprint, jsonify, request, abort
 from snmp_utils import get_metrics
-from db_utils import upsert_current_metric, open_alert
-from models import Measurement, Alert, Host
+from db_utils import open_alert
+from models import Alert, Host
+from inventory import credentials_for
+from metric_pipeline import normalize, persist
+from series_store import read_history
+from lttb import lttb_rows
 from datetime import datetime, timedelta
 from database import db
-from seuils import check_thresholds
 import logging
 logger = logging.getLogger(__name__)
 
@@ -13,68 +16,8 @@ bp = Blueprint("api_poll", __name__, url_prefix="/api/poll")
 SNMP_DOWN_MSG = "SNMP injoignable (timeout)"
 SNMP_UP_MSG = "SNMP rétabli ✅"
 
-# =====================================================================
-# 🔹 Fonction utilitaire : enregistre les mesures d’une catégorie SNMP
-# =====================================================================
-def store_measurements_for_category(db, host, cat, data):
-    """Gère l’insertion des mesures selon la catégorie SNMP."""
-
-    # --- 🔸 INTERFACES ---
-    if cat == "interfaces":
-        for iface_name, iface_info in data.items():
-            in_val = iface_info.get("in_mbps", 0.0)
-            out_val = iface_info.get("out_mbps", 0.0)
-            state = iface_info.get("state", "unknown")
-
-            db.session.add(Measurement(
-                host_id=host.id,
-                oid=f"{iface_name}.in",
-                metric=f"{iface_name}.in",
-                value=str(in_val),
-                meta=cat
-            ))
-            db.session.add(Measurement(
-                host_id=host.id,
-                oid=f"{iface_name}.out",
-                metric=f"{iface_name}.out",
-                value=str(out_val),
-                meta=cat
-            ))
-
-            # État interface
-            upsert_current_metric(db, host.id, f"{iface_name}.state", iface_name, state, meta=cat)
-        return
-
-    # --- 🔸 RAM / STORAGE ---
-    if cat in ("ram", "storage"):
-        for metric, val in data.items():
-            if isinstance(val, dict) and "used" in val and "total" in val:
-                pct = val.get("pct", 0)
-                label = metric.split(".")[0]
-
-                upsert_current_metric(db, host.id, label, label, pct, meta=cat)
-                db.session.add(Measurement(
-                    host_id=host.id,
-                    oid=metric,
-                    metric=label,
-                    value=str(pct),
-                    meta=cat
-                ))
-                check_thresholds(db, host, cat, metric, pct, Alert)
-        return
-
-    # --- 🔸 CPU / SYSTEM / AUTRES ---
-    for metric, val in data.items():
-        upsert_current_metric(db, host.id, metric, metric, val, meta=cat)
-        db.session.add(Measurement(
-            host_id=host.id,
-            oid=metric,
-            metric=metric,
-            value=str(val),
-            meta=cat
-        ))
-        check_thresholds(db, host, cat, metric, val, Alert)
-
+# Plancher de max_points (LTTB garde au moins le premier et le dernier point)
+MIN_CHART_POINTS = 10
 
 # =====================================================================
 # 🔹 POLL D’UN HOST UNIQUE
@@ -90,6 +33,7 @@ def poll_host_api(host_id):
 
     previous_status = host.status or "unknown"
     reachable = True  # pas de test ping ici, juste SNMP
+    poll_ts = datetime.utcnow().replace(microsecond=0)
 
     for cat in (host.snmp_categories or []):
         try:
@@ -97,7 +41,7 @@ def poll_host_api(host_id):
 
             data = get_metrics(
                 host.ip,
-                host.snmp_community,
+                credentials_for(host),
                 host.port,
                 cat,
                 host_id=host.id,
@@ -107,7 +51,8 @@ def poll_host_api(host_id):
             result[cat] = data
             print(f"[API POLL] {host.hostname} [{group_name or 'default'}] → {cat} ({len(data)} métriques)")
 
-            store_measurements_for_category(db, host, cat, data)
+            # Même normalisation et mêmes écritures que le poller (metric_pipeline)
+            persist(db, host, cat, normalize(cat, data), poll_ts, Alert)
 
         except Exception as e:
             msg = f"Erreur SNMP ({cat}) sur {host.hostname}: {e}"
@@ -158,12 +103,13 @@ def poll_all_hosts():
         try:
             group_name = h.group.name if h.group else None
             cat_metrics = {}
+            poll_ts = datetime.utcnow().replace(microsecond=0)
 
             for cat in (h.snmp_categories or []):
                 try:
                     data = get_metrics(
                         h.ip,
-                        h.snmp_community,
+                        credentials_for(h),
                         h.port,
                         cat,
                         host_id=h.id,
@@ -171,7 +117,7 @@ def poll_all_hosts():
                     )
                     cat_metrics[cat] = data
                     print(f"[API POLL] {h.hostname} → {cat} ({len(data)} métriques)")
-                    store_measurements_for_category(db, h, cat, data)
+                    persist(db, h, cat, normalize(cat, data), poll_ts, Alert)
                 except Exception as e_cat:
                     print(f"[API POLL] ⚠️ Erreur SNMP {h.hostname} ({cat}): {e_cat}")
                     if h.status != "down":
@@ -221,46 +167,33 @@ def metrics_history(host_id, category):
     except ValueError:
         minutes = 5
 
-    since = datetime.utcnow() - timedelta(minutes=minutes)
+    # Points max par série (LTTB) ; absent ou invalide : pas de réduction
+    max_points = request.args.get("max_points", type=int)
 
-    rows = (
-        db.session.query(Measurement)
-        .filter(Measurement.host_id == host_id)
-        .filter(Measurement.meta.like(f"%{category}%"))
-        .filter(Measurement.ts >= since)
-        # Récupérer d'abord les dernières mesures (desc) pour éviter le
-        # cas où la fenêtre demandée contient plus de 1000 entrées et
-        # que la limite tronque les valeurs récentes.
-        .order_by(Measurement.ts.desc())
-        .limit(1000)
-        .all()
-    )
+    since = datetime.utcnow() - timedelta(minutes=minutes)
 
-    # .all() renvoie les rows ordonnées par ts desc ; on inverse pour
-    # envoyer au client un tableau chronologique asc (temps croissant).
-    rows = list(reversed(rows))
+    # Séries numériques de la catégorie, en ordre chronologique : brutes sur une
+    # fenêtre courte, sinon l'agrégat le plus grossier qui garde assez de points
+    resolution, rows = read_history(db, host_id, category, since)
+    if max_points and max_points > 0:
+        rows = lttb_rows(rows, max(max_points, MIN_CHART_POINTS))
 
     data = []
-    for r in rows:
-        try:
-            val = float(r.value)
-        except (ValueError, TypeError):
-            continue
-
-        metric_name = r.oid if category == "interfaces" else r.metric
-
+    for name, ts, val in rows:
         # Retourner un ISO timestamp en UTC avec 'Z' pour éviter les ambiguïtés
         # côté client (chart.js / date parsing). Les timestamps en DB sont
         # stockés en UTC (naïfs), on les formate donc explicitement en UTC.
         try:
-            ts_str = r.ts.strftime('%Y-%m-%dT%H:%M:%SZ')
+            ts_str = ts.strftime('%Y-%m-%dT%H:%M:%SZ')
         except Exception:
-            ts_str = r.ts.isoformat()
+            ts_str = ts.isoformat()
 
         data.append({
             "timestamp": ts_str,
-            "metric": metric_name,
+            "metric": name,
             "value": val
         })
 
-    return jsonify(data)
+    response = jsonify(data)
+    response.headers["X-Resolution"] = str(resolution)
+    return response
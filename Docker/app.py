@@ -12,7 +12,10 @@ from io import TextIOWrapper
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 from typing import List, Optional
-from snmp_utils import snmp_get, snmp_walk, get_metrics
+from snmp_utils import snmp_get, snmp_walk, get_metrics, AUTH_PROTOCOLS, PRIV_PROTOCOLS
+from snmp_registry import collect_metrics
+from inventory import credentials_for
+from series_store import forget_host
 from models import User, Host, Alert, Group, Tag, Template, CurrentMetric, Measurement, host_tags
 from seuils import get_severity, check_thresholds
 import logging
@@ -281,6 +284,59 @@ def _ensure_template(name: str) -> Optional[Template]:
         db.session.flush()
     return tpl
 
+def _creates_dependency_cycle(host_id: int, parent_id: int) -> bool:
+    """Vrai si rattacher `host_id` à `parent_id` crée une boucle de dépendances."""
+    seen = set()
+    current = parent_id
+    while current and current not in seen:
+        if current == host_id:
+            return True
+        seen.add(current)
+        parent = db.session.get(Host, current)
+        current = parent.parent_id if parent else None
+    return False
+
+
+def _snmp_security_from_form(existing=None):
+    """
+    Lit la version SNMP et les paramètres USM (v3) du formulaire.
+    Retourne (version, v3, erreur). Une clé laissée vide conserve la clé
+    existante (`existing`) : les secrets ne sont jamais réaffichés.
+    """
+    version = request.form.get("snmp_version") or None
+    if version not in (None, "v1", "v2c", "v3"):
+        return None, None, "Version SNMP invalide."
+    user = request.form.get("snmp_v3_user", "").strip()
+    if not user:
+        # Pas d'utilisateur propre à l'hôte : identifiants v3 du template
+        return version, None, None
+
+    previous = existing or {}
+    v3 = {
+        "user": user,
+        "auth_protocol": request.form.get("snmp_v3_auth_protocol", "SHA"),
+        "auth_key": request.form.get("snmp_v3_auth_key", "") or previous.get("auth_key"),
+        "priv_protocol": request.form.get("snmp_v3_priv_protocol", "AES"),
+        "priv_key": request.form.get("snmp_v3_priv_key", "") or previous.get("priv_key"),
+    }
+    if v3["auth_protocol"] not in AUTH_PROTOCOLS or v3["priv_protocol"] not in PRIV_PROTOCOLS:
+        return None, None, "Protocole SNMPv3 inconnu."
+    if v3["auth_protocol"] == "none":
+        v3["auth_key"] = None
+    if v3["priv_protocol"] == "none":
+        v3["priv_key"] = None
+    if v3["priv_key"] and not v3["auth_key"]:
+        return None, None, "Le chiffrement SNMPv3 (priv) nécessite une authentification."
+    for key in ("auth_key", "priv_key"):
+        if v3[key] and len(v3[key]) < 8:
+            return None, None, "Les clés SNMPv3 doivent faire au moins 8 caractères."
+    if v3["auth_protocol"] != "none" and not v3["auth_key"]:
+        return None, None, "Clé d'authentification SNMPv3 manquante."
+    if v3["priv_protocol"] != "none" and not v3["priv_key"]:
+        return None, None, "Clé de chiffrement SNMPv3 manquante."
+    return version, v3, None
+
+
 def get_down_hostnames():
     critical_alerts = (
         Alert.query
@@ -561,6 +617,37 @@ def healthz():
         db_ok = True
     except Exception:
         db_ok = False
+    try:
+        from poller import LAST_CYCLE_STATS
+        poller_stats = dict(LAST_CYCLE_STATS)
+    except Exception:
+        poller_stats = {}
+    try:
+        from trap_receiver import TRAP_STATS
+        trap_stats = dict(TRAP_STATS)
+    except Exception:
+        trap_stats = {}
+    try:
+        from retention import RETENTION_STATS
+        retention_stats = dict(RETENTION_STATS)
+    except Exception:
+        retention_stats = {}
+    try:
+        from rollups import ROLLUP_STATS
+        from chunk_store import CHUNK_STATS
+        rollup_stats = dict(ROLLUP_STATS, chunks=dict(CHUNK_STATS))
+    except Exception:
+        rollup_stats = {}
+    try:
+        from recent_store import RECENT
+        recent_stats = RECENT.stats()
+    except Exception:
+        recent_stats = {}
+    try:
+        from query_plans import QUERY_PLAN_PROBLEMS
+        plan_problems = list(QUERY_PLAN_PROBLEMS)
+    except Exception:
+        plan_problems = []
     return jsonify(
         status="ok" if db_ok else "degraded",
         db_host=DB_HOST,
@@ -568,6 +655,12 @@ def healthz():
         db_name=DB_NAME,
         user=g.user,
         role=g.role,
+        poller=poller_stats,
+        traps=trap_stats,
+        retention=retention_stats,
+        rollups=rollup_stats,
+        query_plans=plan_problems,
+        recent=recent_stats,
     )
 
 @app.route("/logs/poller")
@@ -608,13 +701,10 @@ def host_view(host_id: int):
     try:
         # 🔹 Essai d’interrogation SNMP live
         if host.snmp_categories:
-            for category in host.snmp_categories:
-                metrics[category] = get_metrics(
-                    ip=host.ip,
-                    community=host.snmp_community,
-                    port=host.port,
-                    category=category
-                )
+            # Un seul plan de requêtes pour toutes les catégories de l'hôte
+            metrics, failures = collect_metrics(host.ip, credentials_for(host), host.port, host.snmp_categories)
+            if failures:
+                error = f"Hôte injoignable ou timeout SNMP : {next(iter(failures.values()))}"
     except Exception as e:
         error = f"Hôte injoignable ou timeout SNMP : {e}"
 
@@ -695,12 +785,14 @@ def host_edit(host_id: int):
 
     groups = Group.query.order_by(Group.name.asc()).all()
     templates = Template.query.order_by(Template.name.asc()).all()
+    parents = Host.query.filter(Host.id != host.id).order_by(Host.hostname.asc()).all()
 
     if request.method == "POST":
         hostname = request.form.get("hostname", "").strip()
         description = request.form.get("description", "").strip()
         group_id = request.form.get("group_id") or None
         template_id = request.form.get("template_id") or None
+        parent_id = request.form.get("parent_id", type=int)
         ip = request.form.get("ip", "").strip()
         port = request.form.get("port", "161").strip()
         tags_raw = request.form.get("tags", "").strip()
@@ -716,23 +808,30 @@ def host_edit(host_id: int):
         # Validations
         if not hostname:
             flash("Hostname obligatoire.", "danger")
-            return render_template("host_edit.html", host=host, groups=groups, templates=templates)
+            return render_template("host_edit.html", host=host, groups=groups, templates=templates, parents=parents)
         exists = Host.query.filter(Host.hostname == hostname, Host.id != host.id).first()
         if exists:
             flash("Un autre host utilise déjà ce hostname.", "warning")
-            return render_template("host_edit.html", host=host, groups=groups, templates=templates)
+            return render_template("host_edit.html", host=host, groups=groups, templates=templates, parents=parents)
         try:
             ipaddress.ip_address(ip)
         except ValueError:
             flash("Adresse IP invalide.", "danger")
-            return render_template("host_edit.html", host=host, groups=groups, templates=templates)
+            return render_template("host_edit.html", host=host, groups=groups, templates=templates, parents=parents)
         try:
             port = int(port)
             if port < 1 or port > 65535:
                 raise ValueError()
         except ValueError:
             flash("Port invalide (1-65535).", "danger")
-            return render_template("host_edit.html", host=host, groups=groups, templates=templates)
+            return render_template("host_edit.html", host=host, groups=groups, templates=templates, parents=parents)
+        if parent_id and _creates_dependency_cycle(host.id, parent_id):
+            flash("Dépendance invalide : ce parent dépend (directement ou non) de cet hôte.", "danger")
+            return render_template("host_edit.html", host=host, groups=groups, templates=templates, parents=parents)
+        snmp_version, snmp_v3, error = _snmp_security_from_form(host.snmp_v3)
+        if error:
+            flash(error, "danger")
+            return render_template("host_edit.html", host=host, groups=groups, templates=templates, parents=parents)
 
         # Application des modifications
         host.hostname = hostname
@@ -741,7 +840,10 @@ def host_edit(host_id: int):
         host.port = port
         host.group_id = int(group_id) if group_id else None
         host.template_id = int(template_id) if template_id else None
+        host.parent_id = parent_id or None
         host.snmp_community = snmp_community or "public"
+        host.snmp_version = snmp_version
+        host.snmp_v3 = snmp_v3
         host.snmp_categories = list(snmp_categories)
 
         # Geolocation (optional)
@@ -795,7 +897,7 @@ def host_edit(host_id: int):
 
     # Pré-remplir le champ tags
     tags_value = ", ".join(t.name for t in host.tags) if host.tags else ""
-    return render_template("host_edit.html", host=host, groups=groups, templates=templates, tags_value=tags_value)
+    return render_template("host_edit.html", host=host, groups=groups, templates=templates, parents=parents, tags_value=tags_value)
 
 
 @app.route("/hosts/<int:host_id>/delete", methods=["POST"])
@@ -807,6 +909,7 @@ def host_delete(host_id: int):
     hostname = host.hostname
     db.session.delete(host)
     db.session.commit()
+    forget_host(host_id)
     flash(f"Host « {hostname} » supprimé.", "success")
     return redirect(url_for("admin"))
 
@@ -852,7 +955,7 @@ def admin():
     hosts_down = Host.query.filter_by(status="down").count()
     hosts_warning = Host.query.filter_by(status="warning").count()
     hosts_unknown = Host.query.filter(
-        or_(Host.status == None, Host.status == "unknown")
+        or_(Host.status == None, Host.status == "unknown", Host.status == "unreachable")
     ).count()
 
     # Répartition par catégorie SNMP
@@ -986,7 +1089,31 @@ def template_new():
         if Template.query.filter_by(name=name).first():
             flash("Ce template existe déjà.", "warning")
             return render_template("template_new.html")
-        db.session.add(Template(name=name, description=description))
+        # Bornes de la fréquence de poll adaptative (secondes, optionnelles)
+        params = {}
+        for key in ("poll_min_interval", "poll_max_interval"):
+            raw = request.form.get(key, "").strip()
+            if not raw:
+                continue
+            try:
+                params[key] = int(raw)
+            except ValueError:
+                flash("Les intervalles de poll doivent être des entiers (secondes).", "danger")
+                return render_template("template_new.html")
+            if params[key] <= 0:
+                flash("Les intervalles de poll doivent être positifs.", "danger")
+                return render_template("template_new.html")
+        if params.get("poll_min_interval", 0) > params.get("poll_max_interval", float("inf")):
+            flash("L'intervalle minimal doit être inférieur ou égal au maximal.", "danger")
+            return render_template("template_new.html")
+        snmp_version, v3, error = _snmp_security_from_form()
+        if error:
+            flash(error, "danger")
+            return render_template("template_new.html")
+        if v3:
+            params["v3"] = v3
+        db.session.add(Template(name=name, description=description,
+                                snmp_version=snmp_version or "v2c", params=params or None))
         db.session.commit()
         flash(f"Template « {name} » créé.", "success")
         return redirect(url_for("host_new"))
@@ -1329,7 +1456,7 @@ def category_overview(category):
     host_data = []
     for h in hosts:
         try:
-            metrics = get_metrics(h.ip, h.snmp_community or "public", h.port or 161, category)
+            metrics = get_metrics(h.ip, credentials_for(h), h.port or 161, category)
             host_data.append({"host": h, "metrics": metrics})
         except Exception as e:
             host_data.append({"host": h, "error": str(e)})
@@ -1380,11 +1507,13 @@ def api_alerts_latest():
 def host_new():
     groups = Group.query.order_by(Group.name.asc()).all()
     templates = Template.query.order_by(Template.name.asc()).all()
+    parents = Host.query.order_by(Host.hostname.asc()).all()
 
     if request.method == "POST":
         hostname = request.form.get("hostname", "").strip()
         description = request.form.get("description", "").strip()
         group_id = request.form.get("group_id") or None
+        parent_id = request.form.get("parent_id", type=int)
         ip = request.form.get("ip", "").strip()
         port = request.form.get("port", "161").strip()
         tags_raw = request.form.get("tags", "").strip()
@@ -1396,22 +1525,26 @@ def host_new():
         # Validations simples
         if not hostname:
             flash("Hostname obligatoire.", "danger")
-            return render_template("host_new.html", groups=groups, templates=templates)
+            return render_template("host_new.html", groups=groups, templates=templates, parents=parents)
         if Host.query.filter_by(hostname=hostname).first():
             flash("Un host avec ce hostname existe déjà.", "warning")
-            return render_template("host_new.html", groups=groups, templates=templates)
+            return render_template("host_new.html", groups=groups, templates=templates, parents=parents)
         try:
             ipaddress.ip_address(ip)
         except ValueError:
             flash("Adresse IP invalide.", "danger")
-            return render_template("host_new.html", groups=groups, templates=templates)
+            return render_template("host_new.html", groups=groups, templates=templates, parents=parents)
         try:
             port = int(port)
             if port < 1 or port > 65535:
                 raise ValueError()
         except ValueError:
             flash("Port invalide (1-65535).", "danger")
-            return render_template("host_new.html", groups=groups, templates=templates)
+            return render_template("host_new.html", groups=groups, templates=templates, parents=parents)
+        snmp_version, snmp_v3, error = _snmp_security_from_form()
+        if error:
+            flash(error, "danger")
+            return render_template("host_new.html", groups=groups, templates=templates, parents=parents)
 
         # Création de l’hôte
         host = Host(
@@ -1420,10 +1553,13 @@ def host_new():
             ip=ip,
             port=port,
             group_id=int(group_id) if group_id else None,
+            parent_id=parent_id or None,
         )
 
         # SNMP v2c
         host.snmp_community = snmp_community or "public"
+        host.snmp_version = snmp_version
+        host.snmp_v3 = snmp_v3
         host.snmp_categories = snmp_categories or ["system"]
 
         # Geolocation (optional)
@@ -1462,7 +1598,7 @@ def host_new():
     initial_ip = request.args.get('ip', '')
     initial_port = request.args.get('port', '161')
     initial_snmp_community = request.args.get('snmp_community', 'public')
-    return render_template("host_new.html", groups=groups, templates=templates,
+    return render_template("host_new.html", groups=groups, templates=templates, parents=parents,
                            initial_hostname=initial_hostname,
                            initial_ip=initial_ip,
                            initial_port=initial_port,
@@ -1533,8 +1669,11 @@ def inject_globals():
 @app.context_processor
 def inject_host_status_cache():
     try:
-        from poller import HOST_STATUS_CACHE
-        return {'HOST_STATUS_CACHE': HOST_STATUS_CACHE}
+        from poller import HOST_STATE
+        from host_state import load_status_map
+        # Dans le process du poller : registre en mémoire ; ailleurs : table host_state
+        statuses = HOST_STATE.statuses() if len(HOST_STATE) else load_status_map(db)
+        return {'HOST_STATUS_CACHE': statuses}
     except Exception:
         # si poller pas encore initialisé
         return {'HOST_STATUS_CACHE': {}}
@@ -1582,7 +1721,18 @@ if __name__ == "__main__":
     if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
         with app.app_context():
             from poller import start_scheduler
+            from trap_receiver import start_trap_receiver
+            from retention import start_retention_job
+            from rollups import start_rollup_job
             start_scheduler(app, db, Host, Alert)
+            start_trap_receiver(app, db, Alert)
+            start_retention_job(app, db)
+            start_rollup_job(app, db)
+            try:
+                from query_plans import check_query_plans
+                check_query_plans(db)
+            except Exception as e:
+                print(f"[plans] ⚠️ Contrôle des plans impossible : {e}")
     else:
         print("[poller] ⏭️ Scheduler non démarré (process reloader Flask)")
 
@@ -0,0 +1,75 @@
+"""
+Banc d'essai du backend de séries mmap (mmap_store.py).
+
+    python bench_mmap_store.py --series 2000 --hours 24 --step 15
+
+Écrit `series` séries échantillonnées toutes les `step` secondes sur `hours`
+heures dans un répertoire temporaire, puis mesure :
+  - le débit d'écriture (points/s, un appel append par hôte et par cycle) ;
+  - la latence des lectures de plage (1 h, 6 h, fenêtre complète) d'une catégorie.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SEGMENT_INITIAL_CAPACITY", "1024")
+from mmap_store import MmapSeriesStore  # noqa: E402
+
+SERIES_PER_HOST = 20
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--series", type=int, default=2000, help="nombre total de séries")
+    parser.add_argument("--hours", type=float, default=24, help="historique écrit (heures)")
+    parser.add_argument("--step", type=int, default=15, help="intervalle entre points (s)")
+    parser.add_argument("--reads", type=int, default=200, help="lectures par fenêtre")
+    parser.add_argument("--dir", default=None, help="répertoire de données (temporaire par défaut)")
+    args = parser.parse_args()
+
+    root = args.dir or tempfile.mkdtemp(prefix="bench_series_")
+    store = MmapSeriesStore(root)
+    hosts = max(1, args.series // SERIES_PER_HOST)
+    names = [f"eth{i}.in" for i in range(SERIES_PER_HOST)]
+    cycles = int(args.hours * 3600 / args.step)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(hours=args.hours)
+
+    # 🔹 Écriture
+    t0 = time.perf_counter()
+    for cycle in range(cycles):
+        ts = start + timedelta(seconds=cycle * args.step)
+        for host in range(hosts):
+            store.append(host, "interfaces", ts, [(n, random.random() * 1000) for n in names])
+    elapsed = time.perf_counter() - t0
+    points = cycles * hosts * SERIES_PER_HOST
+    print(f"écriture : {points} points en {elapsed:.2f}s → {points / elapsed:,.0f} points/s")
+
+    # 🔹 Lectures de plage
+    end = start + timedelta(hours=args.hours)
+    for hours in sorted({h for h in (1, 6, args.hours) if h <= args.hours}):
+        label = f"{hours:g}h"
+        latencies = []
+        for _ in range(args.reads):
+            host = random.randrange(hosts)
+            t1 = time.perf_counter()
+            data = store.read(host, "interfaces", end - timedelta(hours=hours), end)
+            latencies.append((time.perf_counter() - t1) * 1000)
+        n = sum(len(ts) for ts, _ in data.values())
+        print(f"lecture {label:>4} ({n} points, {SERIES_PER_HOST} séries) : "
+              f"p50 {percentile(latencies, 50):.2f} ms, p95 {percentile(latencies, 95):.2f} ms")
+
+    if args.dir is None:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import os
+import struct
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from models import MetricSeries, MetricSample, MetricChunk, RollupWatermark, Host
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Chunks compressés (Gorilla) des échantillons anciens
+# ─────────────────────────────────────────────
+# Une fois une heure scellée (plus vieille que CHUNK_MIN_AGE et déjà agrégée
+# en 1 min), les échantillons bruts de chaque série sont encodés en un seul
+# BLOB metric_chunks puis supprimés de metric_samples :
+#   - horodatages : delta-of-delta à préfixe variable (0 → 1 bit)
+#   - valeurs : XOR avec la précédente (valeur inchangée → 1 bit)
+# Les lecteurs (historique brut, export des logs) décodent directement en array('d').
+CHUNK_ENABLED = os.getenv("CHUNK_ENABLED", "1") == "1"
+CHUNK_SPAN = 3600                                           # une heure par chunk
+CHUNK_MIN_AGE = int(os.getenv("CHUNK_MIN_AGE", str(6 * 3600)))
+CHUNK_BATCH_SPAN = 6 * 3600                                 # secondes compactées par passe
+# Clé du filigrane de compaction dans rollup_watermarks (résolution 0 : brut)
+COMPACTION_MARK = 0
+
+EPOCH = datetime(1970, 1, 1)
+
+# Totaux depuis le démarrage, exposés par /healthz (avec les agrégats)
+CHUNK_STATS = {"chunks_written": 0, "samples_compacted": 0, "bytes_written": 0}
+
+
+# ==== 🔹 Flux de bits ====
+class BitWriter:
+    __slots__ = ("acc", "nbits")
+
+    def __init__(self):
+        self.acc = 0
+        self.nbits = 0
+
+    def write(self, value, width):
+        self.acc = (self.acc << width) | (value & ((1 << width) - 1))
+        self.nbits += width
+
+    def to_bytes(self):
+        pad = -self.nbits % 8
+        return (self.acc << pad).to_bytes((self.nbits + pad) // 8, "big")
+
+
+class BitReader:
+    __slots__ = ("acc", "remaining")
+
+    def __init__(self, data):
+        self.acc = int.from_bytes(data, "big")
+        self.remaining = len(data) * 8
+
+    def read(self, width):
+        self.remaining -= width
+        return (self.acc >> self.remaining) & ((1 << width) - 1)
+
+
+def _float_bits(value):
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+# Delta-of-delta hors 0 : (préfixe, largeur du préfixe, largeur de la valeur) ;
+# au-delà de [-2048, 2047] s, préfixe 1111 + 32 bits
+DOD_CLASSES = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+def encode_chunk(start, timestamps, values):
+    """Encode des ts entiers (epoch, croissants, >= start) et des floats en BLOB."""
+    out = BitWriter()
+    prev_ts, prev_delta = start, 0
+    prev_bits, prev_lead, prev_trail = 0, -1, 0
+    for i, (ts, value) in enumerate(zip(timestamps, values)):
+        ts = int(ts)
+        # ---- horodatage ----
+        if i == 0:
+            out.write(ts - start, 32)
+            prev_delta = ts - start
+        else:
+            delta = ts - prev_ts
+            dod = delta - prev_delta
+            if dod == 0:
+                out.write(0, 1)
+            else:
+                for prefix, prefix_width, width in DOD_CLASSES:
+                    if -(1 << (width - 1)) <= dod < (1 << (width - 1)):
+                        out.write(prefix, prefix_width)
+                        out.write(dod, width)
+                        break
+                else:
+                    out.write(0b1111, 4)
+                    out.write(dod, 32)
+            prev_delta = delta
+        prev_ts = ts
+
+        # ---- valeur ----
+        bits = _float_bits(value)
+        if i == 0:
+            out.write(bits, 64)
+        else:
+            xor = bits ^ prev_bits
+            if xor == 0:
+                out.write(0, 1)
+            else:
+                lead = min(64 - xor.bit_length(), 31)
+                trail = (xor & -xor).bit_length() - 1
+                if prev_lead >= 0 and lead >= prev_lead and trail >= prev_trail:
+                    # Bits significatifs dans la fenêtre précédente
+                    out.write(0b10, 2)
+                    out.write(xor >> prev_trail, 64 - prev_lead - prev_trail)
+                else:
+                    length = 64 - lead - trail
+                    out.write(0b11, 2)
+                    out.write(lead, 5)
+                    out.write(length - 1, 6)
+                    out.write(xor >> trail, length)
+                    prev_lead, prev_trail = lead, trail
+        prev_bits = bits
+    return out.to_bytes()
+
+
+def _signed(value, width):
+    return value - (1 << width) if value >= (1 << (width - 1)) else value
+
+
+def decode_chunk(start, count, data):
+    """Décode un BLOB en (array('d') ts epoch, array('d') valeurs)."""
+    timestamps, values = array("d"), array("d")
+    if not count:
+        return timestamps, values
+    bits_in = BitReader(data)
+    ts = start + bits_in.read(32)
+    delta = ts - start
+    bits = bits_in.read(64)
+    timestamps.append(ts)
+    values.append(_bits_float(bits))
+    lead = trail = 0
+    for _ in range(count - 1):
+        # ---- horodatage ----
+        if bits_in.read(1):
+            if not bits_in.read(1):
+                dod = _signed(bits_in.read(7), 7)
+            elif not bits_in.read(1):
+                dod = _signed(bits_in.read(9), 9)
+            elif not bits_in.read(1):
+                dod = _signed(bits_in.read(12), 12)
+            else:
+                dod = _signed(bits_in.read(32), 32)
+            delta += dod
+        ts += delta
+        # ---- valeur ----
+        if bits_in.read(1):
+            if bits_in.read(1):
+                lead = bits_in.read(5)
+                length = bits_in.read(6) + 1
+                trail = 64 - lead - length
+            bits ^= bits_in.read(64 - lead - trail) << trail
+        timestamps.append(ts)
+        values.append(_bits_float(bits))
+    return timestamps, values
+
+
+# ==== 🔹 Compaction ====
+def _hour(ts):
+    seconds = int((ts - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % CHUNK_SPAN)
+
+
+def compaction_mark(db):
+    mark = db.session.get(RollupWatermark, COMPACTION_MARK)
+    return mark.watermark if mark else None
+
+
+def compact(db, now=None):
+    """
+    Une passe : encode au plus CHUNK_BATCH_SPAN secondes d'heures scellées.
+    Retourne False quand il n'y a plus rien à compacter.
+    """
+    now = now or datetime.utcnow()
+    one_minute = db.session.get(RollupWatermark, 60)
+    if one_minute is None:
+        return False  # les agrégats doivent d'abord lire ces échantillons bruts
+    end_limit = _hour(min(now - timedelta(seconds=CHUNK_MIN_AGE), one_minute.watermark))
+
+    start = compaction_mark(db)
+    if start is None:
+        first = db.session.query(db.func.min(MetricSample.ts)).scalar()
+        if first is None:
+            return False
+        start = _hour(first)
+    if start >= end_limit:
+        return False
+    end = min(end_limit, start + timedelta(seconds=CHUNK_BATCH_SPAN))
+
+    # Échantillons par (série, heure)
+    groups = {}
+    rows = (db.session.query(MetricSample.series_id, MetricSample.ts, MetricSample.value)
+            .filter(MetricSample.ts >= start, MetricSample.ts < end)
+            .order_by(MetricSample.series_id, MetricSample.ts)
+            .yield_per(5000))
+    for sid, ts, value in rows:
+        group = groups.setdefault((sid, _hour(ts)), (array("d"), array("d")))
+        group[0].append((ts - EPOCH).total_seconds())
+        group[1].append(value)
+
+    if groups:
+        chunks = []
+        for (sid, hour), (timestamps, values) in groups.items():
+            data = encode_chunk(int((hour - EPOCH).total_seconds()), timestamps, values)
+            chunks.append({"series_id": sid, "ts": hour, "count": len(values), "data": data})
+            CHUNK_STATS["bytes_written"] += len(data)
+            CHUNK_STATS["samples_compacted"] += len(values)
+        stmt = (insert(MetricChunk.__table__)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite"))
+        db.session.execute(stmt, chunks)
+        # Suppression des lignes brutes par clé primaire (series_id, ts)
+        series_ids = sorted({sid for sid, _ in groups})
+        for i in range(0, len(series_ids), 500):
+            (db.session.query(MetricSample)
+             .filter(MetricSample.series_id.in_(series_ids[i:i + 500]))
+             .filter(MetricSample.ts >= start, MetricSample.ts < end)
+             .delete(synchronize_session=False))
+        CHUNK_STATS["chunks_written"] += len(chunks)
+
+    mark = db.session.get(RollupWatermark, COMPACTION_MARK)
+    if mark is None:
+        db.session.add(RollupWatermark(resolution=COMPACTION_MARK, watermark=end))
+    else:
+        mark.watermark = end
+    db.session.commit()
+    return True
+
+
+def run_compaction(db, now=None):
+    """Rattrape la compaction (appelé par le job des agrégats, après eux)."""
+    if not CHUNK_ENABLED:
+        return
+    try:
+        while compact(db, now):
+            pass
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"[chunks] ❌ Compaction échouée : {e}")
+
+
+# ==== 🔹 Lecture ====
+def _decode_rows(chunks, since, until):
+    """Décode des (clé, début, nombre, data) en lignes (clé, ts epoch, valeur) dans [since, until)."""
+    start = (since - EPOCH).total_seconds()
+    end = (until - EPOCH).total_seconds() if until is not None else float("inf")
+    for key, hour, count, data in chunks:
+        timestamps, values = decode_chunk(int((hour - EPOCH).total_seconds()), count, data)
+        for ts, value in zip(timestamps, values):
+            if start <= ts < end:
+                yield key, ts, value
+
+
+def read_chunks(db, host_id, category, since, until=None):
+    """Échantillons compactés d'un hôte / d'une catégorie : [(nom, ts, valeur)] triés."""
+    mark = compaction_mark(db)
+    if mark is None or since >= mark:
+        return []
+    q = (db.session.query(MetricSeries.name, MetricChunk.ts, MetricChunk.count, MetricChunk.data)
+         .join(MetricChunk, MetricChunk.series_id == MetricSeries.id)
+         .filter(MetricSeries.host_id == host_id, MetricSeries.category == category)
+         .filter(MetricChunk.ts >= _hour(since)))
+    if until is not None:
+        q = q.filter(MetricChunk.ts < until)
+    rows = [(name, EPOCH + timedelta(seconds=ts), value) for name, ts, value in _decode_rows(q.all(), since, until)]
+    rows.sort(key=lambda r: r[1])
+    return rows
+
+
+def read_chunk_logs(db, since, host_id=None, group_id=None, category=None):
+    """Lignes de log compactées [(ts, host, catégorie, nom, valeur)] (export des logs)."""
+    mark = compaction_mark(db)
+    if mark is None or since >= mark:
+        return []
+    q = (db.session.query(MetricChunk.series_id, MetricChunk.ts, MetricChunk.count, MetricChunk.data)
+         .join(MetricSeries, MetricSeries.id == MetricChunk.series_id)
+         .join(Host, Host.id == MetricSeries.host_id)
+         .filter(MetricChunk.ts >= _hour(since)))
+    if host_id:
+        q = q.filter(MetricSeries.host_id == host_id)
+    if group_id:
+        q = q.filter(Host.group_id == group_id)
+    if category:
+        q = q.filter(MetricSeries.category == category)
+    chunks = q.all()
+    if not chunks:
+        return []
+    series = {
+        sid: (host, cat, name) for sid, host, cat, name in
+        db.session.query(MetricSeries.id, Host, MetricSeries.category, MetricSeries.name)
+        .join(Host, Host.id == MetricSeries.host_id)
+        .filter(MetricSeries.id.in_({c[0] for c in chunks}))
+    }
+    return [
+        (EPOCH + timedelta(seconds=ts), *series[sid], value)
+        for sid, ts, value in _decode_rows(chunks, since, None)
+    ]
@@ -1,9 +1,14 @@
 import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
 from models import CurrentMetric, Measurement, Alert, User
 from database import db
 import logging
@@ -74,12 +79,115 @@ def send_alert_email(subject: str, body: str, to: list[str] | None = None) -> bo
         return False
 
 
+# ==============================================================
+# 🔹 UNITÉ DE TRAVAIL (une transaction par poll d'hôte)
+# ==============================================================
+_uow_state = threading.local()
+
+
+def in_unit_of_work() -> bool:
+    """Indique si une unité de travail est ouverte dans le thread courant."""
+    return getattr(_uow_state, "active", False)
+
+
+@contextmanager
+def unit_of_work(db):
+    """
+    Regroupe toutes les écritures (métriques, alertes, statut) d'un bloc en une
+    seule transaction, validée une seule fois à la sortie du bloc.
+    - Les fonctions de ce module font un simple flush au lieu d'un commit.
+    - Les e-mails sont mis en attente et envoyés uniquement après le commit.
+    - En cas d'erreur, tout est annulé (rollback) et aucun e-mail n'est envoyé.
+    """
+    if in_unit_of_work():
+        # Imbrication : la transaction englobante reste maîtresse du commit
+        yield
+        return
+
+    _uow_state.active = True
+    _uow_state.emails = []
+    try:
+        yield
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        emails = _uow_state.emails
+        _uow_state.active = False
+        _uow_state.emails = []
+    for subject, body in emails:
+        send_alert_email(subject, body)
+
+
+# ==============================================================
+# 🔹 ÉTAT EN MÉMOIRE APPLIQUÉ AU COMMIT
+# ==============================================================
+# Les caches qui reflètent ce qui est en base (tampons récents, deadband)
+# ne sont mis à jour qu'une fois la transaction validée : après un rollback,
+# ils ne doivent pas croire stockées des lignes annulées.
+def after_commit(db, callback):
+    """
+    Exécute `callback()` après le commit de la transaction en cours, ou tout
+    de suite si aucune n'est ouverte. Abandonné si la transaction est annulée.
+    """
+    session = db.session()
+    if not session.in_transaction():
+        callback()
+        return
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    if session.in_nested_transaction():
+        return  # simple savepoint libéré (begin_nested) : la transaction continue
+    for callback in session.info.pop("after_commit", []):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"[db] ⚠️ Mise à jour post-commit échouée : {e}")
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_after_commit(session, transaction):
+    # Fin de la transaction racine sans commit (rollback) : rien à appliquer
+    if transaction.parent is None:
+        session.info.pop("after_commit", None)
+
+
+def commit_or_flush(db):
+    """Commit immédiat, ou simple flush si une unité de travail est ouverte."""
+    if in_unit_of_work():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def _rollback(db):
+    """Rollback local hors unité de travail ; sinon l'erreur remonte à l'unité de travail."""
+    if in_unit_of_work():
+        raise
+    db.session.rollback()
+
+
+def _notify(subject: str, body: str):
+    """Envoie le mail tout de suite, ou le diffère jusqu'au commit de l'unité de travail."""
+    if in_unit_of_work():
+        _uow_state.emails.append((subject, body))
+    else:
+        send_alert_email(subject, body)
+
+
 def upsert_current_metric(db, host_id, oid, metric, value, meta=None):
     """Insère ou met à jour la dernière valeur connue d'une métrique pour un host."""
     if isinstance(meta, (dict, list)):
         meta = json.dumps(meta, ensure_ascii=False)
     if isinstance(value, (dict, list)):
         value = json.dumps(value, ensure_ascii=False)
+    elif value is not None and not isinstance(value, str):
+        # Valeurs SNMP natives (int...) : mises en texte seulement ici
+        value = str(value)
 
     existing = CurrentMetric.query.filter_by(host_id=host_id, oid=oid).first()
     if existing:
@@ -95,7 +203,7 @@ def upsert_current_metric(db, host_id, oid, metric, value, meta=None):
             value=value,
             meta=meta
         ))
-    db.session.commit()
+    commit_or_flush(db)
 
 
 def open_alert(db, Alert, host_id, severity, message, cooldown_minutes=10):
@@ -141,7 +249,7 @@ def open_alert(db, Alert, host_id, severity, message, cooldown_minutes=10):
             # mettre à jour le timestamp pour refléter le changement
             existing_unresolved.created_at = now
             db.session.add(existing_unresolved)
-            db.session.commit()
+            commit_or_flush(db)
             logger.info(f"[alerte] Mise à jour alerte {old_sev} -> {severity} pour host {host_id}: {message}")
             # Si on monte en CRITICAL et que l'envoi est autorisé, on envoie un mail
             if send_email and severity == "critical":
@@ -152,14 +260,14 @@ def open_alert(db, Alert, host_id, severity, message, cooldown_minutes=10):
                     f"Gravité : {severity.upper()}\n"
                     f"Détails : {message}\n"
                 )
-                send_alert_email(subject, body)
+                _notify(subject, body)
             # Mettre à jour le statut de l'hôte si nécessaire (sauf si déjà DOWN)
             try:
                 if host and getattr(host, 'status', None) != 'down' and severity in ('warning', 'critical'):
                     host.status = 'warning'
                     host.last_status_change = now
                     db.session.add(host)
-                    db.session.commit()
+                    commit_or_flush(db)
             except Exception:
                 logger.exception("Erreur lors de la mise à jour du statut d'hôte après mise à jour d'alerte")
             return existing_unresolved
@@ -186,14 +294,14 @@ def open_alert(db, Alert, host_id, severity, message, cooldown_minutes=10):
             last_similar.created_at = now
             last_similar.resolved_at = None
             db.session.add(last_similar)
-            db.session.commit()
+            commit_or_flush(db)
             # Mettre à jour le statut de l'hôte si nécessaire (sauf si déjà DOWN)
             try:
                 if host and getattr(host, 'status', None) != 'down' and severity in ('warning', 'critical'):
                     host.status = 'warning'
                     host.last_status_change = now
                     db.session.add(host)
-                    db.session.commit()
+                    commit_or_flush(db)
             except Exception:
                 logger.exception("Erreur lors de la mise à jour du statut d'hôte après réouverture d'alerte")
             return last_similar
@@ -209,7 +317,7 @@ def open_alert(db, Alert, host_id, severity, message, cooldown_minutes=10):
         created_at=now
     )
     db.session.add(alert)
-    db.session.commit()
+    commit_or_flush(db)
 
     print(f"[alerte] 🔔 Nouvelle alerte {severity.upper()} sur {hostname} ({host_ip}) : {message}")
 
@@ -222,7 +330,7 @@ def open_alert(db, Alert, host_id, severity, message, cooldown_minutes=10):
             f"Gravité : {severity.upper()}\n"
             f"Détails : {message}\n"
         )
-        send_alert_email(subject, body)
+        _notify(subject, body)
 
     # Mettre à jour le statut d'hôte : si l'hôte n'est pas DOWN, le passer en WARNING
     try:
@@ -230,7 +338,7 @@ def open_alert(db, Alert, host_id, severity, message, cooldown_minutes=10):
             host.status = 'warning'
             host.last_status_change = now
             db.session.add(host)
-            db.session.commit()
+            commit_or_flush(db)
     except Exception:
         logger.exception("Erreur lors de la mise à jour du statut d'hôte après création d'alerte")
 
@@ -300,10 +408,10 @@ def resolve_alert(db, Alert, host_id, category=None, message_contains=None, min_
         db.session.add(a)
         resolved_ids.append(a.id)
     try:
-        db.session.commit()
+        commit_or_flush(db)
     except Exception:
         logger.exception("Erreur commit lors de la résolution d'alertes")
-        db.session.rollback()
+        _rollback(db)
         return
 
     logger.info(f"[alerte] Résolution d'alertes pour host {host_id} : ids={resolved_ids}")
@@ -322,7 +430,7 @@ def resolve_alert(db, Alert, host_id, category=None, message_contains=None, min_
             f"{details}\n\n"
             f"Rétablissement : {resolved_time} UTC"
         )
-        send_alert_email(subject, body)
+        _notify(subject, body)
 
     # Si aucune alerte non résolue ne reste pour cet hôte, remettre le statut à 'up'
     try:
@@ -331,7 +439,7 @@ def resolve_alert(db, Alert, host_id, category=None, message_contains=None, min_
             host.status = 'up'
             host.last_status_change = resolved_time
             db.session.add(host)
-            db.session.commit()
+            commit_or_flush(db)
     except Exception:
         logger.exception("Erreur lors de la remise à jour du statut d'hôte après résolution d'alertes")
 
@@ -371,10 +479,10 @@ def resolve_snmp_alerts(db, Alert, host_id, min_age_seconds=0, force=False):
         resolved_ids.append(a.id)
 
     try:
-        db.session.commit()
+        commit_or_flush(db)
     except Exception:
         logger.exception("Erreur commit lors de la résolution d'alertes SNMP")
-        db.session.rollback()
+        _rollback(db)
         return
 
     logger.info(f"[alerte] Résolution SNMP pour host {host_id} : ids={resolved_ids}")
@@ -389,7 +497,7 @@ def resolve_snmp_alerts(db, Alert, host_id, min_age_seconds=0, force=False):
             f"{details}\n\n"
             f"Rétablissement : {resolved_time} UTC"
         )
-        send_alert_email(subject, body)
+        _notify(subject, body)
 
     # Remise à 'up' si aucune alerte non résolue ne reste
     try:
@@ -398,6 +506,6 @@ def resolve_snmp_alerts(db, Alert, host_id, min_age_seconds=0, force=False):
             host.status = 'up'
             host.last_status_change = resolved_time
             db.session.add(host)
-            db.session.commit()
+            commit_or_flush(db)
     except Exception:
         logger.exception("Erreur lors de la remise à jour du statut d'hôte après résolution d'alertes SNMP")
\ No newline at end of file
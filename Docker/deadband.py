@@ -0,0 +1,137 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Stockage sur changement (deadband) par catégorie
+# ─────────────────────────────────────────────
+# Avant écriture (series_store.add_samples), chaque échantillon est comparé
+# au dernier échantillon *stocké* de sa série :
+#   - texte (sysDescr, état d'interface…) : stocké seulement s'il a changé ;
+#   - numérique : selon deadband_pct de la catégorie (None = toujours,
+#     0 = sur changement, X = écart relatif de plus de X %) ;
+#   - dans tous les cas, un battement de cœur tous les `heartbeat` secondes.
+# Les lecteurs reconstruisent une série en escalier (fill_steps) : la valeur
+# stockée reste valable jusqu'au point suivant.
+DEADBAND_ENABLED = os.getenv("DEADBAND_ENABLED", "1") == "1"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class StoragePolicy(NamedTuple):
+    deadband_pct: Optional[float]   # None : chaque échantillon numérique est stocké
+    heartbeat: int                  # secondes max sans point stocké
+
+
+STORAGE_POLICIES = {
+    "system": StoragePolicy(0, 3600),
+    "cpu": StoragePolicy(None, 900),
+    "ram": StoragePolicy(1.0, 900),
+    "storage": StoragePolicy(0.5, 900),
+    # Compteurs / débits : tous les points ; l'état (texte) sur changement
+    "interfaces": StoragePolicy(None, 900),
+}
+DEFAULT_POLICY = StoragePolicy(None, 900)
+
+
+def policy_for(category):
+    return STORAGE_POLICIES.get(category, DEFAULT_POLICY)
+
+
+def step_lookback(category):
+    """Secondes à relire avant une fenêtre pour en connaître la valeur initiale (0 : inutile)."""
+    policy = policy_for(category)
+    if not DEADBAND_ENABLED or policy.deadband_pct is None:
+        return 0
+    # Un battement tombe au premier poll après l'échéance : marge d'un battement
+    return 2 * policy.heartbeat
+
+
+class DeadbandFilter:
+    """Dernier échantillon stocké par (hôte, catégorie, nom) : décide des écritures."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = {}   # (hôte, catégorie, nom) → (ts epoch, valeur)
+
+    @staticmethod
+    def _changed(policy, previous, value, number):
+        if number is None or not isinstance(previous, float):
+            return str(value) != str(previous)
+        if policy.deadband_pct is None:
+            return True
+        if previous == 0:
+            return number != 0
+        return abs(number - previous) > abs(previous) * policy.deadband_pct / 100
+
+    def keep(self, host_id, category, ts, samples, to_number):
+        """
+        Échantillons [(nom, valeur)] à stocker parmi ceux d'un même horodatage.
+        Ne modifie pas l'état : l'appelant appelle record() une fois l'écriture
+        validée (après un rollback, le dernier échantillon stocké est inchangé).
+        """
+        policy = policy_for(category)
+        stamp = (ts - EPOCH).total_seconds()
+        kept = []
+        with self._lock:
+            for name, value in samples:
+                last = self._last.get((host_id, category, name))
+                if (last is not None and stamp - last[0] < policy.heartbeat
+                        and not self._changed(policy, last[1], value, to_number(value))):
+                    continue
+                kept.append((name, value))
+        return kept
+
+    def record(self, host_id, category, ts, samples, to_number):
+        """Enregistre les échantillons [(nom, valeur)] effectivement stockés."""
+        stamp = (ts - EPOCH).total_seconds()
+        with self._lock:
+            for name, value in samples:
+                number = to_number(value)
+                self._last[(host_id, category, name)] = (stamp, number if number is not None else value)
+
+    def forget_host(self, host_id):
+        with self._lock:
+            for key in [k for k in self._last if k[0] == host_id]:
+                del self._last[key]
+
+
+DEADBAND = DeadbandFilter()
+
+
+def fill_steps(rows, since, until, lookback):
+    """
+    Série en escalier de `since` à `until` depuis des lignes [(nom, ts, valeur)]
+    triées, lues à partir de since - lookback :
+      - la dernière valeur avant `since` ouvre la fenêtre ;
+      - un point (ts, valeur précédente) précède chaque changement ;
+      - la dernière valeur est prolongée jusqu'à `until` (au plus `lookback` secondes).
+    """
+    previous, seen, out = {}, set(), []
+    for name, ts, value in rows:
+        if ts < since:
+            previous[name] = (ts, value)
+            continue
+        if name in previous:
+            prev = previous[name][1]
+            if name not in seen and ts > since:
+                out.append((name, since, prev))
+            if prev != value:
+                out.append((name, ts, prev))
+        seen.add(name)
+        previous[name] = (ts, value)
+        out.append((name, ts, value))
+
+    horizon = timedelta(seconds=lookback)
+    for name, (ts, value) in previous.items():
+        if until - ts > horizon:
+            continue  # plus de battement de cœur : la série s'est arrêtée
+        if name not in seen:
+            out.append((name, since, value))
+        if ts < until:
+            out.append((name, until, value))
+    out.sort(key=lambda r: r[1])
+    return out
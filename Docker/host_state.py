@@ -0,0 +1,245 @@
+import threading
+import time
+from datetime import datetime
+from models import HostStateSnapshot
+import logging
+logger = logging.getLogger(__name__)
+
+# Intervalle minimal entre deux sauvegardes du registre en base (secondes)
+SNAPSHOT_INTERVAL = 60
+
+
+# ==============================================================
+# 🔹 ÉTAT COMPACT D'UN HÔTE
+# ==============================================================
+class HostState:
+    """Dernier état connu d'un hôte côté poller (enregistrement compact)."""
+    __slots__ = ("status", "last_poll", "last_latency", "consecutive_failures", "last_snmp_ok",
+                 "backoff", "probe_at", "interval", "next_due", "changed_at")
+
+    def __init__(self, status="unknown", last_poll=None, last_latency=None,
+                 consecutive_failures=0, last_snmp_ok=None):
+        self.status = status
+        self.last_poll = last_poll                      # datetime UTC du dernier poll
+        self.last_latency = last_latency                # durée de collecte SNMP (ms)
+        self.consecutive_failures = consecutive_failures
+        self.last_snmp_ok = last_snmp_ok                # datetime UTC du dernier SNMP OK
+        # Disjoncteur SNMP (non persisté) : délai courant et prochaine sonde (time.monotonic)
+        self.backoff = 0
+        self.probe_at = None
+        # Fréquence adaptative (non persistée) : intervalle courant (s), prochaine
+        # échéance et dernier changement de statut observé (time.monotonic)
+        self.interval = None
+        self.next_due = None
+        self.changed_at = None
+
+    @property
+    def due(self):
+        return self.next_due is None or time.monotonic() >= self.next_due
+
+    @property
+    def breaker_open(self):
+        return self.probe_at is not None
+
+
+# ==============================================================
+# 🔹 REGISTRE PARTAGÉ DES ÉTATS
+# ==============================================================
+class HostStateRegistry:
+    """
+    Registre en mémoire des états d'hôtes, sauvegardé périodiquement dans la
+    table `host_state` et rechargé au démarrage. Les workers web lisent la table
+    (voir `load_status_map`) : l'état reste visible hors du process du poller.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._dirty = set()
+        self._removed = set()
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def __contains__(self, host_id):
+        return host_id in self._states
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, host_id):
+        return self._states.get(host_id)
+
+    def ids(self):
+        return list(self._states.keys())
+
+    def ensure(self, host_id, status="unknown"):
+        """Retourne l'état de l'hôte, en le créant avec `status` s'il est inconnu."""
+        with self._lock:
+            state = self._states.get(host_id)
+            if state is None:
+                state = HostState(status=status)
+                self._states[host_id] = state
+                self._dirty.add(host_id)
+            return state
+
+    def record_poll(self, host_id, status, snmp_ok, latency_ms=None, when=None):
+        """Met à jour l'état après un poll d'hôte."""
+        when = when or datetime.utcnow()
+        with self._lock:
+            state = self._states.get(host_id) or HostState()
+            if state.status != status:
+                state.changed_at = time.monotonic()
+            state.status = status
+            state.last_poll = when
+            state.last_latency = latency_ms
+            if snmp_ok:
+                state.consecutive_failures = 0
+                state.last_snmp_ok = when
+            else:
+                state.consecutive_failures += 1
+            self._states[host_id] = state
+            self._dirty.add(host_id)
+
+    def set_status(self, host_id, status):
+        with self._lock:
+            state = self._states.get(host_id) or HostState()
+            if state.status != status:
+                state.changed_at = time.monotonic()
+            state.status = status
+            self._states[host_id] = state
+            self._dirty.add(host_id)
+
+    def trip_breaker(self, host_id, base, maximum):
+        """Ouvre (ou prolonge) le disjoncteur : backoff exponentiel jusqu'à `maximum` secondes."""
+        with self._lock:
+            state = self._states.get(host_id)
+            if state is None:
+                return None
+            state.backoff = base if not state.backoff else min(state.backoff * 2, maximum)
+            state.probe_at = time.monotonic() + state.backoff
+            return state.backoff
+
+    def reset_breaker(self, host_id):
+        with self._lock:
+            state = self._states.get(host_id)
+            if state is not None:
+                state.backoff = 0
+                state.probe_at = None
+
+    def schedule(self, host_id, interval):
+        """Fixe l'intervalle de poll de l'hôte et sa prochaine échéance."""
+        with self._lock:
+            state = self._states.get(host_id)
+            if state is not None:
+                state.interval = interval
+                state.next_due = time.monotonic() + interval
+
+    def mark_due(self, host_id):
+        """Rend l'hôte immédiatement éligible au prochain cycle."""
+        with self._lock:
+            state = self._states.get(host_id)
+            if state is not None:
+                state.next_due = None
+
+    def remove(self, host_id):
+        with self._lock:
+            self._states.pop(host_id, None)
+            self._dirty.discard(host_id)
+            self._removed.add(host_id)
+
+    def states(self):
+        """Copie {host_id: HostState} (pour le snapshot binaire du poller)."""
+        with self._lock:
+            return dict(self._states)
+
+    def restore(self, records):
+        """
+        Réinjecte des états issus du snapshot binaire :
+        {host_id: (status, last_poll, last_latency, consecutive_failures, last_snmp_ok)}.
+        Ces états sont plus récents que la table host_state et la remplacent.
+        """
+        with self._lock:
+            for host_id, (status, last_poll, latency, failures, last_ok) in records.items():
+                self._states[host_id] = HostState(status, last_poll, latency, failures, last_ok)
+                self._dirty.add(host_id)
+
+    def statuses(self):
+        """Vue {host_id: status} (remplace l'ancien HOST_STATUS_CACHE)."""
+        return {host_id: s.status for host_id, s in self._states.items()}
+
+    # ----------------------------------------------------------
+    # Persistance (table host_state)
+    # ----------------------------------------------------------
+    def load_from_db(self, db):
+        """Recharge le registre depuis la table host_state (au démarrage)."""
+        try:
+            rows = db.session.query(HostStateSnapshot).all()
+        except Exception as e:
+            logger.warning(f"[host_state] ⚠️ Lecture host_state impossible : {e}")
+            return 0
+
+        with self._lock:
+            for r in rows:
+                self._states[r.host_id] = HostState(
+                    status=r.status or "unknown",
+                    last_poll=r.last_poll,
+                    last_latency=r.last_latency,
+                    consecutive_failures=r.consecutive_failures or 0,
+                    last_snmp_ok=r.last_snmp_ok,
+                )
+            self._dirty.clear()
+        return len(rows)
+
+    def flush_to_db(self, db, force=False):
+        """
+        Sauvegarde les états modifiés dans host_state, au plus une fois toutes
+        les SNAPSHOT_INTERVAL secondes (sauf `force=True`).
+        """
+        now = time.monotonic()
+        if not force and now - self._last_flush < SNAPSHOT_INTERVAL:
+            return 0
+
+        with self._lock:
+            dirty = {host_id: self._states[host_id] for host_id in self._dirty if host_id in self._states}
+            removed = set(self._removed)
+            self._dirty.clear()
+            self._removed.clear()
+        self._last_flush = now
+
+        if not dirty and not removed:
+            return 0
+
+        try:
+            if removed:
+                db.session.query(HostStateSnapshot).filter(
+                    HostStateSnapshot.host_id.in_(removed)
+                ).delete(synchronize_session=False)
+            stamp = datetime.utcnow()
+            for host_id, s in dirty.items():
+                db.session.merge(HostStateSnapshot(
+                    host_id=host_id,
+                    status=s.status,
+                    last_poll=s.last_poll,
+                    last_latency=s.last_latency,
+                    consecutive_failures=s.consecutive_failures,
+                    last_snmp_ok=s.last_snmp_ok,
+                    updated_at=stamp,
+                ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"[host_state] ⚠️ Sauvegarde host_state échouée : {e}")
+            # Réessayer au prochain passage
+            with self._lock:
+                self._dirty.update(h for h in dirty if h in self._states)
+                self._removed.update(removed)
+            return 0
+        return len(dirty)
+
+
+def load_status_map(db):
+    """Lecture {host_id: status} depuis host_state, pour les workers web."""
+    try:
+        rows = db.session.query(HostStateSnapshot.host_id, HostStateSnapshot.status).all()
+        return {host_id: status for host_id, status in rows}
+    except Exception:
+        return {}
@@ -0,0 +1,186 @@
+import json
+from typing import NamedTuple, Optional
+from datetime import datetime
+from models import Host, Group, Template
+from snmp_utils import resolve_credentials
+import logging
+logger = logging.getLogger(__name__)
+
+
+def normalize_categories(raw):
+    """Normalize snmp_categories stored as list or JSON string."""
+    if raw is None:
+        return []
+    if isinstance(raw, (list, tuple)):
+        return list(raw)
+    if isinstance(raw, str):
+        try:
+            parsed = json.loads(raw)
+            if isinstance(parsed, (list, tuple)):
+                return list(parsed)
+        except Exception:
+            return [c.strip() for c in raw.split(",") if c.strip()]
+    return []
+
+
+# ==============================================================
+# 🔹 SPÉCIFICATION DE POLL (immuable)
+# ==============================================================
+class PollSpec(NamedTuple):
+    """
+    Tout ce dont le poller a besoin pour interroger un hôte, sans objet ORM.
+    Les attributs reprennent les noms de `Host` : une PollSpec peut être passée
+    aux fonctions qui attendent un hôte (check_thresholds, check_host_reachability...).
+    `thresholds` est partagé : ne pas le modifier.
+    """
+    id: int
+    hostname: str
+    ip: str
+    port: int
+    snmp_community: Optional[str]
+    snmp_version: Optional[str]
+    snmp_v3: Optional[dict]
+    snmp_categories: tuple
+    thresholds: dict
+    device_type: Optional[str]
+    template_id: Optional[int]
+    parent_id: Optional[int]
+    status: Optional[str]
+    last_status_change: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    def config(self):
+        """Champs de configuration (hors statut, modifié par le poller lui-même)."""
+        return self._replace(status=None, last_status_change=None, updated_at=None)
+
+
+# ==============================================================
+# 🔹 INVENTAIRE INCRÉMENTAL
+# ==============================================================
+class HostInventory:
+    """
+    Inventaire en mémoire des hôtes à interroger. Chaque refresh ne relit que les
+    lignes modifiées depuis le dernier filigrane `hosts.updated_at` (plus la liste
+    des ids pour détecter les suppressions) au lieu de recharger tous les Host.
+
+    Note : renommer un groupe ne modifie pas `hosts.updated_at` ; appeler
+    `invalidate()` pour forcer un rechargement complet.
+
+    Les paramètres des templates (peu nombreux) sont relus à chaque refresh.
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._watermark = None
+        self._template_params = {}
+        self._template_versions = {}
+        self._by_ip = {}
+
+    def __len__(self):
+        return len(self._specs)
+
+    def get(self, host_id):
+        return self._specs.get(host_id)
+
+    def specs(self):
+        return list(self._specs.values())
+
+    def by_ip(self, ip):
+        """Hôtes déclarés avec cette adresse (index mémoire, pour les traps)."""
+        return self._by_ip.get(ip, ())
+
+    def invalidate(self):
+        self._specs = {}
+        self._watermark = None
+        self._template_params = {}
+        self._template_versions = {}
+        self._by_ip = {}
+
+    def template_params(self, template_id):
+        """Paramètres JSON du template (dict vide si aucun)."""
+        return self._template_params.get(template_id) or {}
+
+    def credentials(self, spec):
+        """Identifiants SNMP effectifs (communauté v2c ou V3Credentials) de l'hôte."""
+        return resolve_credentials(
+            spec.snmp_community, spec.snmp_version, spec.snmp_v3,
+            self._template_versions.get(spec.template_id), self.template_params(spec.template_id),
+        )
+
+    def refresh(self, db):
+        """
+        Synchronise l'inventaire avec la base. Retourne (specs, changed, removed)
+        où changed/removed sont les ids ajoutés ou reconfigurés et supprimés
+        (une ligne relue pour un simple changement de statut n'est pas « changed »).
+        """
+        q = (
+            db.session.query(
+                Host.id, Host.hostname, Host.ip, Host.port, Host.snmp_community,
+                Host.snmp_version, Host.snmp_v3, Host.snmp_categories, Host.thresholds, Host.template_id, Host.parent_id,
+                Host.status, Host.last_status_change, Host.updated_at,
+                Group.name.label("group_name"),
+            )
+            .outerjoin(Group, Host.group_id == Group.id)
+        )
+        if self._watermark is not None:
+            # >= : les lignes modifiées dans la même seconde que le filigrane sont relues
+            q = q.filter(Host.updated_at >= self._watermark)
+
+        changed = []
+        for r in q.all():
+            spec = PollSpec(
+                id=r.id,
+                hostname=r.hostname,
+                ip=r.ip,
+                port=r.port,
+                snmp_community=r.snmp_community,
+                snmp_version=r.snmp_version,
+                snmp_v3=r.snmp_v3 if isinstance(r.snmp_v3, dict) else None,
+                snmp_categories=tuple(normalize_categories(r.snmp_categories)),
+                thresholds=r.thresholds if isinstance(r.thresholds, dict) else {},
+                device_type=r.group_name,
+                template_id=r.template_id,
+                parent_id=r.parent_id,
+                status=r.status,
+                last_status_change=r.last_status_change,
+                updated_at=r.updated_at,
+            )
+            previous = self._specs.get(r.id)
+            if previous is None or previous.config() != spec.config():
+                changed.append(r.id)
+            self._specs[r.id] = spec
+            if r.updated_at and (self._watermark is None or r.updated_at > self._watermark):
+                self._watermark = r.updated_at
+
+        self._template_params = {}
+        self._template_versions = {}
+        for template_id, version, params in db.session.query(Template.id, Template.snmp_version, Template.params).all():
+            self._template_params[template_id] = params if isinstance(params, dict) else {}
+            self._template_versions[template_id] = version
+
+        # Détection des suppressions : simple parcours de la clé primaire
+        removed = []
+        if self._specs:
+            current_ids = {host_id for (host_id,) in db.session.query(Host.id).all()}
+            for host_id in list(self._specs.keys()):
+                if host_id not in current_ids:
+                    self._specs.pop(host_id, None)
+                    removed.append(host_id)
+
+        if changed or removed or not self._by_ip:
+            # Remplacé d'un bloc : lu sans verrou par le récepteur de traps
+            by_ip = {}
+            for spec in self._specs.values():
+                by_ip.setdefault(spec.ip, []).append(spec)
+            self._by_ip = {ip: tuple(specs) for ip, specs in by_ip.items()}
+
+        return self.specs(), changed, removed
+
+
+def credentials_for(host):
+    """Identifiants SNMP effectifs d'un objet Host (routes web)."""
+    template = host.template
+    return resolve_credentials(
+        host.snmp_community, host.snmp_version, host.snmp_v3,
+        template.snmp_version if template else None, template.params if template else None,
+    )
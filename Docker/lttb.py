@@ -0,0 +1,62 @@
+from datetime import datetime
+import numpy as np
+
+# ─────────────────────────────────────────────
+# 🔹 Réduction des séries pour les graphes (LTTB)
+# ─────────────────────────────────────────────
+# Largest-Triangle-Three-Buckets : garde le premier et le dernier point, puis
+# dans chaque intervalle le point qui forme le plus grand triangle avec le
+# point retenu précédemment et la moyenne de l'intervalle suivant. Les pics
+# et creux survivent, contrairement à une moyenne par intervalle.
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def lttb_indices(x, y, max_points):
+    """Indices des points retenus (x croissants, tableaux NumPy float64)."""
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    # max_points - 2 intervalles sur les points intérieurs [1, n - 1)
+    bounds = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    starts, ends = bounds[:-1], bounds[1:]
+    counts = ends - starts
+    mean_x = np.add.reduceat(x[1:n - 1], starts - 1) / counts
+    mean_y = np.add.reduceat(y[1:n - 1], starts - 1) / counts
+    # Troisième sommet : moyenne de l'intervalle suivant (dernier point pour le dernier)
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    kept = np.empty(max_points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(len(starts)):
+        s, e = starts[i], ends[i]
+        ax, ay = x[a], y[a]
+        # Double de l'aire des triangles (a, candidat, moyenne suivante), vectorisé
+        area = np.abs((ax - next_x[i]) * (y[s:e] - ay) - (ax - x[s:e]) * (next_y[i] - ay))
+        a = s + int(area.argmax())
+        kept[i + 1] = a
+    return kept
+
+
+def lttb_rows(rows, max_points):
+    """
+    Réduit des lignes [(nom, ts, valeur)] triées par ts à au plus `max_points`
+    points par série ; retourne des lignes triées par ts.
+    """
+    by_name = {}
+    for row in rows:
+        by_name.setdefault(row[0], []).append(row)
+
+    out = []
+    for series in by_name.values():
+        if len(series) <= max_points:
+            out.extend(series)
+            continue
+        x = np.fromiter(((ts - EPOCH).total_seconds() for _, ts, _ in series), np.float64, len(series))
+        y = np.fromiter((value for _, _, value in series), np.float64, len(series))
+        out.extend(series[i] for i in lttb_indices(x, y, max_points))
+    out.sort(key=lambda r: r[1])
+    return out
@@ -0,0 +1,93 @@
+from typing import NamedTuple
+from db_utils import upsert_current_metric
+from seuils import check_thresholds
+from models import Measurement
+from series_store import add_samples
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Normalisation d'un résultat de catégorie
+# ─────────────────────────────────────────────
+# Le poller et api_poll persistent la sortie de collect_metrics / get_metrics
+# par ce seul chemin : normalize() la transforme une fois en
+#   - échantillons [(nom, valeur)] → series_store (texte → measurements) ;
+#   - valeurs courantes [(oid, valeur)] → current_metrics ;
+#   - entrées de seuils [(clé, valeur)] → check_thresholds ;
+# puis persist() les écrit, chaque échantillon une seule fois.
+#
+# Interfaces : seuls les débits (`<iface>.in_mbps` / `.out_mbps`, calculés
+# depuis COUNTER_CACHE dans snmp_registry) et l'état (`<iface>.state`) sont
+# stockés ; les compteurs bruts restent en mémoire. Les anciennes séries de
+# compteurs `<iface>.in` / `.out` sont converties par la migration 009.
+INTERFACE_SAMPLE_KEYS = ("in_mbps", "out_mbps", "state")
+# Copies lisibles d'une autre clé (sysUpTime formaté) : valeur courante seulement
+DISPLAY_ONLY_KEYS = ("Uptime",)
+# Catégories dont chaque entrée {used, total, pct} alimente un seuil (sur pct)
+PCT_CATEGORIES = ("ram", "storage")
+
+
+class Normalized(NamedTuple):
+    samples: list      # [(nom de série, valeur)]
+    labels: dict       # nom de série → libellé (colonne metric des mesures texte)
+    current: list      # [(oid, valeur)]
+    thresholds: list   # [(clé, valeur numérique)]
+
+
+def normalize(category, data):
+    """Résultat brut d'une catégorie ({clé: valeur ou dict}) → Normalized."""
+    samples, labels, current, thresholds = [], {}, [], []
+    for key, val in (data.items() if isinstance(data, dict) else []):
+        current.append((key, val))
+
+        if category == "interfaces" and isinstance(val, dict):
+            for sub_key in INTERFACE_SAMPLE_KEYS:
+                if val.get(sub_key) is not None:
+                    samples.append((f"{key}.{sub_key}", val[sub_key]))
+                    labels[f"{key}.{sub_key}"] = key
+            continue
+
+        if isinstance(val, dict):
+            for sub_key, sub_val in val.items():
+                samples.append((f"{key}.{sub_key}", sub_val))
+                labels[f"{key}.{sub_key}"] = sub_key
+            if category in PCT_CATEGORIES and "pct" in val:
+                thresholds.append((key, val["pct"]))
+            continue
+
+        if key in DISPLAY_ONLY_KEYS or category in PCT_CATEGORIES:
+            # Copies d'affichage : Uptime lisible, clés `<montage>.pct` des dicts ci-dessus
+            continue
+        samples.append((key, val))
+        if category == "cpu":
+            thresholds.append((key, val))
+    return Normalized(samples, labels, current, thresholds)
+
+
+def persist(db, host, category, normalized, ts, Alert, warn=logger.warning):
+    """
+    Écrit une catégorie normalisée : valeurs courantes, seuils, puis
+    échantillons (numériques en un INSERT, texte en lignes measurements).
+    Une erreur sur une valeur courante ou un seuil est signalée via `warn`
+    sans interrompre le reste.
+    """
+    for oid, val in normalized.current:
+        try:
+            upsert_current_metric(db, host.id, oid, oid, val, meta=category)
+        except Exception as e:
+            warn(f"{host.hostname} ({category}/{oid}) erreur : {e}")
+    for key, val in normalized.thresholds:
+        try:
+            check_thresholds(db, host, category, key, val, Alert)
+        except Exception as e:
+            warn(f"{host.hostname} ({category}/{key}) seuil : {e}")
+
+    for name, val in add_samples(db, host.id, category, normalized.samples, ts=ts):
+        db.session.add(Measurement(
+            host_id=host.id,
+            oid=name,
+            metric=normalized.labels.get(name, name),
+            value=str(val),
+            category=category,
+            ts=ts
+        ))
@@ -0,0 +1,263 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Stockage de séries en colonnes mappées en mémoire
+# ─────────────────────────────────────────────
+# Backend alternatif à metric_samples (SERIES_BACKEND=mmap). Un fichier par
+# série et par jour UTC : <racine>/<host_id>/<catégorie>/<nom>/<AAAAMMJJ>.seg
+#
+#   [en-tête 64 o : magic, version, capacité, nombre, premier ts, dernier ts]
+#   [colonne ts    : capacité × float64 (epoch secondes)]
+#   [colonne value : capacité × float64]
+#
+# Les ts d'un segment sont croissants : une lecture de plage est un
+# searchsorted suivi d'une tranche, c.-à-d. une vue NumPy sur le mmap, sans
+# copie. Un segment plein est agrandi en doublant sa capacité.
+SERIES_DATA_DIR = os.getenv("SERIES_DATA_DIR", "/app/data/series")
+SEGMENT_INITIAL_CAPACITY = int(os.getenv("SEGMENT_INITIAL_CAPACITY", "1024"))
+# Segments ouverts en écriture gardés en cache (un descripteur de fichier chacun)
+SEGMENT_OPEN_MAX = int(os.getenv("SEGMENT_OPEN_MAX", "2048"))
+
+MAGIC = 0x53454731  # "SEG1"
+HEADER = np.dtype([
+    ("magic", "<u4"), ("version", "<u4"), ("capacity", "<i8"), ("count", "<i8"),
+    ("first", "<f8"), ("last", "<f8"), ("reserved", "<u1", (24,)),
+])
+HEADER_SIZE = HEADER.itemsize  # 64
+DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch(ts):
+    return (ts - EPOCH).total_seconds()
+
+
+class Segment:
+    """Un fichier segment mappé : en-tête + colonnes ts / value (vues NumPy)."""
+    __slots__ = ("path", "mm", "header", "ts", "values")
+
+    def __init__(self, path, mode="r+"):
+        self.path = path
+        self.mm = np.memmap(path, dtype=np.uint8, mode=mode)
+        self.header = self.mm[:HEADER_SIZE].view(HEADER)
+        if int(self.header["magic"][0]) != MAGIC:
+            raise ValueError(f"segment invalide : {path}")
+        capacity = int(self.header["capacity"][0])
+        body = HEADER_SIZE + capacity * 8
+        self.ts = self.mm[HEADER_SIZE:body].view("<f8")
+        self.values = self.mm[body:body + capacity * 8].view("<f8")
+
+    @classmethod
+    def create(cls, path, capacity):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = np.zeros(1, dtype=HEADER)
+        header["magic"], header["version"], header["capacity"] = MAGIC, 1, capacity
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header.tobytes())
+            f.truncate(HEADER_SIZE + capacity * 16)
+        os.replace(tmp, path)
+        return cls(path)
+
+    @property
+    def count(self):
+        return int(self.header["count"][0])
+
+    @property
+    def capacity(self):
+        return int(self.header["capacity"][0])
+
+    @property
+    def last(self):
+        return float(self.header["last"][0]) if self.count else None
+
+    def append(self, ts, value):
+        """Ajoute un point (ts croissant) ; retourne le segment (nouveau s'il a été agrandi)."""
+        segment = self if self.count < self.capacity else self._grow()
+        n = segment.count
+        segment.ts[n] = ts
+        segment.values[n] = value
+        if n == 0:
+            segment.header["first"] = ts
+        segment.header["last"] = ts
+        # Le nombre est publié en dernier : un lecteur ne voit jamais de point à moitié écrit
+        segment.header["count"] = n + 1
+        return segment
+
+    def _grow(self):
+        n = self.count
+        bigger = Segment.create(self.path + ".grow", self.capacity * 2)
+        bigger.ts[:n] = self.ts[:n]
+        bigger.values[:n] = self.values[:n]
+        bigger.header["first"], bigger.header["last"] = self.header["first"], self.header["last"]
+        bigger.header["count"] = n
+        bigger.flush()
+        self.close()
+        bigger.close()
+        os.replace(self.path + ".grow", self.path)
+        return Segment(self.path)
+
+    def window(self, start, end=None):
+        """Vues (ts, values) des points start <= ts < end, sans copie."""
+        n = self.count
+        ts = self.ts[:n]
+        lo = int(np.searchsorted(ts, start, side="left"))
+        hi = n if end is None else int(np.searchsorted(ts, end, side="left"))
+        return ts[lo:hi], self.values[lo:hi]
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        """Libère le mapping (fermé par NumPy quand plus aucune vue ne le référence)."""
+        if self.mm.mode != "r":
+            self.mm.flush()
+        self.mm = self.header = self.ts = self.values = None
+
+
+def downsample(ts, values, resolution):
+    """Moyennes par intervalle de `resolution` secondes (ts triés) : (débuts, moyennes)."""
+    if not len(ts):
+        return ts, values
+    buckets = (ts // resolution).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    return (buckets[starts] * resolution).astype(np.float64), np.add.reduceat(values, starts) / counts
+
+
+class MmapSeriesStore:
+    """Séries (hôte, catégorie, nom) en segments journaliers mappés en mémoire."""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._writers = OrderedDict()   # (hôte, catégorie, nom, jour) → Segment (LRU)
+
+    # ---- chemins ----
+    def _series_dir(self, host_id, category, name):
+        return os.path.join(self.root, str(host_id), category, quote(name, safe=""))
+
+    def _segment_path(self, host_id, category, name, day):
+        stamp = (EPOCH + timedelta(days=day)).strftime("%Y%m%d")
+        return os.path.join(self._series_dir(host_id, category, name), f"{stamp}.seg")
+
+    @staticmethod
+    def _day_of(filename):
+        return (datetime.strptime(filename[:8], "%Y%m%d") - EPOCH).days
+
+    def categories(self, host_id):
+        try:
+            return os.listdir(os.path.join(self.root, str(host_id)))
+        except FileNotFoundError:
+            return []
+
+    def names(self, host_id, category):
+        base = os.path.join(self.root, str(host_id), category)
+        try:
+            return [unquote(d) for d in os.listdir(base)]
+        except FileNotFoundError:
+            return []
+
+    # ---- écriture ----
+    def _writer(self, key):
+        segment = self._writers.get(key)
+        if segment is not None:
+            self._writers.move_to_end(key)
+            return segment
+        path = self._segment_path(*key)
+        segment = Segment(path) if os.path.exists(path) else Segment.create(path, SEGMENT_INITIAL_CAPACITY)
+        self._writers[key] = segment
+        while len(self._writers) > SEGMENT_OPEN_MAX:
+            _, old = self._writers.popitem(last=False)
+            old.close()
+        return segment
+
+    def append(self, host_id, category, ts, samples):
+        """Ajoute des points [(nom, valeur)] au même horodatage (datetime UTC naïf)."""
+        stamp = _epoch(ts)
+        day = int(stamp // DAY)
+        with self._lock:
+            for name, value in samples:
+                key = (host_id, category, name, day)
+                segment = self._writer(key)
+                last = segment.last
+                if last is not None and stamp <= last:
+                    continue  # doublon / point en retard
+                self._writers[key] = segment.append(stamp, value)
+
+    # ---- lecture ----
+    def _segments(self, host_id, category, name, first_day, last_day):
+        base = self._series_dir(host_id, category, name)
+        try:
+            files = sorted(os.listdir(base))
+        except FileNotFoundError:
+            return
+        for filename in files:
+            if not filename.endswith(".seg"):
+                continue
+            day = self._day_of(filename)
+            if first_day <= day <= last_day:
+                yield Segment(os.path.join(base, filename), mode="r")
+
+    def read(self, host_id, category, since, until=None):
+        """
+        {nom: (ts epoch, valeurs)} sur [since, until). Vues sur le mmap quand la
+        plage tient dans un segment, sinon une seule concaténation.
+        """
+        start = _epoch(since)
+        end = _epoch(until) if until is not None else None
+        first_day = int(start // DAY)
+        last_day = int((end if end is not None else _epoch(datetime.utcnow())) // DAY)
+        result = {}
+        for name in self.names(host_id, category):
+            parts = [seg.window(start, end) for seg in
+                     self._segments(host_id, category, name, first_day, last_day) if seg.count]
+            parts = [p for p in parts if len(p[0])]
+            if not parts:
+                continue
+            if len(parts) == 1:
+                result[name] = parts[0]
+            else:
+                result[name] = (np.concatenate([p[0] for p in parts]),
+                                np.concatenate([p[1] for p in parts]))
+        return result
+
+    # ---- rétention ----
+    def drop_before(self, cutoff):
+        """Supprime les segments entièrement antérieurs à `cutoff` ; retourne leur nombre."""
+        cutoff_day = int(_epoch(cutoff) // DAY)
+        removed = 0
+        with self._lock:
+            for key in [k for k in self._writers if k[3] < cutoff_day]:
+                self._writers.pop(key).close()
+            for dirpath, _, files in os.walk(self.root):
+                for filename in files:
+                    if filename.endswith(".seg") and self._day_of(filename) < cutoff_day:
+                        os.remove(os.path.join(dirpath, filename))
+                        removed += 1
+        return removed
+
+    def forget_host(self, host_id):
+        with self._lock:
+            for key in [k for k in self._writers if k[0] == host_id]:
+                self._writers.pop(key).close()
+            shutil.rmtree(os.path.join(self.root, str(host_id)), ignore_errors=True)
+
+
+_store = None
+
+
+def get_store():
+    """Instance partagée, créée à la première utilisation."""
+    global _store
+    if _store is None:
+        _store = MmapSeriesStore(SERIES_DATA_DIR)
+    return _store
@@ -56,19 +56,30 @@ class Host(db.Model):
     status = db.Column(db.String(20), default="unknown")
     last_status_change = db.Column(db.DateTime, nullable=True)
     snmp_community = db.Column(db.String(128), nullable=True, default="public")
+    # Version SNMP et identifiants USM propres à l'hôte (sinon ceux du template) :
+    # {"user", "auth_protocol", "auth_key", "priv_protocol", "priv_key"}
+    # ⚠️ clés USM en clair (voir mysql/migrations/008_hosts_snmp_v3.sql)
+    snmp_version = db.Column(db.Enum("v1", "v2c", "v3", name="snmp_ver_enum"), nullable=True)
+    snmp_v3 = db.Column(db.JSON, nullable=True)
     snmp_categories = db.Column(db.JSON, nullable=True)
     thresholds = db.Column(db.JSON, nullable=True, default={})
     # Optional geolocation
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    # Maintenu par MySQL (ON UPDATE CURRENT_TIMESTAMP) : filigrane de l'inventaire du poller
+    updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
 
     group_id = db.Column(db.Integer, db.ForeignKey("groups.id"))
     template_id = db.Column(db.Integer, db.ForeignKey("templates.id"))
+    # Dépendance optionnelle (ex: routeur d'uplink) : si le parent est down,
+    # l'hôte passe en 'unreachable' sans être interrogé
+    parent_id = db.Column(db.Integer, db.ForeignKey("hosts.id", ondelete="SET NULL"), nullable=True)
 
     group = db.relationship("Group", backref=db.backref("hosts", lazy=True))
     template = db.relationship("Template", backref=db.backref("hosts", lazy=True))
     tags = db.relationship("Tag", secondary=host_tags, lazy="subquery",
                            backref=db.backref("hosts", lazy=True))
+    parent = db.relationship("Host", remote_side=[id], backref=db.backref("children", lazy=True))
 
 class CurrentMetric(db.Model):
     __tablename__ = "current_metrics"
@@ -86,8 +97,59 @@ class Measurement(db.Model):
     oid = db.Column(db.String(200))
     metric = db.Column(db.String(120))
     value = db.Column(db.String(255))
+    category = db.Column(db.String(32))
     meta = db.Column(db.JSON)
     ts = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    __table_args__ = (db.Index("idx_meas_host_cat_ts", "host_id", "category", "ts"),)
+
+class MetricSeries(db.Model):
+    """Dictionnaire des séries numériques : (hôte, catégorie, métrique) → id."""
+    __tablename__ = "metric_series"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    host_id = db.Column(db.Integer, db.ForeignKey("hosts.id", ondelete="CASCADE"), nullable=False)
+    category = db.Column(db.String(32), nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    __table_args__ = (db.UniqueConstraint("host_id", "category", "name", name="uq_series_host_cat_name"),)
+
+class MetricSample(db.Model):
+    __tablename__ = "metric_samples"
+    series_id = db.Column(db.Integer, db.ForeignKey("metric_series.id", ondelete="CASCADE"), primary_key=True)
+    ts = db.Column(db.DateTime, primary_key=True)
+    value = db.Column(db.Float, nullable=False)
+
+class MetricChunk(db.Model):
+    """Échantillons d'une heure scellée d'une série, compressés (chunk_store.py)."""
+    __tablename__ = "metric_chunks"
+    series_id = db.Column(db.Integer, primary_key=True)
+    ts = db.Column(db.DateTime, primary_key=True)  # début de l'heure
+    count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+class _MetricRollup(db.Model):
+    """Agrégats d'une série par intervalle (`ts` = début de l'intervalle)."""
+    __abstract__ = True
+    series_id = db.Column(db.Integer, primary_key=True)
+    ts = db.Column(db.DateTime, primary_key=True)
+    min_value = db.Column(db.Float, nullable=False)
+    max_value = db.Column(db.Float, nullable=False)
+    avg_value = db.Column(db.Float, nullable=False)
+    last_value = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+
+class MetricRollup1m(_MetricRollup):
+    __tablename__ = "metric_rollup_1m"
+
+class MetricRollup5m(_MetricRollup):
+    __tablename__ = "metric_rollup_5m"
+
+class MetricRollup1h(_MetricRollup):
+    __tablename__ = "metric_rollup_1h"
+
+class RollupWatermark(db.Model):
+    """Fin (exclue) de la période déjà agrégée, par résolution (secondes) ; 0 = compaction en chunks."""
+    __tablename__ = "rollup_watermarks"
+    resolution = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    watermark = db.Column(db.DateTime, nullable=False)
 
 class Alert(db.Model):
     __tablename__ = "alerts"
@@ -101,3 +163,13 @@ class Alert(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     host = db.relationship("Host", backref=db.backref("alerts", lazy=True))
+
+class HostStateSnapshot(db.Model):
+    __tablename__ = "host_state"
+    host_id = db.Column(db.Integer, db.ForeignKey("hosts.id", ondelete="CASCADE"), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default="unknown")
+    last_poll = db.Column(db.DateTime, nullable=True)
+    last_latency = db.Column(db.Float, nullable=True)
+    consecutive_failures = db.Column(db.Integer, nullable=False, default=0)
+    last_snmp_ok = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
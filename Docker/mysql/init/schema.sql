@@ -88,13 +88,16 @@ CREATE TABLE IF NOT EXISTS `hosts` (
   `ip` VARCHAR(45) NOT NULL,
   `port` INT NOT NULL DEFAULT 161,
   `snmp_community` VARCHAR(128) DEFAULT 'public',
+  `snmp_version` ENUM('v1','v2c','v3') DEFAULT NULL,  -- NULL : version du template (v2c par défaut)
+  `snmp_v3` JSON DEFAULT NULL,  -- identifiants USM : user, auth_protocol, auth_key, priv_protocol, priv_key (clés en clair)
   `snmp_categories` JSON DEFAULT NULL,  -- ex: ["system","cpu","storage","interfaces"]
   `thresholds` JSON DEFAULT NULL,  
   `latitude` DOUBLE NULL,
   `longitude` DOUBLE NULL,
   `group_id` INT UNSIGNED DEFAULT NULL,
   `template_id` INT UNSIGNED DEFAULT NULL,
-  `status` ENUM('up','down','warning','unknown') NOT NULL DEFAULT 'unknown',
+  `parent_id` INT UNSIGNED DEFAULT NULL,  -- dépendance (ex: routeur d'uplink)
+  `status` ENUM('up','down','warning','unknown','unreachable') NOT NULL DEFAULT 'unknown',
   `last_status_change` DATETIME DEFAULT NULL,
   `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
@@ -103,6 +106,7 @@ CREATE TABLE IF NOT EXISTS `hosts` (
   KEY `idx_hosts_ip_port` (`ip`,`port`),
   KEY `idx_hosts_group_id` (`group_id`),
   KEY `idx_hosts_template_id` (`template_id`),
+  KEY `idx_hosts_parent_id` (`parent_id`),
   KEY `idx_hosts_snmp_community` (`snmp_community`),
   KEY `idx_hosts_status` (`status`),
   CONSTRAINT `fk_hosts_group`
@@ -110,6 +114,9 @@ CREATE TABLE IF NOT EXISTS `hosts` (
     ON UPDATE CASCADE ON DELETE SET NULL,
   CONSTRAINT `fk_hosts_template`
     FOREIGN KEY (`template_id`) REFERENCES `templates` (`id`)
+    ON UPDATE CASCADE ON DELETE SET NULL,
+  CONSTRAINT `fk_hosts_parent`
+    FOREIGN KEY (`parent_id`) REFERENCES `hosts` (`id`)
     ON UPDATE CASCADE ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -154,7 +161,7 @@ CREATE TABLE IF NOT EXISTS `alerts` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- ============================================================================
--- Mesures brutes
+-- Mesures brutes (valeurs texte ; le numérique va dans metric_samples)
 -- ============================================================================
 CREATE TABLE IF NOT EXISTS `measurements` (
   `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
@@ -162,15 +169,115 @@ CREATE TABLE IF NOT EXISTS `measurements` (
   `oid` VARCHAR(200) NOT NULL,
   `metric` VARCHAR(120) DEFAULT NULL,
   `value` VARCHAR(255) NOT NULL,
+  `category` VARCHAR(32) DEFAULT NULL,  -- system, cpu, ram, storage, interfaces
   `ts` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `meta` JSON DEFAULT NULL,
-  PRIMARY KEY (`id`),
+  PRIMARY KEY (`id`, `ts`),
   KEY `idx_meas_host_ts` (`host_id`,`ts`),
-  CONSTRAINT `fk_meas_host`
+  KEY `idx_meas_host_cat_ts` (`host_id`,`category`,`ts`)
+  -- Pas de clé étrangère (incompatible avec le partitionnement) : les lignes
+  -- d'un hôte supprimé disparaissent avec leur partition (cf. retention.py)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+-- ============================================================================
+-- Séries numériques : dictionnaire (hôte, catégorie, métrique) → id
+-- ============================================================================
+CREATE TABLE IF NOT EXISTS `metric_series` (
+  `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `host_id` INT UNSIGNED NOT NULL,
+  `category` VARCHAR(32) NOT NULL,
+  `name` VARCHAR(200) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_series_host_cat_name` (`host_id`, `category`, `name`),
+  CONSTRAINT `fk_series_host`
     FOREIGN KEY (`host_id`) REFERENCES `hosts` (`id`)
     ON UPDATE CASCADE ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ============================================================================
+-- Échantillons numériques (series_id, ts, DOUBLE) : ~17 octets par ligne
+-- ============================================================================
+CREATE TABLE IF NOT EXISTS `metric_samples` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,
+  `value` DOUBLE NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+  -- Partitions journalières créées / supprimées par retention.py
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+-- ============================================================================
+-- Heures scellées de metric_samples, compressées (chunk_store.py) :
+-- delta-of-delta sur les ts, XOR sur les valeurs
+-- ============================================================================
+CREATE TABLE IF NOT EXISTS `metric_chunks` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'heure
+  `count` INT UNSIGNED NOT NULL,
+  `data` BLOB NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+-- ============================================================================
+-- Agrégats 1 min / 5 min / 1 h (rollups.py), rétention propre à chaque résolution
+-- ============================================================================
+CREATE TABLE IF NOT EXISTS `metric_rollup_1m` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'intervalle
+  `min_value` DOUBLE NOT NULL,
+  `max_value` DOUBLE NOT NULL,
+  `avg_value` DOUBLE NOT NULL,
+  `last_value` DOUBLE NOT NULL,
+  `count` INT UNSIGNED NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS `metric_rollup_5m` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'intervalle
+  `min_value` DOUBLE NOT NULL,
+  `max_value` DOUBLE NOT NULL,
+  `avg_value` DOUBLE NOT NULL,
+  `last_value` DOUBLE NOT NULL,
+  `count` INT UNSIGNED NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS `metric_rollup_1h` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'intervalle
+  `min_value` DOUBLE NOT NULL,
+  `max_value` DOUBLE NOT NULL,
+  `avg_value` DOUBLE NOT NULL,
+  `last_value` DOUBLE NOT NULL,
+  `count` INT UNSIGNED NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+-- Fin (exclue) de la période déjà agrégée, par résolution en secondes (0 : compaction en chunks)
+CREATE TABLE IF NOT EXISTS `rollup_watermarks` (
+  `resolution` INT UNSIGNED NOT NULL,
+  `watermark` DATETIME NOT NULL,
+  PRIMARY KEY (`resolution`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- ============================================================================
 -- Cache des valeurs actuelles
 -- ============================================================================
@@ -189,6 +296,24 @@ CREATE TABLE IF NOT EXISTS `current_metrics` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 
+-- ============================================================================
+-- État des hôtes vu par le poller (snapshot périodique, lu par les workers web)
+-- ============================================================================
+CREATE TABLE IF NOT EXISTS `host_state` (
+  `host_id` INT UNSIGNED NOT NULL,
+  `status` VARCHAR(20) NOT NULL DEFAULT 'unknown',
+  `last_poll` DATETIME DEFAULT NULL,
+  `last_latency` FLOAT DEFAULT NULL,
+  `consecutive_failures` INT UNSIGNED NOT NULL DEFAULT 0,
+  `last_snmp_ok` DATETIME DEFAULT NULL,
+  `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`host_id`),
+  CONSTRAINT `fk_host_state_host`
+    FOREIGN KEY (`host_id`) REFERENCES `hosts` (`id`)
+    ON UPDATE CASCADE ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+
 -- ============================================================================
 -- Utilisateur admin par défaut
 -- ============================================================================
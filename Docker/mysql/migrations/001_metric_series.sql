@@ -0,0 +1,68 @@
+-- ============================================================================
+--  Migration 001 : mesures numériques → metric_series / metric_samples
+--  À appliquer une fois sur une base existante (les nouvelles bases sont
+--  créées directement par mysql/init/schema.sql) :
+--    mysql -u root -p SNMP < mysql/migrations/001_metric_series.sql
+-- ============================================================================
+
+USE `SNMP`;
+
+CREATE TABLE IF NOT EXISTS `metric_series` (
+  `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `host_id` INT UNSIGNED NOT NULL,
+  `category` VARCHAR(32) NOT NULL,
+  `name` VARCHAR(200) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_series_host_cat_name` (`host_id`, `category`, `name`),
+  CONSTRAINT `fk_series_host`
+    FOREIGN KEY (`host_id`) REFERENCES `hosts` (`id`)
+    ON UPDATE CASCADE ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `metric_samples` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,
+  `value` DOUBLE NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`),
+  CONSTRAINT `fk_samples_series`
+    FOREIGN KEY (`series_id`) REFERENCES `metric_series` (`id`)
+    ON UPDATE CASCADE ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 🔹 Lignes numériques à migrer, avec leur catégorie (meta = "cpu") et le nom
+--    de série tel qu'affiché par les graphes : l'oid pour les interfaces et les
+--    sous-clés de dictionnaires ("<oid>.pct"), sinon la métrique.
+DROP TEMPORARY TABLE IF EXISTS `tmp_numeric_measurements`;
+CREATE TEMPORARY TABLE `tmp_numeric_measurements` AS
+SELECT
+  m.`id`,
+  m.`host_id`,
+  LEFT(JSON_UNQUOTE(m.`meta`), 32) AS `category`,
+  CASE
+    WHEN JSON_UNQUOTE(m.`meta`) = 'interfaces' OR m.`metric` IS NULL
+      OR m.`oid` LIKE CONCAT('%.', m.`metric`) THEN m.`oid`
+    ELSE m.`metric`
+  END AS `name`,
+  m.`ts`,
+  CAST(m.`value` AS DOUBLE) AS `value`
+FROM `measurements` m
+WHERE m.`meta` IS NOT NULL
+  AND JSON_TYPE(m.`meta`) = 'STRING'
+  AND m.`value` REGEXP '^-?[0-9]+(\\.[0-9]+)?([eE][-+]?[0-9]+)?$';
+
+-- 🔹 Dictionnaire
+INSERT IGNORE INTO `metric_series` (`host_id`, `category`, `name`)
+SELECT DISTINCT `host_id`, `category`, `name` FROM `tmp_numeric_measurements`;
+
+-- 🔹 Échantillons (doublons série/seconde ignorés)
+INSERT IGNORE INTO `metric_samples` (`series_id`, `ts`, `value`)
+SELECT s.`id`, t.`ts`, t.`value`
+FROM `tmp_numeric_measurements` t
+JOIN `metric_series` s
+  ON s.`host_id` = t.`host_id` AND s.`category` = t.`category` AND s.`name` = t.`name`;
+
+-- 🔹 Les lignes migrées quittent `measurements` (qui ne garde que le texte)
+DELETE m FROM `measurements` m
+JOIN `tmp_numeric_measurements` t ON t.`id` = m.`id`;
+
+DROP TEMPORARY TABLE `tmp_numeric_measurements`;
@@ -0,0 +1,34 @@
+-- ============================================================================
+--  Migration 002 : partitionnement journalier de measurements / metric_samples
+--  Le partitionnement MySQL impose que `ts` fasse partie de la clé primaire et
+--  interdit les clés étrangères. Les ALTER recopient la table : à lancer en
+--  période creuse (ou après une première purge par retention.py, qui supprime
+--  par lots tant que la table n'est pas partitionnée).
+--    mysql -u root -p SNMP < mysql/migrations/002_partition_measurements.sql
+--  Les partitions journalières sont ensuite créées par le job de rétention.
+--  ⚠️ Coût unique au premier passage du job après cette migration : tout
+--  l'historique est dans pfuture. Le job purge d'abord par lots les lignes
+--  hors rétention (DELETE ... LIMIT, sans verrou de table), puis découpe
+--  pfuture en une seule REORGANIZE PARTITION en jours, du plus ancien jour
+--  conservé à aujourd'hui + RETENTION_PRECREATE_DAYS. Cette réorganisation
+--  recopie les lignes conservées sous verrou de métadonnées (écritures
+--  bloquées le temps de la copie) : démarrer l'application en période
+--  creuse. Les découpages suivants ne touchent qu'un pfuture vide.
+-- ============================================================================
+
+USE `SNMP`;
+
+-- 🔹 measurements
+ALTER TABLE `measurements` DROP FOREIGN KEY `fk_meas_host`;
+ALTER TABLE `measurements` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `ts`);
+ALTER TABLE `measurements`
+  PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+    PARTITION pfuture VALUES LESS THAN MAXVALUE
+  );
+
+-- 🔹 metric_samples (clé primaire (series_id, ts) déjà compatible)
+ALTER TABLE `metric_samples` DROP FOREIGN KEY `fk_samples_series`;
+ALTER TABLE `metric_samples`
+  PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+    PARTITION pfuture VALUES LESS THAN MAXVALUE
+  );
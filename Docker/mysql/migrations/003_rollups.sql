@@ -0,0 +1,55 @@
+-- ============================================================================
+--  Migration 003 : tables d'agrégats (rollups) et filigranes
+--    mysql -u root -p SNMP < mysql/migrations/003_rollups.sql
+--  Le downsampler (rollups.py) agrège ensuite l'historique existant.
+-- ============================================================================
+
+USE `SNMP`;
+
+CREATE TABLE IF NOT EXISTS `metric_rollup_1m` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'intervalle
+  `min_value` DOUBLE NOT NULL,
+  `max_value` DOUBLE NOT NULL,
+  `avg_value` DOUBLE NOT NULL,
+  `last_value` DOUBLE NOT NULL,
+  `count` INT UNSIGNED NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS `metric_rollup_5m` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'intervalle
+  `min_value` DOUBLE NOT NULL,
+  `max_value` DOUBLE NOT NULL,
+  `avg_value` DOUBLE NOT NULL,
+  `last_value` DOUBLE NOT NULL,
+  `count` INT UNSIGNED NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS `metric_rollup_1h` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'intervalle
+  `min_value` DOUBLE NOT NULL,
+  `max_value` DOUBLE NOT NULL,
+  `avg_value` DOUBLE NOT NULL,
+  `last_value` DOUBLE NOT NULL,
+  `count` INT UNSIGNED NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS `rollup_watermarks` (
+  `resolution` INT UNSIGNED NOT NULL,
+  `watermark` DATETIME NOT NULL,
+  PRIMARY KEY (`resolution`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
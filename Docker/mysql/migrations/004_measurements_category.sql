@@ -0,0 +1,19 @@
+-- ============================================================================
+--  Migration 004 : colonne `category` indexée sur measurements
+--  La catégorie était stockée en chaîne JSON dans `meta` ("cpu") et filtrée
+--  par LIKE, sans index possible. Nouvel index (host_id, category, ts).
+--    mysql -u root -p SNMP < mysql/migrations/004_measurements_category.sql
+-- ============================================================================
+
+USE `SNMP`;
+
+ALTER TABLE `measurements`
+  ADD COLUMN `category` VARCHAR(32) DEFAULT NULL AFTER `value`,
+  ADD KEY `idx_meas_host_cat_ts` (`host_id`, `category`, `ts`);
+
+-- 🔹 Reprise depuis meta (les écritures récentes renseignent déjà category)
+UPDATE `measurements`
+SET `category` = LEFT(JSON_UNQUOTE(`meta`), 32)
+WHERE `category` IS NULL
+  AND `meta` IS NOT NULL
+  AND JSON_TYPE(`meta`) = 'STRING';
@@ -0,0 +1,19 @@
+-- ============================================================================
+--  Migration 005 : chunks compressés des échantillons anciens
+--    mysql -u root -p SNMP < mysql/migrations/005_metric_chunks.sql
+--  Le compacteur (chunk_store.py, lancé avec le downsampler) convertit ensuite
+--  les heures déjà agrégées de metric_samples et supprime les lignes brutes.
+-- ============================================================================
+
+USE `SNMP`;
+
+CREATE TABLE IF NOT EXISTS `metric_chunks` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,  -- début de l'heure
+  `count` INT UNSIGNED NOT NULL,
+  `data` BLOB NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`ts`)) (
+  PARTITION pfuture VALUES LESS THAN MAXVALUE
+);
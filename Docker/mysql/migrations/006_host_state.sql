@@ -0,0 +1,26 @@
+-- ============================================================================
+--  Migration 006 : registre d'état des hôtes (host_state)
+--  Snapshot périodique du poller, lu par les workers web et rechargé au
+--  premier cycle après un redémarrage :
+--    mysql -u root -p SNMP < mysql/migrations/006_host_state.sql
+-- ============================================================================
+
+USE `SNMP`;
+
+CREATE TABLE IF NOT EXISTS `host_state` (
+  `host_id` INT UNSIGNED NOT NULL,
+  `status` VARCHAR(20) NOT NULL DEFAULT 'unknown',
+  `last_poll` DATETIME DEFAULT NULL,
+  `last_latency` FLOAT DEFAULT NULL,
+  `consecutive_failures` INT UNSIGNED NOT NULL DEFAULT 0,
+  `last_snmp_ok` DATETIME DEFAULT NULL,
+  `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`host_id`),
+  CONSTRAINT `fk_host_state_host`
+    FOREIGN KEY (`host_id`) REFERENCES `hosts` (`id`)
+    ON UPDATE CASCADE ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 🔹 Reprise du dernier statut connu : les hôtes ne repassent pas par 'unknown'
+INSERT IGNORE INTO `host_state` (`host_id`, `status`)
+SELECT `id`, `status` FROM `hosts`;
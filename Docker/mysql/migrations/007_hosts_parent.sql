@@ -0,0 +1,16 @@
+-- ============================================================================
+--  Migration 007 : dépendance parent → enfant entre hôtes
+--  Un hôte dont le parent (ex: routeur d'uplink) est down passe en
+--  'unreachable' sans être interrogé :
+--    mysql -u root -p SNMP < mysql/migrations/007_hosts_parent.sql
+-- ============================================================================
+
+USE `SNMP`;
+
+ALTER TABLE `hosts`
+  ADD COLUMN `parent_id` INT UNSIGNED DEFAULT NULL AFTER `template_id`,
+  MODIFY COLUMN `status` ENUM('up','down','warning','unknown','unreachable') NOT NULL DEFAULT 'unknown',
+  ADD KEY `idx_hosts_parent_id` (`parent_id`),
+  ADD CONSTRAINT `fk_hosts_parent`
+    FOREIGN KEY (`parent_id`) REFERENCES `hosts` (`id`)
+    ON UPDATE CASCADE ON DELETE SET NULL;
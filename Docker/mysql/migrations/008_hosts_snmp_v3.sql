@@ -0,0 +1,15 @@
+-- ============================================================================
+--  Migration 008 : version SNMP et identifiants SNMPv3 (USM) par hôte
+--    mysql -u root -p SNMP < mysql/migrations/008_hosts_snmp_v3.sql
+--  NULL : version / identifiants du template (v2c par défaut).
+--  ⚠️ Les clés auth_key / priv_key sont stockées EN CLAIR dans le JSON
+--  snmp_v3 (le moteur SNMP en a besoin pour localiser les clés) : restreindre
+--  l'accès à la base et à ses sauvegardes en conséquence. Les formulaires ne
+--  les réaffichent jamais (champ vide = clé inchangée).
+-- ============================================================================
+
+USE `SNMP`;
+
+ALTER TABLE `hosts`
+  ADD COLUMN `snmp_version` ENUM('v1','v2c','v3') DEFAULT NULL AFTER `snmp_community`,
+  ADD COLUMN `snmp_v3` JSON DEFAULT NULL AFTER `snmp_version`;
@@ -0,0 +1,90 @@
+-- ============================================================================
+--  Migration 009 : séries d'interfaces `<iface>.in` / `.out` → `.in_mbps` / `.out_mbps`
+--    mysql -u root -p SNMP < mysql/migrations/009_interface_rate_series.sql
+--  Les graphes de trafic ne lisent plus que les débits `.in_mbps` / `.out_mbps`
+--  (déjà écrits par le poller) ; les séries `.in` / `.out` (compteurs bruts
+--  d'octets, nommées ainsi par la migration 001) ne sont plus écrites.
+--  Cette migration en dérive des débits (écart entre deux compteurs
+--  consécutifs) là où la série `_mbps` n'a pas déjà un point à la même
+--  seconde, puis complète les agrégats déjà calculés.
+--  - Les débits décimaux écrits autrefois par api_poll dans ces séries sont
+--    ignorés (seules les valeurs entières sont des compteurs), de même que
+--    les reculs (redémarrage) et les écarts au-delà de 100 Gbit/s.
+--  - Seules les lignes de metric_samples sont converties : à appliquer avant
+--    que le compacteur (chunk_store.py) ne les ait encodées en chunks.
+--  - Les anciennes séries restent en place et expirent avec la rétention.
+--  - Backend SERIES_BACKEND=mmap : non concerné (aucune série en base).
+-- ============================================================================
+
+USE `SNMP`;
+
+-- 🔹 Séries cibles
+INSERT IGNORE INTO `metric_series` (`host_id`, `category`, `name`)
+SELECT `host_id`, `category`, CONCAT(`name`, '_mbps')
+FROM `metric_series`
+WHERE `category` = 'interfaces' AND (`name` LIKE '%.in' OR `name` LIKE '%.out');
+
+-- 🔹 Débits dérivés des compteurs consécutifs (Mbps, comme calculate_rate)
+DROP TEMPORARY TABLE IF EXISTS `tmp_interface_rates`;
+CREATE TEMPORARY TABLE `tmp_interface_rates` (
+  `series_id` INT UNSIGNED NOT NULL,
+  `ts` TIMESTAMP NOT NULL,
+  `value` DOUBLE NOT NULL,
+  PRIMARY KEY (`series_id`, `ts`)
+) ENGINE=InnoDB;
+
+INSERT IGNORE INTO `tmp_interface_rates` (`series_id`, `ts`, `value`)
+SELECT n.`id`, d.`ts`,
+       ROUND((d.`value` - d.`prev_value`) * 8 / (TIMESTAMPDIFF(SECOND, d.`prev_ts`, d.`ts`) * 1000000), 3)
+FROM (
+  SELECT s.`series_id`, s.`ts`, s.`value`,
+         LAG(s.`value`) OVER w AS `prev_value`,
+         LAG(s.`ts`) OVER w AS `prev_ts`
+  FROM `metric_samples` s
+  JOIN `metric_series` o ON o.`id` = s.`series_id`
+  WHERE o.`category` = 'interfaces' AND (o.`name` LIKE '%.in' OR o.`name` LIKE '%.out')
+    AND s.`value` = FLOOR(s.`value`)
+  WINDOW w AS (PARTITION BY s.`series_id` ORDER BY s.`ts`)
+) d
+JOIN `metric_series` o ON o.`id` = d.`series_id`
+JOIN `metric_series` n
+  ON n.`host_id` = o.`host_id` AND n.`category` = o.`category` AND n.`name` = CONCAT(o.`name`, '_mbps')
+WHERE d.`prev_ts` IS NOT NULL
+  AND d.`ts` > d.`prev_ts`
+  AND d.`value` >= d.`prev_value`
+  AND (d.`value` - d.`prev_value`) * 8 / (TIMESTAMPDIFF(SECOND, d.`prev_ts`, d.`ts`) * 1000000) <= 100000;
+
+-- 🔹 Échantillons (les points déjà écrits par le poller sont conservés)
+INSERT IGNORE INTO `metric_samples` (`series_id`, `ts`, `value`)
+SELECT `series_id`, `ts`, `value` FROM `tmp_interface_rates`;
+
+-- 🔹 Agrégats des intervalles déjà passés par le downsampler (avant son
+--    filigrane ; au-delà, rollups.py les calculera depuis metric_samples)
+INSERT IGNORE INTO `metric_rollup_1m` (`series_id`, `ts`, `min_value`, `max_value`, `avg_value`, `last_value`, `count`)
+SELECT t.`series_id`, FROM_UNIXTIME(UNIX_TIMESTAMP(t.`ts`) DIV 60 * 60),
+       MIN(t.`value`), MAX(t.`value`), AVG(t.`value`),
+       CAST(SUBSTRING_INDEX(GROUP_CONCAT(t.`value` ORDER BY t.`ts` DESC), ',', 1) AS DOUBLE), COUNT(*)
+FROM `tmp_interface_rates` t
+JOIN `rollup_watermarks` w ON w.`resolution` = 60
+WHERE t.`ts` < w.`watermark`
+GROUP BY t.`series_id`, UNIX_TIMESTAMP(t.`ts`) DIV 60;
+
+INSERT IGNORE INTO `metric_rollup_5m` (`series_id`, `ts`, `min_value`, `max_value`, `avg_value`, `last_value`, `count`)
+SELECT t.`series_id`, FROM_UNIXTIME(UNIX_TIMESTAMP(t.`ts`) DIV 300 * 300),
+       MIN(t.`value`), MAX(t.`value`), AVG(t.`value`),
+       CAST(SUBSTRING_INDEX(GROUP_CONCAT(t.`value` ORDER BY t.`ts` DESC), ',', 1) AS DOUBLE), COUNT(*)
+FROM `tmp_interface_rates` t
+JOIN `rollup_watermarks` w ON w.`resolution` = 300
+WHERE t.`ts` < w.`watermark`
+GROUP BY t.`series_id`, UNIX_TIMESTAMP(t.`ts`) DIV 300;
+
+INSERT IGNORE INTO `metric_rollup_1h` (`series_id`, `ts`, `min_value`, `max_value`, `avg_value`, `last_value`, `count`)
+SELECT t.`series_id`, FROM_UNIXTIME(UNIX_TIMESTAMP(t.`ts`) DIV 3600 * 3600),
+       MIN(t.`value`), MAX(t.`value`), AVG(t.`value`),
+       CAST(SUBSTRING_INDEX(GROUP_CONCAT(t.`value` ORDER BY t.`ts` DESC), ',', 1) AS DOUBLE), COUNT(*)
+FROM `tmp_interface_rates` t
+JOIN `rollup_watermarks` w ON w.`resolution` = 3600
+WHERE t.`ts` < w.`watermark`
+GROUP BY t.`series_id`, UNIX_TIMESTAMP(t.`ts`) DIV 3600;
+
+DROP TEMPORARY TABLE `tmp_interface_rates`;
@@ -0,0 +1,169 @@
+import math
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Snapshot binaire de l'état de travail du poller
+# ─────────────────────────────────────────────
+# Écrit à chaque cycle (fichier temporaire + os.replace, donc atomique) et relu
+# par mmap au démarrage : un redémarrage reprend les statuts, les derniers
+# compteurs d'interfaces, l'index des alertes ouvertes et les types d'équipements
+# détectés, sans rejouer de transitions ni d'alertes.
+SNAPSHOT_PATH = os.getenv("POLL_SNAPSHOT_PATH", os.path.join("instance", "poll_state.bin"))
+
+_MAGIC = b"PSNP"
+_VERSION = 1
+
+# En-tête : magic, version, created, nb hôtes, nb types, nb compteurs, nb alertes, crc32
+_HEADER = struct.Struct("<4sHdIIIII")
+# Hôte : host_id, statut, last_poll, latence (ms), échecs consécutifs, last_snmp_ok
+_HOST = struct.Struct("<IBdfHd")
+# Compteurs : in, out, ts
+_COUNTER = struct.Struct("<QQd")
+# Alerte ouverte : host_id, alert_id, sévérité, flags
+_ALERT = struct.Struct("<IIBB")
+_KEYLEN = struct.Struct("<H")
+_CODE = struct.Struct("<B")
+
+STATUS_CODES = ("unknown", "up", "down", "warning", "unreachable")
+SEVERITY_CODES = ("info", "warning", "critical")
+DEVICE_TYPES = ("linux", "pfsense", "windows")
+ALERT_FLAG_SNMP = 0x01
+
+
+def _ts(dt):
+    return (dt - datetime(1970, 1, 1)).total_seconds() if dt else 0.0
+
+
+def _dt(ts):
+    return datetime.utcfromtimestamp(ts) if ts else None
+
+
+def _code(values, value):
+    try:
+        return values.index(value)
+    except ValueError:
+        return 0
+
+
+def _pack_key(key: str) -> bytes:
+    raw = key.encode("utf-8")[:65535]
+    return _KEYLEN.pack(len(raw)) + raw
+
+
+def save_snapshot(host_states, counters, alert_index, device_types, path=SNAPSHOT_PATH):
+    """
+    Écrit le snapshot binaire.
+    - host_states : {host_id: HostState}
+    - counters : {(ip, port, interface): (in, out, datetime)}
+    - alert_index : {host_id: [(alert_id, severity, flags), ...]}
+    - device_types : {(ip, port): "linux" | "pfsense" | "windows"}
+    """
+    body = bytearray()
+    for host_id, s in host_states.items():
+        latency = s.last_latency if s.last_latency is not None else math.nan
+        body += _HOST.pack(host_id, _code(STATUS_CODES, s.status), _ts(s.last_poll),
+                           latency, min(s.consecutive_failures, 0xFFFF), _ts(s.last_snmp_ok))
+    for (ip, port), dtype in device_types.items():
+        body += _pack_key(f"{ip}:{port}") + _CODE.pack(_code(DEVICE_TYPES, dtype))
+    for (ip, port, name), (in_val, out_val, ts) in counters.items():
+        body += _pack_key(f"{ip}:{port}|{name}") + _COUNTER.pack(
+            in_val & 0xFFFFFFFFFFFFFFFF, out_val & 0xFFFFFFFFFFFFFFFF, _ts(ts))
+    n_alerts = 0
+    for host_id, alerts in alert_index.items():
+        for alert_id, severity, flags in alerts:
+            body += _ALERT.pack(host_id, alert_id, _code(SEVERITY_CODES, severity), flags)
+            n_alerts += 1
+
+    header = _HEADER.pack(_MAGIC, _VERSION, _ts(datetime.utcnow()), len(host_states),
+                          len(device_types), len(counters), n_alerts, zlib.crc32(body))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _unpack_key(buf, offset):
+    (length,) = _KEYLEN.unpack_from(buf, offset)
+    offset += _KEYLEN.size
+    return bytes(buf[offset:offset + length]).decode("utf-8"), offset + length
+
+
+def _split_agent(key):
+    ip, _, port = key.rpartition(":")
+    return ip, int(port)
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    """
+    Relit le snapshot par mmap. Retourne un dict (created, hosts, counters,
+    alerts, device_types) ou None si le fichier est absent ou corrompu.
+    Les hôtes sont retournés en tuples bruts, à réinjecter dans le registre.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < _HEADER.size:
+        return None
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            magic, version, created, n_hosts, n_types, n_counters, n_alerts, crc = _HEADER.unpack_from(buf, 0)
+            if magic != _MAGIC or version != _VERSION:
+                logger.warning(f"[snapshot] ⚠️ Format inconnu ({magic!r} v{version}) — ignoré")
+                return None
+            if zlib.crc32(buf[_HEADER.size:]) != crc:
+                logger.warning("[snapshot] ⚠️ CRC invalide (écriture interrompue ?) — ignoré")
+                return None
+
+            offset = _HEADER.size
+            hosts = {}
+            for _ in range(n_hosts):
+                host_id, status, last_poll, latency, failures, last_ok = _HOST.unpack_from(buf, offset)
+                offset += _HOST.size
+                hosts[host_id] = (
+                    STATUS_CODES[status] if status < len(STATUS_CODES) else "unknown",
+                    _dt(last_poll),
+                    None if math.isnan(latency) else latency,
+                    failures,
+                    _dt(last_ok),
+                )
+
+            device_types = {}
+            for _ in range(n_types):
+                key, offset = _unpack_key(buf, offset)
+                (code,) = _CODE.unpack_from(buf, offset)
+                offset += _CODE.size
+                device_types[_split_agent(key)] = DEVICE_TYPES[code] if code < len(DEVICE_TYPES) else "linux"
+
+            counters = {}
+            for _ in range(n_counters):
+                key, offset = _unpack_key(buf, offset)
+                in_val, out_val, ts = _COUNTER.unpack_from(buf, offset)
+                offset += _COUNTER.size
+                agent, _, name = key.partition("|")
+                ip, port = _split_agent(agent)
+                counters[(ip, port, name)] = (in_val, out_val, _dt(ts))
+
+            alerts = {}
+            for _ in range(n_alerts):
+                host_id, alert_id, severity, flags = _ALERT.unpack_from(buf, offset)
+                offset += _ALERT.size
+                alerts.setdefault(host_id, []).append((alert_id, SEVERITY_CODES[severity], flags))
+    except Exception as e:
+        logger.warning(f"[snapshot] ⚠️ Lecture du snapshot impossible : {e}")
+        return None
+
+    return {
+        "created": _dt(created),
+        "hosts": hosts,
+        "counters": counters,
+        "alerts": alerts,
+        "device_types": device_types,
+    }
@@ -1,20 +1,67 @@
+import os
 import time
 import threading
-import json
 from datetime import datetime
-from snmp_utils import get_metrics
-from db_utils import upsert_current_metric, open_alert, resolve_alert, resolve_snmp_alerts
-from seuils import check_host_reachability, detect_interface_changes, check_thresholds
-from models import CurrentMetric, Measurement, Alert
+from snmp_utils import (
+    get_typed, agent_stats, SnmpTimeout, COUNTER_CACHE, DEVICE_TYPE_CACHE,
+    SYS_UPTIME_OID, note_uptime, interface_table,
+)
+from snmp_registry import collect_metrics
+from db_utils import open_alert, resolve_alert, resolve_snmp_alerts, unit_of_work
+from seuils import check_host_reachability, detect_interface_changes
+from models import CurrentMetric, Alert
+from metric_pipeline import normalize, persist
+from host_state import HostStateRegistry
+from inventory import HostInventory
+from poll_snapshot import save_snapshot, load_snapshot, ALERT_FLAG_SNMP
 import logging
 poller_logger = logging.getLogger(__name__)
 
-# Cache mémoire des statuts connus
-HOST_STATUS_CACHE = {}
+# Registre des états connus (sauvegardé dans host_state, rechargé au démarrage)
+HOST_STATE = HostStateRegistry()
+_host_state_loaded = False
+
+# Inventaire des hôtes à interroger (rafraîchi de façon incrémentale)
+INVENTORY = HostInventory()
+
+# Index des alertes ouvertes par hôte : host_id -> [(alert_id, severity, flags)]
+OPEN_ALERT_INDEX = {}
 
 SNMP_DOWN_MSG = "SNMP injoignable (timeout)"
 SNMP_UP_MSG = "SNMP rétabli ✅"
 
+# Disjoncteur SNMP : délai avant la 1re sonde puis doublement jusqu'au maximum (secondes)
+BREAKER_BASE_BACKOFF = 15
+BREAKER_MAX_BACKOFF = 900
+
+# Durée maximale d'un cycle (secondes, 0 = illimitée) : au-delà, les hôtes
+# restants sont reportés au cycle suivant
+POLL_CYCLE_DEADLINE = float(os.getenv("POLL_CYCLE_DEADLINE", "45"))
+
+# Âge maximal (secondes) d'un snapshot dont on reprend les types
+# d'équipements : un redémarrage d'agent pendant l'arrêt du poller n'est pas
+# visible via sysUpTime (AGENT_UPTIME n'est pas sauvegardé)
+DEVICE_TYPE_MAX_AGE = float(os.getenv("DEVICE_TYPE_MAX_AGE", "21600"))
+
+# Bilan du dernier cycle (jobs terminés / reportés / ignorés), exposé par /healthz
+LAST_CYCLE_STATS = {}
+
+# Fréquence adaptative (secondes) : intervalle minimal tant qu'un hôte est en
+# alerte ou vient de changer d'état, puis allongé par POLL_INTERVAL_GROWTH à
+# chaque poll stable jusqu'au maximum. Bornes surchargeables par template
+# (params JSON : poll_min_interval / poll_max_interval).
+POLL_TICK_SECONDS = float(os.getenv("POLL_TICK_SECONDS", "5"))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "15"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
+POLL_INTERVAL_GROWTH = 1.5
+RECENT_CHANGE_WINDOW = 600
+
+# Réveil anticipé du scheduler (trap reçu...) sans attendre la fin du tick
+POLL_WAKEUP = threading.Event()
+
+# Statuts d'un parent qui rendent ses enfants injoignables (poll suspendu)
+PARENT_DOWN_STATUSES = ("down", "unreachable")
+
 
 # ==============================================================
 # 🔹 LOGGER STANDARDISÉ
@@ -28,201 +75,583 @@ def log_poller(icon: str, message: str):
     poller_logger.info(formatted)
 
 
-def _normalize_categories(raw):
-    """Normalize snmp_categories stored as list or JSON string."""
-    if raw is None:
-        return []
-    if isinstance(raw, (list, tuple)):
-        return list(raw)
-    if isinstance(raw, str):
+def _is_snmp_alert(message):
+    """Même critère que resolve_snmp_alerts : message contenant 'SNMP' ou 'injoignable'."""
+    lowered = (message or "").lower()
+    return "snmp" in lowered or "injoignable" in lowered
+
+
+def _resolve_link_down_alerts(db, Alert, host, rows, interfaces):
+    """
+    Résout les alertes « Interface X down (trap linkDown) » dont l'interface
+    est vue 'up' par ce poll : le trap linkUp (UDP) a pu se perdre.
+    Le libellé du trap peut être le nom (ifDescr) ou « ifIndex N ».
+    Retourne les ids des alertes résolues.
+    """
+    up = {name for name, info in interfaces.items()
+          if isinstance(info, dict) and info.get("state") == "up"}
+    if not up:
+        return set()
+    table = interface_table(host.ip, host.port)
+    if table is not None:
+        up |= {f"ifIndex {e.index[0]}" for e in table.entries if e.name in up}
+    resolved = set()
+    for r in rows:
+        message = r.message or ""
+        if not message.startswith("Interface ") or "down (trap linkDown)" not in message:
+            continue
+        label = message[len("Interface "):message.index(" down (trap linkDown)")]
+        if label in up:
+            resolve_alert(db, Alert, host.id, message_contains=f"Interface {label} down", force=True)
+            resolved.add(r.id)
+    return resolved
+
+
+def _has_open_snmp_alert(host_id):
+    """Vrai si l'index signale une alerte SNMP ouverte (ou si l'hôte n'est pas encore indexé)."""
+    alerts = OPEN_ALERT_INDEX.get(host_id)
+    if alerts is None:
+        return True
+    return any(flags & ALERT_FLAG_SNMP for _, _, flags in alerts)
+
+
+# ==============================================================
+# 🔹 POLL D'UN HÔTE
+# ==============================================================
+def _set_host_status(db, Host, host_id, **values):
+    """UPDATE ciblé de la ligne hosts (le poller ne manipule pas d'objets Host)."""
+    db.session.query(Host).filter(Host.id == host_id).update(values, synchronize_session="evaluate")
+
+
+def _collect_host(host):
+    """
+    Phase réseau d'un poll (ping puis plan SNMP), sans aucun accès à la base :
+    elle s'exécute hors transaction, aucune connexion ni verrou n'est tenu
+    pendant les timeouts et retransmissions.
+    Retourne un dict : ping_ok, ping_error, collected, failures, timed_out,
+    poll_ts et latency_ms (durée de collecte SNMP).
+    """
+    hostname = host.hostname
+    categories = list(host.snmp_categories)
+
+    # 1️⃣ Vérif Ping
+    ping_error = None
+    try:
+        ping_ok = check_host_reachability(None, host, None)
+    except Exception as e:
+        log_poller("⚠️", f"Erreur reachability pour {hostname}: {e}")
+        ping_ok, ping_error = False, e
+
+    # 2️⃣ SNMP : toutes les catégories partagent un même plan de requêtes (GET/GETBULK fusionnés)
+    collected, failures = {}, {}
+    timed_out = False
+    snmp_started = time.monotonic()
+    poll_ts = datetime.utcnow().replace(microsecond=0)
+    if categories:
         try:
-            parsed = json.loads(raw)
-            if isinstance(parsed, (list, tuple)):
-                return list(parsed)
-        except Exception:
-            return [c.strip() for c in raw.split(",") if c.strip()]
-    return []
+            # Type d'équipement de l'inventaire (groupe) ; sinon détection via sysDescr
+            collected, failures = collect_metrics(host.ip, INVENTORY.credentials(host), host.port, categories,
+                                                  host_id=host.id, group_name=host.device_type)
+        except SnmpTimeout:
+            # Agent muet : aucune catégorie collectée (disjoncteur ouvert par l'appelant)
+            log_poller("⏱️", f"{hostname} SNMP timeout — aucune catégorie collectée")
+            timed_out = True
+        except Exception as e:
+            log_poller("⚠️", f"{hostname} SNMP erreur: {e}")
+    return {
+        "ping_ok": ping_ok,
+        "ping_error": ping_error,
+        "collected": collected,
+        "failures": failures,
+        "timed_out": timed_out,
+        "poll_ts": poll_ts,
+        "latency_ms": round((time.monotonic() - snmp_started) * 1000, 1),
+    }
+
+
+def _poll_single_host(db, Host, host, Alert, previous_status, collection):
+    """
+    Écrit le résultat d'une collecte (_collect_host) : métriques, seuils,
+    alertes et statut de l'hôte (PollSpec de l'inventaire).
+    Aucune écriture n'est validée ici : l'appelant ouvre une unité de travail
+    (`unit_of_work`) qui commit l'ensemble une seule fois.
+    Retourne un dict : status, snmp_ok, timed_out, latency_ms (durée de collecte
+    SNMP) et open_alerts (entrée de l'index des alertes ouvertes pour cet hôte).
+    """
+    host_id = host.id
+    hostname = host.hostname
+    categories = list(host.snmp_categories)
+    ping_ok = collection["ping_ok"]
+    if collection["ping_error"] is not None:
+        open_alert(db, Alert, host_id, "critical", f"Erreur reachability: {collection['ping_error']}")
+
+    # Tentative SNMP indépendante du ping : on considère SNMP OK si au moins
+    # une catégorie renvoie des données valides. Si l'hôte n'a pas de
+    # catégories SNMP configurées, on considère SNMP OK (rien à collecter).
+    snmp_ok = True if not categories else False
+    timed_out = collection["timed_out"]
+    latency_ms = collection["latency_ms"]
+    poll_ts = collection["poll_ts"]
+    collected = collection["collected"]
+    snmp_errors = 0
+    for cat, e in collection["failures"].items():
+        # L'agent répond mais refuse la requête : ce n'est pas un timeout
+        log_poller("⚠️", f"{hostname} ({cat}) SNMP erreur agent: {e}")
+        snmp_errors += 1
+
+    for cat in categories:
+        data = collected.get(cat)
+        if data is None:
+            continue
+        # Si on obtient des données, marque SNMP comme OK
+        if data:
+            snmp_ok = True
+
+        if cat == "interfaces":
+            detect_interface_changes(db, host.id, data, Alert)
+
+        # Valeurs courantes, seuils et échantillons : un seul passage (metric_pipeline)
+        persist(db, host, cat, normalize(cat, data), poll_ts, Alert,
+                warn=lambda msg: log_poller("⚠️", msg))
+
+    # 3️⃣ Statut global simplifié
+    # Déterminer le statut en se basant sur SNMP (down si SNMP KO).
+    # Si SNMP OK, vérifier s'il existe des alertes warning/critical non résolues
+    # pour promouvoir en 'warning'.
+    rtt = agent_stats(host.ip, host.port)
+    log_poller("🔍", f"host={hostname} ping_ok={ping_ok} snmp_ok={snmp_ok} prev={previous_status} "
+                     f"timeout={timed_out} erreurs={snmp_errors} srtt={rtt['srtt_ms']}ms rto={rtt['rto_ms']}ms")
+    active_problem = 0
+    open_alerts = OPEN_ALERT_INDEX.get(host_id, [])
+    try:
+        # Si SNMP est joignable, tenter de résoudre toute alerte SNMP en attente
+        # (uniquement si l'index en signale une : évite deux requêtes par hôte sain)
+        if snmp_ok and _has_open_snmp_alert(host_id):
+            try:
+                resolve_snmp_alerts(db, Alert, host_id, force=True)
+            except Exception as e:
+                log_poller("⚠️", f"Erreur lors de tentative de résolution SNMP pour {hostname}: {e}")
+
+        rows = Alert.query.with_entities(Alert.id, Alert.severity, Alert.message).filter(
+            Alert.host_id == host.id,
+            Alert.resolved_at.is_(None)
+        ).all()
+        # Trap linkUp perdu : l'interface revue 'up' par le poll clôt l'alerte du trap linkDown
+        if collected.get("interfaces"):
+            resolved = _resolve_link_down_alerts(db, Alert, host, rows, collected["interfaces"])
+            rows = [r for r in rows if r.id not in resolved]
+        open_alerts = [
+            (r.id, r.severity, ALERT_FLAG_SNMP if _is_snmp_alert(r.message) else 0)
+            for r in rows
+        ]
+        active_problem = sum(1 for r in rows if r.severity in ("warning", "critical"))
+        if snmp_ok:
+            new_status = "warning" if active_problem and active_problem > 0 else "up"
+        else:
+            # SNMP KO → host down
+            new_status = "down"
+    except Exception as e:
+        log_poller("⚠️", f"Erreur lecture alertes pour host {hostname}: {e}")
+        # En cas d'erreur, conserver le statut précédent
+        new_status = previous_status
+    if not host.last_status_change and new_status == previous_status:
+        _set_host_status(db, Host, host_id, last_status_change=datetime.utcnow())
+
+    # Si des alertes non résolues de type warning/critical existent pour cet hôte,
+    # elles doivent avoir la priorité sur 'up'. Ordre de priorité : down > warning > up.
+    # (active_problem is set above)
+
+    # 4️⃣ Changement d’état
+    if new_status != previous_status:
+        log_poller("ℹ️", f"host={hostname} status change {previous_status} -> {new_status} (snmp_ok={snmp_ok} active_problem={active_problem})")
+        # 🕓 Nouveau : enregistrer l’heure du changement d’état
+        _set_host_status(db, Host, host_id, status=new_status, last_status_change=datetime.utcnow())
+
+        if new_status == "down":
+            down_alert = open_alert(db, Alert, host_id, "critical",
+                    f"{SNMP_DOWN_MSG} sur {hostname} ({host.ip})")
+            if down_alert is not None:
+                open_alerts = [a for a in open_alerts if a[0] != down_alert.id]
+                open_alerts.append((down_alert.id, "critical", ALERT_FLAG_SNMP))
+            log_poller("❌", f"{hostname} DOWN (ping ou SNMP KO) [{host.ip}]")
+
+        elif new_status == "up":
+            # Force immediate resolution for SNMP reachability alerts
+            # Résolution robuste des alertes SNMP : utilise la fonction dédiée
+            if any(flags & ALERT_FLAG_SNMP for _, _, flags in open_alerts):
+                try:
+                    resolve_snmp_alerts(db, Alert, host_id, force=True)
+                except Exception as e:
+                    log_poller("⚠️", f"Erreur lors de la résolution d'alertes SNMP pour {hostname}: {e}")
+                open_alerts = [a for a in open_alerts if not a[2] & ALERT_FLAG_SNMP]
+
+            # 🔹 Cas 1 : Unknown → Up → première connexion, pas de mail
+            if previous_status == "unknown":
+                alert = Alert(
+                    host_id=host_id,
+                    severity="info",
+                    message=f"Connexion SNMP établie avec succès sur {hostname} ({host.ip})",
+                    created_at=datetime.utcnow()
+                )
+                db.session.add(alert)
+                log_poller("🟢", f"{hostname} ajouté avec succès [{host.ip}] (première détection)")
+
+            # 🔹 Cas 2 : Down → Up → vraie reprise → mail envoyé
+            # Ne créer l'alerte "SNMP rétabli" que si le statut précédent était "down"
+            elif previous_status == "down":
+                open_alert(db, Alert, host_id, "info",
+                        f"{SNMP_UP_MSG} sur {hostname} ({host.ip})")
+                log_poller("✅", f"Host {hostname} back UP [{host.ip}]")
+
+
+    # 5️⃣ Résumé final par hôte (traiter explicitement 'warning')
+    if new_status == "up":
+        log_poller("✅", f"Metrics updated for {hostname} [{host.ip}]")
+    elif new_status == "warning":
+        log_poller("⚠️", f"Host {hostname} WARNING — métriques partiellement dégradées [{host.ip}]")
+    else:
+        log_poller("❌", f"Host {hostname} DOWN — métriques non mises à jour")
+
+    return {
+        "status": new_status,
+        "snmp_ok": snmp_ok,
+        "timed_out": timed_out,
+        "latency_ms": latency_ms,
+        "open_alerts": open_alerts,
+    }
+
+
+def _probe_agent(host):
+    """Sonde légère du disjoncteur : un seul GET sysUpTime."""
+    try:
+        values = get_typed(host.ip, INVENTORY.credentials(host), host.port, [SYS_UPTIME_OID])
+    except Exception:
+        return False
+    # Un agent qui revient a souvent redémarré : invalide ses colonnes statiques
+    note_uptime(host.ip, host.port, values.get(SYS_UPTIME_OID))
+    return bool(values)
+
+
+def _mark_unreachable(db, Host, host, previous_status, parent):
+    """
+    Hôte derrière un parent down : aucun ping ni requête SNMP (pas de timeouts
+    à attendre), statut 'unreachable' sans alerte ni e-mail. Le poll normal
+    reprend dès que le parent est de nouveau joignable.
+    """
+    if previous_status != "unreachable":
+        _set_host_status(db, Host, host.id, status="unreachable", last_status_change=datetime.utcnow())
+        log_poller("⛓️", f"{host.hostname} UNREACHABLE — parent {parent.hostname} injoignable, poll suspendu [{host.ip}]")
+    return {
+        "status": "unreachable",
+        "snmp_ok": None,
+        "timed_out": False,
+        "latency_ms": None,
+        "open_alerts": OPEN_ALERT_INDEX.get(host.id, []),
+    }
+
+
+# ==============================================================
+# 🔹 JOB D'UN HÔTE
+# ==============================================================
+def _collection_failed(host, collection):
+    """Vrai si aucune catégorie SNMP n'a renvoyé de données (l'hôte passerait down)."""
+    return bool(host.snmp_categories) and not any(collection["collected"].values())
+
+
+def _run_host_job(db, Host, Alert, host, polled=None, stats=None):
+    """
+    Traite un hôte pour ce cycle (disjoncteur, dépendance, poll complet).
+    `polled` : ids déjà traités pendant ce cycle (un parent interrogé à la
+    demande d'un enfant n'est pas repris ensuite).
+    `stats` : bilan du cycle, où est compté le résultat d'un parent interrogé
+    à la demande (celui de l'hôte lui-même est compté par l'appelant).
+    L'échéance du cycle n'est vérifiée qu'entre deux hôtes : une chaîne de
+    parents interrogés à la demande peut dépasser POLL_CYCLE_DEADLINE.
+    Retourne "completed", "skipped" (sonde en attente, parent down) ou "failed".
+    """
+    host_id = host.id
+    hostname = host.hostname
+    polled = polled if polled is not None else set()
+    polled.add(host_id)
+    previous_status = HOST_STATE.ensure(host_id, host.status or "unknown").status
+    parent = INVENTORY.get(host.parent_id) if host.parent_id else None
+    parent_state = HOST_STATE.get(parent.id) if parent else None
+    parent_down = parent_state is not None and parent_state.status in PARENT_DOWN_STATUSES
+
+    # Disjoncteur ouvert : pas de poll complet, seulement une sonde sysUpTime
+    # selon le backoff. Le statut (down) et les alertes restent inchangés.
+    state = HOST_STATE.get(host_id)
+    if not parent_down and state.breaker_open:
+        if time.monotonic() < state.probe_at:
+            return "skipped"
+        if not _probe_agent(host):
+            backoff = HOST_STATE.trip_breaker(host_id, BREAKER_BASE_BACKOFF, BREAKER_MAX_BACKOFF)
+            HOST_STATE.record_poll(host_id, previous_status, False)
+            log_poller("🔌", f"{hostname} toujours muet — prochaine sonde dans {backoff}s")
+            return "skipped"
+        HOST_STATE.reset_breaker(host_id)
+        log_poller("🔌", f"{hostname} répond de nouveau à la sonde — reprise du poll complet")
+
+    # Collecte réseau d'abord, hors transaction : la transaction de lecture
+    # éventuellement ouverte (inventaire, hôte précédent) est close avant
+    # le ping et les échanges SNMP.
+    collection = None
+    if not parent_down:
+        if db.session.in_transaction():
+            db.session.commit()
+        collection = _collect_host(host)
+
+        # Échec de l'enfant alors que le statut du parent date d'un cycle
+        # précédent (parent pas encore dû, intervalle adaptatif) : le parent est
+        # interrogé maintenant, et l'enfant n'est déclaré down que si son
+        # parent répond encore.
+        if parent is not None and parent.id not in polled and _collection_failed(host, collection):
+            log_poller("⛓️", f"{hostname} muet — vérification immédiate du parent {parent.hostname}")
+            outcome = _run_host_job(db, Host, Alert, parent, polled, stats)
+            if stats is not None:
+                stats[outcome] += 1
+            parent_state = HOST_STATE.get(parent.id)
+            parent_down = parent_state is not None and parent_state.status in PARENT_DOWN_STATUSES
+
+    # Puis une seule transaction par hôte, limitée aux écritures : métriques,
+    # transitions d'alertes et statut sont validés en un seul commit, ou tous
+    # annulés en cas d'erreur (le cache garde alors le statut précédent).
+    try:
+        with unit_of_work(db):
+            if parent_down:
+                outcome = _mark_unreachable(db, Host, host, previous_status, parent)
+            else:
+                outcome = _poll_single_host(db, Host, host, Alert, previous_status, collection)
+    except Exception as e:
+        log_poller("💥", f"Poll de {hostname} annulé (rollback) : {e}")
+        # L'index n'est plus fiable pour cet hôte : le reconstruire au prochain poll
+        OPEN_ALERT_INDEX.pop(host_id, None)
+        HOST_STATE.schedule(host_id, _interval_bounds(host)[0])
+        return "failed"
+
+    OPEN_ALERT_INDEX[host_id] = outcome["open_alerts"]
+    if outcome["snmp_ok"] is None:
+        # Poll suspendu : ni succès ni échec SNMP à comptabiliser
+        HOST_STATE.set_status(host_id, outcome["status"])
+        _schedule_next_poll(host)
+        return "skipped"
+
+    HOST_STATE.record_poll(host_id, outcome["status"], outcome["snmp_ok"], outcome["latency_ms"])
+    if outcome["timed_out"] and not outcome["snmp_ok"]:
+        backoff = HOST_STATE.trip_breaker(host_id, BREAKER_BASE_BACKOFF, BREAKER_MAX_BACKOFF)
+        log_poller("🔌", f"{hostname} disjoncteur ouvert — sonde sysUpTime dans {backoff}s")
+    elif outcome["snmp_ok"]:
+        HOST_STATE.reset_breaker(host_id)
+    _schedule_next_poll(host)
+    return "completed"
+
+
+# ==============================================================
+# 🔹 FRÉQUENCE ADAPTATIVE
+# ==============================================================
+def _interval_bounds(host):
+    """(min, max) de l'intervalle de poll : params du template, sinon valeurs globales."""
+    params = INVENTORY.template_params(host.template_id) if host.template_id else {}
+    try:
+        low = float(params.get("poll_min_interval") or POLL_MIN_INTERVAL)
+        high = float(params.get("poll_max_interval") or POLL_MAX_INTERVAL)
+    except (TypeError, ValueError):
+        low, high = POLL_MIN_INTERVAL, POLL_MAX_INTERVAL
+    low = max(low, POLL_TICK_SECONDS)
+    return low, max(low, high)
+
+
+def _schedule_next_poll(host):
+    """
+    Planifie le prochain poll : intervalle minimal si l'hôte a une alerte
+    warning/critical ouverte, n'est pas 'up' ou a changé d'état récemment ;
+    sinon l'intervalle courant est allongé jusqu'au maximum.
+    """
+    state = HOST_STATE.get(host.id)
+    if state is None:
+        return
+    low, high = _interval_bounds(host)
+    alerts = OPEN_ALERT_INDEX.get(host.id, [])
+    volatile = (
+        state.status != "up"
+        or any(severity in ("warning", "critical") for _, severity, _ in alerts)
+        or (state.changed_at is not None and time.monotonic() - state.changed_at < RECENT_CHANGE_WINDOW)
+    )
+    if volatile or not state.interval:
+        interval = low
+    else:
+        interval = min(high, max(low, state.interval * POLL_INTERVAL_GROWTH))
+    HOST_STATE.schedule(host.id, interval)
+
+
+def _is_due(host):
+    """Hôte à traiter ce cycle : jamais planifié, échéance atteinte ou disjoncteur ouvert (sonde)."""
+    state = HOST_STATE.get(host.id)
+    return state is None or state.breaker_open or state.due
+
+
+def request_poll(host_id):
+    """
+    Demande un poll immédiat et ciblé de l'hôte (ex. trap reçu) : il devient
+    dû, son disjoncteur est refermé (l'agent vient d'émettre) et le scheduler
+    est réveillé.
+    """
+    HOST_STATE.mark_due(host_id)
+    HOST_STATE.reset_breaker(host_id)
+    POLL_WAKEUP.set()
+
+
+def _prioritize(specs):
+    """
+    Ordre de traitement du cycle : d'abord les hôtes avec une alerte
+    warning/critical active (ou down), puis les plus en retard (last_poll le plus
+    ancien). Un parent dû passe toujours avant ses enfants, quelle que soit sa
+    priorité propre : leur statut s'appuie sur son résultat de ce cycle.
+    """
+    epoch = datetime.min
+
+    def key(spec):
+        state = HOST_STATE.get(spec.id)
+        alerts = OPEN_ALERT_INDEX.get(spec.id, [])
+        alerting = (
+            (state is not None and state.status in ("down", "warning"))
+            or any(severity in ("warning", "critical") for _, severity, _ in alerts)
+        )
+        last_poll = state.last_poll if state is not None and state.last_poll else epoch
+        return (0 if alerting else 1, last_poll)
+
+    due = {spec.id for spec in specs}
+    ordered, emitted = [], set()
+    for spec in sorted(specs, key=key):
+        # Ancêtres dus pas encore placés, du plus haut au plus bas, puis l'hôte
+        chain, seen, node = [], set(), spec
+        while node is not None and node.id not in seen:
+            seen.add(node.id)
+            if node.id in due and node.id not in emitted:
+                emitted.add(node.id)
+                chain.append(node)
+            node = INVENTORY.get(node.parent_id) if node.parent_id else None
+        ordered.extend(reversed(chain))
+    return ordered
+
+
+# ==============================================================
+# 🔹 REPRISE APRÈS REDÉMARRAGE
+# ==============================================================
+def _restore_working_state(db):
+    """
+    Recharge l'état de travail au premier cycle : table host_state, puis le
+    snapshot binaire (plus récent) s'il existe. Statuts, compteurs, index des
+    alertes et types d'équipements sont repris tels quels : pas de repassage
+    par 'unknown', donc ni transitions ni alertes en rafale.
+    """
+    restored = HOST_STATE.load_from_db(db)
+    log_poller("♻️", f"{restored} état(s) d'hôte rechargé(s) depuis host_state")
+
+    snapshot = load_snapshot()
+    if not snapshot:
+        return
+    HOST_STATE.restore(snapshot["hosts"])
+    COUNTER_CACHE.update(snapshot["counters"])
+    if (datetime.utcnow() - snapshot["created"]).total_seconds() <= DEVICE_TYPE_MAX_AGE:
+        DEVICE_TYPE_CACHE.update(snapshot["device_types"])
+    OPEN_ALERT_INDEX.update(snapshot["alerts"])
+    # Les hôtes sans alerte ouverte n'apparaissent pas dans le snapshot : index vide connu
+    for host_id in snapshot["hosts"]:
+        OPEN_ALERT_INDEX.setdefault(host_id, [])
+    log_poller("♻️", f"Snapshot du {snapshot['created']} rechargé : "
+                     f"{len(snapshot['hosts'])} hôtes, {len(snapshot['counters'])} compteurs, "
+                     f"{len(snapshot['device_types'])} types d'équipements")
 
 
 # ==============================================================
 # 🔹 POLL PRINCIPAL
 # ==============================================================
 def poll_host_metrics(app, db, Host, Alert):
-    global HOST_STATUS_CACHE
+    global _host_state_loaded
 
+    started = time.monotonic()
     with app.app_context():
-        hosts = Host.query.all()
-        log_poller("📡", f"Scanning {len(hosts)} hosts...")
+        # Au premier passage, reprendre l'état sauvegardé (évite le retour en 'unknown')
+        first_cycle = not _host_state_loaded
+        if first_cycle:
+            _restore_working_state(db)
+            _host_state_loaded = True
+
+        # Seules les lignes modifiées depuis le dernier cycle sont relues
+        hosts, changed, removed = INVENTORY.refresh(db)
 
         current_ids = {h.id for h in hosts}
-        for cached_id in list(HOST_STATUS_CACHE.keys()):
+        for cached_id in HOST_STATE.ids():
             if cached_id not in current_ids:
-                HOST_STATUS_CACHE.pop(cached_id, None)
+                HOST_STATE.remove(cached_id)
+                OPEN_ALERT_INDEX.pop(cached_id, None)
                 log_poller("🗑️", f" Host ID {cached_id} supprimé du cache (n’existe plus en BDD)")
 
-        for host in hosts:
-            host_id = host.id
-            hostname = host.hostname
-            categories = _normalize_categories(host.snmp_categories)
-            previous_status = HOST_STATUS_CACHE.get(host_id, host.status or "unknown")
-            HOST_STATUS_CACHE[host_id] = previous_status
-
-            # 1️⃣ Vérif Ping
-            try:
-                ping_ok = check_host_reachability(db, host, Alert)
-            except Exception as e:
-                log_poller("⚠️", f"Erreur reachability pour {hostname}: {e}")
-                open_alert(db, Alert, host_id, "critical", f"Erreur reachability: {e}")
-                ping_ok = False
-
-            # 2️⃣ SNMP
-            # Tentative SNMP indépendante du ping : on considère SNMP OK si au moins
-            # une catégorie renvoie des données valides. Si l'hôte n'a pas de
-            # catégories SNMP configurées, on considère SNMP OK (rien à collecter).
-            snmp_ok = True if not categories else False
-            if categories:
-                for cat in categories:
-                    try:
-                        data = get_metrics(host.ip, host.snmp_community, host.port, cat)
-                        # Si on obtient des données, marque SNMP comme OK
-                        if data:
-                            snmp_ok = True
-
-                        if cat == "interfaces":
-                            detect_interface_changes(db, host.id, data, Alert)
-
-                        for oid, val in (data.items() if isinstance(data, dict) else []):
-                            try:
-                                upsert_current_metric(db, host.id, oid, oid, val, meta=cat)
-                                check_thresholds(db, host, cat, oid, val, Alert)
-                            except Exception as e_sub:
-                                log_poller("⚠️", f"{hostname} ({cat}/{oid}) erreur : {e_sub}")
-
-                            if isinstance(val, dict):
-                                for sub_key, sub_val in val.items():
-                                    db.session.add(Measurement(
-                                        host_id=host.id,
-                                        oid=f"{oid}.{sub_key}",
-                                        metric=sub_key,
-                                        value=str(sub_val),
-                                        meta=cat
-                                    ))
-                            else:
-                                db.session.add(Measurement(
-                                    host_id=host.id,
-                                    oid=oid,
-                                    metric=oid,
-                                    value=str(val),
-                                    meta=cat
-                                ))
-
-                    except Exception as e:
-                        # ne pas breaker : tenter les autres catégories — une seule
-                        # catégorie réussie suffit pour considérer SNMP OK
-                        log_poller("⚠️", f"{hostname} ({cat}) SNMP erreur: {e}")
-                        continue
-
-            # 3️⃣ Statut global simplifié
-            # Déterminer le statut en se basant sur SNMP (down si SNMP KO).
-            # Si SNMP OK, vérifier s'il existe des alertes warning/critical non résolues
-            # pour promouvoir en 'warning'.
-            log_poller("🔍", f"host={hostname} ping_ok={ping_ok} snmp_ok={snmp_ok} prev={previous_status}")
-            try:
-                if snmp_ok:
-                    # Si SNMP est joignable, tenter de résoudre toute alerte SNMP en attente
-                    try:
-                        resolve_snmp_alerts(db, Alert, host_id, force=True)
-                    except Exception as e:
-                        log_poller("⚠️", f"Erreur lors de tentative de résolution SNMP pour {hostname}: {e}")
-
-                    active_problem = Alert.query.filter(
-                        Alert.host_id == host.id,
-                        Alert.resolved_at.is_(None),
-                        Alert.severity.in_(["warning", "critical"])
-                    ).count()
-                    new_status = "warning" if active_problem and active_problem > 0 else "up"
-                else:
-                    # SNMP KO → host down
-                    active_problem = Alert.query.filter(
-                        Alert.host_id == host.id,
-                        Alert.resolved_at.is_(None),
-                        Alert.severity.in_(["warning", "critical"])
-                    ).count()
-                    new_status = "down"
-            except Exception as e:
-                log_poller("⚠️", f"Erreur lecture alertes pour host {hostname}: {e}")
-                # En cas d'erreur, conserver le statut précédent
-                new_status = previous_status
-            if not host.last_status_change:
-                host.last_status_change = datetime.utcnow()
-
-            # Si des alertes non résolues de type warning/critical existent pour cet hôte,
-            # elles doivent avoir la priorité sur 'up'. Ordre de priorité : down > warning > up.
-            # (active_problem is set above)
-
-            # 4️⃣ Changement d’état
-            if new_status != previous_status:
-                log_poller("ℹ️", f"host={hostname} status change {previous_status} -> {new_status} (snmp_ok={snmp_ok} active_problem={active_problem})")
-                HOST_STATUS_CACHE[host_id] = new_status
-                host.status = new_status
-
-                # 🕓 Nouveau : enregistrer l’heure du changement d’état
-                host.last_status_change = datetime.utcnow()
-
-                db.session.commit()
-
-                if new_status == "down":
-                    open_alert(db, Alert, host_id, "critical",
-                            f"{SNMP_DOWN_MSG} sur {hostname} ({host.ip})")
-                    log_poller("❌", f"{hostname} DOWN (ping ou SNMP KO) [{host.ip}]")
-
-                elif new_status == "up":
-                    # Force immediate resolution for SNMP reachability alerts
-                    # Résolution robuste des alertes SNMP : utilise la fonction dédiée
-                    try:
-                        resolve_snmp_alerts(db, Alert, host_id, force=True)
-                    except Exception as e:
-                        log_poller("⚠️", f"Erreur lors de la résolution d'alertes SNMP pour {hostname}: {e}")
-
-                    # 🔹 Cas 1 : Unknown → Up → première connexion, pas de mail
-                    if previous_status == "unknown":
-                        alert = Alert(
-                            host_id=host_id,
-                            severity="info",
-                            message=f"Connexion SNMP établie avec succès sur {hostname} ({host.ip})",
-                            created_at=datetime.utcnow()
-                        )
-                        db.session.add(alert)
-                        db.session.commit()
-                        log_poller("🟢", f"{hostname} ajouté avec succès [{host.ip}] (première détection)")
-
-                    # 🔹 Cas 2 : Down → Up → vraie reprise → mail envoyé
-                    # Ne créer l'alerte "SNMP rétabli" que si le statut précédent était "down"
-                    elif previous_status == "down":
-                        open_alert(db, Alert, host_id, "info",
-                                f"{SNMP_UP_MSG} sur {hostname} ({host.ip})")
-                        log_poller("✅", f"Host {hostname} back UP [{host.ip}]")
-
-
-            # 5️⃣ Résumé final par hôte (traiter explicitement 'warning')
-            if new_status == "up":
-                log_poller("✅", f"Metrics updated for {hostname} [{host.ip}]")
-            elif new_status == "warning":
-                log_poller("⚠️", f"Host {hostname} WARNING — métriques partiellement dégradées [{host.ip}]")
-            else:
-                log_poller("❌", f"Host {hostname} DOWN — métriques non mises à jour")
-
-            db.session.commit()
+        # Un hôte modifié (config, template...) est repris immédiatement et son
+        # type d'équipement redétecté (au 1er cycle, tout l'inventaire est
+        # « modifié » : le cache repris du snapshot est conservé)
+        for host_id in changed:
+            HOST_STATE.mark_due(host_id)
+            if not first_cycle:
+                spec = INVENTORY.get(host_id)
+                DEVICE_TYPE_CACHE.pop((spec.ip, spec.port), None)
+
+        # Seuls les hôtes arrivés à échéance sont traités à ce tick
+        jobs = _prioritize([h for h in hosts if _is_due(h)])
+        if not jobs:
+            HOST_STATE.flush_to_db(db)
+            return
+        log_poller("📡", f"Scanning {len(jobs)}/{len(hosts)} hosts... "
+                         f"({len(changed)} modifié(s), {len(removed)} supprimé(s))")
+
+        deadline = started + POLL_CYCLE_DEADLINE if POLL_CYCLE_DEADLINE > 0 else None
+        stats = {"completed": 0, "deferred": 0, "skipped": 0, "failed": 0}
+        polled = set()
+
+        for position, host in enumerate(jobs):
+            # Échéance dépassée : le reste est reporté au cycle suivant. Ces hôtes
+            # gardent leur last_poll et remonteront en tête (les plus en retard).
+            if deadline is not None and time.monotonic() >= deadline:
+                stats["deferred"] = sum(1 for h in jobs[position:] if h.id not in polled)
+                log_poller("⏳", f"Échéance de cycle ({POLL_CYCLE_DEADLINE:.0f}s) atteinte — "
+                                 f"{stats['deferred']} hôte(s) reporté(s) au cycle suivant")
+                break
+            if host.id in polled:
+                continue  # déjà interrogé à la demande d'un enfant
+            stats[_run_host_job(db, Host, Alert, host, polled, stats)] += 1
+
+        # Sauvegarde périodique du registre (lu par les workers web)
+        HOST_STATE.flush_to_db(db)
+
+    # Snapshot binaire de l'état de travail (reprise rapide après redémarrage)
+    try:
+        # Types d'équipements : seuls les agents encore inventoriés sont conservés
+        agents = {(h.ip, h.port) for h in INVENTORY.specs()}
+        device_types = {agent: group for agent, group in list(DEVICE_TYPE_CACHE.items()) if agent in agents}
+        save_snapshot(HOST_STATE.states(), dict(COUNTER_CACHE), OPEN_ALERT_INDEX, device_types)
+    except Exception as e:
+        log_poller("⚠️", f"Écriture du snapshot impossible : {e}")
+
+    # Bilan du cycle : sert à dimensionner les collecteurs sur des chiffres réels
+    duration = time.monotonic() - started
+    LAST_CYCLE_STATS.clear()
+    LAST_CYCLE_STATS.update(stats, total=len(jobs), not_due=len(hosts) - len(jobs), duration_s=round(duration, 2),
+                            deadline_s=POLL_CYCLE_DEADLINE, finished_at=datetime.utcnow().isoformat())
+    log_poller("⏱️", f"Cycle en {duration:.1f}s — {stats['completed']} terminé(s), {stats['deferred']} reporté(s), "
+                     f"{stats['skipped']} ignoré(s), {stats['failed']} en échec")
 
     # Résumé global
-    up = sum(1 for s in HOST_STATUS_CACHE.values() if s == "up")
-    warning = sum(1 for s in HOST_STATUS_CACHE.values() if s == "warning")
-    down = sum(1 for s in HOST_STATUS_CACHE.values() if s == "down")
-    log_poller("📊", f"Scan terminé — {up} UP, {warning} WARNING, {down} DOWN")
-    # Dump du cache complet pour debug
+    statuses = HOST_STATE.statuses()
+    up = sum(1 for s in statuses.values() if s == "up")
+    warning = sum(1 for s in statuses.values() if s == "warning")
+    down = sum(1 for s in statuses.values() if s == "down")
+    unreachable = sum(1 for s in statuses.values() if s == "unreachable")
+    log_poller("📊", f"Scan terminé — {up} UP, {warning} WARNING, {down} DOWN, {unreachable} UNREACHABLE")
+    # Dump du registre complet pour debug
     try:
-        cache_snapshot = ", ".join(f"{k}:{v}" for k, v in HOST_STATUS_CACHE.items())
-        log_poller("📚", f"HOST_STATUS_CACHE: {cache_snapshot}")
+        cache_snapshot = ", ".join(f"{k}:{v}" for k, v in statuses.items())
+        log_poller("📚", f"HOST_STATE: {cache_snapshot}")
     except Exception:
         pass
 
@@ -233,22 +662,28 @@ def poll_host_metrics(app, db, Host, Alert):
 _scheduler_started = False
 
 def start_scheduler(app, db, Host, Alert):
-    """Démarre le scheduler SNMP en thread séparé (toutes les 15 secondes)."""
+    """
+    Démarre le scheduler SNMP en thread séparé. Il se réveille toutes les
+    POLL_TICK_SECONDS et ne traite que les hôtes arrivés à échéance.
+    """
     global _scheduler_started
     if _scheduler_started:
         log_poller("⚪", "Scheduler déjà en cours — démarrage ignoré (évite doublons Flask debug).")
         return
 
     _scheduler_started = True
-    log_poller("🚀", "SNMP scheduler started (15s interval)")
+    log_poller("🚀", f"SNMP scheduler started (tick {POLL_TICK_SECONDS:.0f}s, "
+                     f"intervalle {POLL_MIN_INTERVAL:.0f}-{POLL_MAX_INTERVAL:.0f}s)")
 
     def loop():
         while True:
+            POLL_WAKEUP.clear()
             try:
                 poll_host_metrics(app, db, Host, Alert)
             except Exception as e:
                 log_poller("💥", f"Erreur dans poll_host_metrics(): {e}")
-            time.sleep(15)
+            # Attente du tick suivant, interrompue par request_poll()
+            POLL_WAKEUP.wait(POLL_TICK_SECONDS)
 
     t = threading.Thread(target=loop, daemon=True)
     t.start()
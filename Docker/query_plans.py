@@ -0,0 +1,103 @@
+"""
+Contrôle des plans d'exécution des requêtes d'historique et de logs.
+
+    python query_plans.py
+
+Code de sortie 1 si une requête ne peut plus utiliser (ou n'utilise pas)
+son index, 0 sinon. Lancé aussi au démarrage par app.py (journal seulement).
+"""
+import sys
+from datetime import datetime, timedelta
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Contrôle des plans d'exécution (MySQL)
+# ─────────────────────────────────────────────
+# Vérifie par EXPLAIN que les requêtes d'historique et de logs s'appuient sur
+# leurs index : l'index attendu doit figurer dans possible_keys et, dès que la
+# table a assez de lignes, être la clé réellement choisie (`key`). Sur une
+# table presque vide, l'optimiseur préfère parfois un parcours complet, ce
+# qui n'est pas une régression.
+QUERY_PLAN_PROBLEMS = []
+
+# Lignes estimées (information_schema) à partir desquelles `key` est contrôlée
+PLAN_KEY_MIN_ROWS = 1000
+
+
+def _plan_checks(db):
+    """[(nom, requête, {table: index attendu})] sur les requêtes réelles des routes."""
+    from series_store import samples_query
+    from routes.logs import _text_query
+
+    since = datetime.utcnow() - timedelta(hours=1)
+    return [
+        ("metrics_history", samples_query(db, 1, "cpu", since),
+         {"metric_series": "uq_series_host_cat_name", "metric_samples": "PRIMARY"}),
+        ("logs_text", _text_query(1, None, "system", since, 1000),
+         {"measurements": "idx_meas_host_cat_ts"}),
+    ]
+
+
+def explain(db, query):
+    """Lignes EXPLAIN (dicts) d'une requête ORM."""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    result = db.session.connection().exec_driver_sql("EXPLAIN " + str(compiled), compiled.params)
+    return [dict(row) for row in result.mappings()]
+
+
+def _table_rows(db, table):
+    """Nombre de lignes estimé par InnoDB (0 si inconnu)."""
+    rows = db.session.execute(db.text(
+        "SELECT TABLE_ROWS FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+    ), {"table": table}).scalar()
+    return rows or 0
+
+
+def check_query_plans(db):
+    """Retourne (et journalise) la liste des requêtes qui ne peuvent plus utiliser leur index."""
+    if db.engine.dialect.name != "mysql":
+        return []
+    problems = []
+    for name, query, expected in _plan_checks(db):
+        try:
+            plan = explain(db, query)
+        except Exception as e:
+            problems.append(f"{name} : EXPLAIN impossible ({e})")
+            continue
+        for row in plan:
+            index = expected.get(row.get("table"))
+            if index is None:
+                continue
+            possible = (row.get("possible_keys") or "").split(",")
+            if index not in possible:
+                problems.append(f"{name} : {row['table']} sans {index} "
+                                f"(type={row.get('type')}, possible_keys={row.get('possible_keys')})")
+            elif row.get("key") != index and _table_rows(db, row["table"]) >= PLAN_KEY_MIN_ROWS:
+                problems.append(f"{name} : {row['table']} n'utilise pas {index} "
+                                f"(type={row.get('type')}, key={row.get('key')})")
+    db.session.rollback()
+
+    QUERY_PLAN_PROBLEMS[:] = problems
+    for problem in problems:
+        logger.warning(f"[plans] ⚠️ {problem}")
+    if not problems:
+        logger.info("[plans] ✅ Requêtes d'historique et de logs indexées")
+    return problems
+
+
+if __name__ == "__main__":
+    from app import app
+    from database import db
+
+    with app.app_context():
+        if db.engine.dialect.name != "mysql":
+            print("[plans] Contrôle réservé à MySQL")
+            sys.exit(0)
+        found = check_query_plans(db)
+    for problem in found:
+        print(f"❌ {problem}")
+    if not found:
+        print("✅ Requêtes d'historique et de logs indexées")
+    sys.exit(1 if found else 0)
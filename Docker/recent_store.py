@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Fenêtre récente en mémoire (tampons circulaires)
+# ─────────────────────────────────────────────
+# Chaque série numérique écrite par le poller (ou api_poll) est aussi copiée
+# dans un tampon circulaire de taille fixe : deux array('d') préalloués (ts
+# epoch, valeur). L'historique des dernières heures est servi depuis ces
+# tampons sans requête MySQL, tant qu'ils couvrent toute la fenêtre demandée.
+RECENT_ENABLED = os.getenv("RECENT_ENABLED", "1") == "1"
+RECENT_WINDOW_SECONDS = int(os.getenv("RECENT_WINDOW_SECONDS", str(3 * 3600)))
+# Pas minimal entre deux échantillons d'une série (intervalle de poll minimal)
+RECENT_MIN_STEP = float(os.getenv("POLL_MIN_INTERVAL", "15"))
+# Budget mémoire total des tampons (Mo) : borne le nombre de séries suivies
+RECENT_MAX_MB = float(os.getenv("RECENT_MAX_MB", "64"))
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch(ts):
+    return (ts - EPOCH).total_seconds()
+
+
+class RingBuffer:
+    """Derniers `capacity` échantillons (ts epoch, valeur) d'une série."""
+    __slots__ = ("ts", "values", "head", "size", "started")
+
+    def __init__(self, capacity, started):
+        self.ts = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.head = 0      # prochain emplacement écrit
+        self.size = 0
+        self.started = started   # epoch du premier échantillon reçu par ce tampon
+
+    @property
+    def capacity(self):
+        return len(self.ts)
+
+    @property
+    def full(self):
+        return self.size == len(self.ts)
+
+    def append(self, ts, value):
+        self.ts[self.head] = ts
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.ts)
+        if self.size < len(self.ts):
+            self.size += 1
+
+    def oldest(self):
+        return self.ts[(self.head - self.size) % len(self.ts)] if self.size else None
+
+    def since(self, start, end=None):
+        """Échantillons [(ts, valeur)] tels que start <= ts < end, en ordre chronologique."""
+        first = (self.head - self.size) % len(self.ts)
+        # Vue chronologique : deux tranches contiguës du tableau circulaire
+        if first + self.size <= len(self.ts):
+            ts = self.ts[first:first + self.size]
+            values = self.values[first:first + self.size]
+        else:
+            ts = self.ts[first:] + self.ts[:self.head]
+            values = self.values[first:] + self.values[:self.head]
+        lo = bisect_left(ts, start)
+        hi = len(ts) if end is None else bisect_left(ts, end)
+        return list(zip(ts[lo:hi], values[lo:hi]))
+
+
+class RecentStore:
+    """Tampons par (hôte, catégorie) → {nom de série: RingBuffer}, bornés en mémoire."""
+
+    def __init__(self, window_seconds, min_step, max_bytes):
+        self.capacity = max(2, int(window_seconds / min_step) + 1)
+        self.max_series = int(max_bytes // (16 * self.capacity))
+        self.window = window_seconds
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._started = {}        # (hôte, catégorie) → epoch du premier échantillon
+        self._incomplete = set()  # groupes dont une série n'a pas eu de tampon (budget atteint)
+        self._series = 0
+
+    def add(self, host_id, category, ts, samples):
+        """
+        Ajoute des échantillons numériques [(nom, valeur)] au même horodatage,
+        déjà validés en base (appelé après le commit).
+        """
+        key = (host_id, category)
+        stamp = _epoch(ts)
+        with self._lock:
+            group = self._buffers.setdefault(key, {})
+            self._started.setdefault(key, stamp)
+            for name, value in samples:
+                buffer = group.get(name)
+                if buffer is None:
+                    if self._series >= self.max_series:
+                        self._incomplete.add(key)
+                        continue
+                    buffer = group[name] = RingBuffer(self.capacity, stamp)
+                    self._series += 1
+                if buffer.size and stamp <= buffer.ts[(buffer.head - 1) % buffer.capacity]:
+                    continue  # doublon / échantillon en retard : l'ordre chronologique prime
+                buffer.append(stamp, value)
+
+    def read(self, host_id, category, since, until=None):
+        """
+        [(nom, ts, valeur)] en ordre chronologique si les tampons couvrent toute
+        la fenêtre, sinon None (l'appelant lit alors la base).
+        """
+        key = (host_id, category)
+        start = _epoch(since)
+        end = _epoch(until) if until is not None else None
+        with self._lock:
+            started = self._started.get(key)
+            if started is None or start < started or key in self._incomplete:
+                return None
+            if time.time() - start > self.window:
+                return None
+            rows = []
+            for name, buffer in self._buffers[key].items():
+                # Série apparue après le début de la fenêtre (nouvelle interface…) :
+                # la base peut en avoir un historique antérieur
+                if buffer.started > start:
+                    return None
+                # Tampon plein dont le plus ancien point est dans la fenêtre : début perdu
+                if buffer.full and buffer.oldest() > start:
+                    return None
+                rows.extend((name, ts, value) for ts, value in buffer.since(start, end))
+        rows.sort(key=lambda r: r[1])
+        return [(name, EPOCH + timedelta(seconds=ts), value) for name, ts, value in rows]
+
+    def forget_host(self, host_id):
+        with self._lock:
+            for key in [k for k in self._buffers if k[0] == host_id]:
+                self._series -= len(self._buffers.pop(key))
+                self._started.pop(key, None)
+                self._incomplete.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "series": self._series,
+                "max_series": self.max_series,
+                "capacity": self.capacity,
+                "memory_mb": round(self._series * 16 * self.capacity / 1_048_576, 1),
+            }
+
+
+RECENT = RecentStore(RECENT_WINDOW_SECONDS, RECENT_MIN_STEP, RECENT_MAX_MB * 1_048_576)
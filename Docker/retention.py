@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Rétention des mesures (partitions journalières)
+# ─────────────────────────────────────────────
+# Sous MySQL, `measurements`, `metric_samples` et les tables d'agrégats sont
+# partitionnées par jour (RANGE sur UNIX_TIMESTAMP(ts), partitions pAAAAMMJJ
+# + pfuture MAXVALUE). Le job crée les partitions des jours à venir et
+# supprime celles dont toutes les lignes ont dépassé la rétention : un DROP
+# PARTITION prend quelques millisecondes là où un DELETE de plusieurs millions
+# de lignes verrouille la table. Table non partitionnée (SQLite de test, base
+# pas encore migrée) : DELETE par lots de RETENTION_DELETE_CHUNK lignes, un
+# commit par lot.
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "1") == "1"
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))      # secondes entre deux passes
+RETENTION_PRECREATE_DAYS = int(os.getenv("RETENTION_PRECREATE_DAYS", "3"))
+RETENTION_DELETE_CHUNK = int(os.getenv("RETENTION_DELETE_CHUNK", "5000"))
+
+# Table → durée de conservation (jours)
+RETENTION_POLICIES = {
+    "measurements": int(os.getenv("RETENTION_MEASUREMENTS_DAYS", "30")),
+    "metric_samples": int(os.getenv("RETENTION_SAMPLES_DAYS", "30")),
+    # Heures compactées de metric_samples (chunk_store.py) : même durée
+    "metric_chunks": int(os.getenv("RETENTION_SAMPLES_DAYS", "30")),
+    # Agrégats (rollups.py) : plus la résolution est grossière, plus on garde
+    "metric_rollup_1m": int(os.getenv("RETENTION_ROLLUP_1M_DAYS", "7")),
+    "metric_rollup_5m": int(os.getenv("RETENTION_ROLLUP_5M_DAYS", "90")),
+    "metric_rollup_1h": int(os.getenv("RETENTION_ROLLUP_1H_DAYS", "730")),
+}
+
+FUTURE_PARTITION = "pfuture"
+
+# Dernier passage, exposé par /healthz
+RETENTION_STATS = {"last_run": None, "dropped_partitions": 0, "created_partitions": 0, "deleted_rows": 0}
+
+
+def _partition_name(day):
+    return f"p{day:%Y%m%d}"
+
+
+def _partitions(db, table):
+    """Partitions RANGE de la table {nom: borne supérieure (epoch)}, vide si non partitionnée."""
+    rows = db.session.execute(db.text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL"
+    ), {"table": table}).all()
+    return {name: (None if bound == "MAXVALUE" else int(bound)) for name, bound in rows}
+
+
+def _day_partition(day):
+    upper = (day + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00")
+    return f"PARTITION {_partition_name(day)} VALUES LESS THAN (UNIX_TIMESTAMP('{upper}'))"
+
+
+def _initial_partitions(db, table, today, cutoff):
+    """
+    Premier découpage d'une table qui n'a encore que pfuture (juste migrée) :
+    tout son historique y est. Les lignes hors rétention sont d'abord purgées
+    par lots, puis pfuture est découpée en UNE réorganisation en partitions
+    journalières, du jour le plus ancien restant à aujourd'hui +
+    RETENTION_PRECREATE_DAYS : chaque jour tombe dans sa partition et expire
+    à son heure. Coût unique (copie des lignes conservées sous verrou de
+    métadonnées), voir migration 002. Retourne (créées, lignes purgées).
+    """
+    deleted = _chunked_delete(db, table, cutoff)
+    oldest = db.session.execute(db.text(f"SELECT MIN(ts) FROM `{table}`")).scalar()
+    first = min(oldest.replace(hour=0, minute=0, second=0, microsecond=0), today) if oldest else today
+    days = [first + timedelta(days=i) for i in range((today - first).days + RETENTION_PRECREATE_DAYS + 1)]
+    db.session.execute(db.text(
+        f"ALTER TABLE `{table}` REORGANIZE PARTITION {FUTURE_PARTITION} INTO ("
+        + ", ".join(_day_partition(day) for day in days)
+        + f", PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+    ))
+    return len(days), deleted
+
+
+def _create_partitions(db, table, existing, today):
+    """Découpe pfuture pour couvrir aujourd'hui + RETENTION_PRECREATE_DAYS jours."""
+    created = 0
+    for offset in range(RETENTION_PRECREATE_DAYS + 1):
+        day = today + timedelta(days=offset)
+        name = _partition_name(day)
+        if name in existing:
+            continue
+        # Une partition plus récente existe déjà : ce jour est couvert par celle-ci
+        later = [n for n in existing if n != FUTURE_PARTITION and n > name]
+        if later:
+            continue
+        # pfuture est vide (jours déjà pré-créés) : découpage sans copie de lignes
+        db.session.execute(db.text(
+            f"ALTER TABLE `{table}` REORGANIZE PARTITION {FUTURE_PARTITION} INTO ("
+            f"{_day_partition(day)}, "
+            f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+        ))
+        existing[name] = None
+        created += 1
+    return created
+
+
+def _drop_expired_partitions(db, table, existing, cutoff):
+    """Supprime les partitions dont la borne supérieure est antérieure à `cutoff`."""
+    cutoff_epoch = db.session.execute(
+        db.text("SELECT UNIX_TIMESTAMP(:cutoff)"), {"cutoff": cutoff.strftime("%Y-%m-%d %H:%M:%S")}
+    ).scalar()
+    expired = sorted(
+        name for name, bound in existing.items()
+        if name != FUTURE_PARTITION and bound is not None and bound <= cutoff_epoch
+    )
+    if expired:
+        db.session.execute(db.text(f"ALTER TABLE `{table}` DROP PARTITION {', '.join(expired)}"))
+    return len(expired)
+
+
+def _chunked_delete(db, table, cutoff):
+    """DELETE par lots (table non partitionnée) ; retourne le nombre de lignes supprimées."""
+    if db.engine.dialect.name == "sqlite":
+        # SQLite n'accepte pas DELETE ... LIMIT : lot choisi par rowid
+        stmt = db.text(
+            f"DELETE FROM {table} WHERE rowid IN "
+            f"(SELECT rowid FROM {table} WHERE ts < :cutoff LIMIT :chunk)"
+        )
+    else:
+        stmt = db.text(f"DELETE FROM `{table}` WHERE ts < :cutoff LIMIT :chunk")
+
+    deleted = 0
+    while True:
+        count = db.session.execute(stmt, {"cutoff": cutoff, "chunk": RETENTION_DELETE_CHUNK}).rowcount
+        db.session.commit()
+        deleted += count
+        if count < RETENTION_DELETE_CHUNK:
+            return deleted
+        # Laisse respirer les écritures du poller entre deux lots
+        time.sleep(0.05)
+
+
+def apply_retention(db, now=None):
+    """Une passe de maintenance sur toutes les tables de RETENTION_POLICIES."""
+    now = now or datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    mysql = db.engine.dialect.name == "mysql"
+
+    for table, days in RETENTION_POLICIES.items():
+        cutoff = now - timedelta(days=days)
+        try:
+            existing = _partitions(db, table) if mysql else {}
+            if set(existing) == {FUTURE_PARTITION}:
+                created, deleted = _initial_partitions(db, table, today, cutoff)
+                RETENTION_STATS["created_partitions"] += created
+                RETENTION_STATS["deleted_rows"] += deleted
+                logger.info(f"[retention] {table} : premier découpage, {deleted} ligne(s) purgée(s), "
+                            f"{created} partition(s) journalière(s) créée(s)")
+            elif existing:
+                created = _create_partitions(db, table, existing, today)
+                dropped = _drop_expired_partitions(db, table, existing, cutoff)
+                RETENTION_STATS["created_partitions"] += created
+                RETENTION_STATS["dropped_partitions"] += dropped
+                if created or dropped:
+                    logger.info(f"[retention] {table} : {created} partition(s) créée(s), {dropped} supprimée(s)")
+            else:
+                deleted = _chunked_delete(db, table, cutoff)
+                RETENTION_STATS["deleted_rows"] += deleted
+                if deleted:
+                    logger.info(f"[retention] {table} : {deleted} ligne(s) de plus de {days} j supprimée(s)")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[retention] ❌ Maintenance de {table} échouée : {e}")
+    from series_store import SERIES_BACKEND
+    if SERIES_BACKEND == "mmap":
+        # Backend fichiers : un segment par jour, supprimé comme une partition
+        try:
+            from mmap_store import get_store
+            dropped = get_store().drop_before(now - timedelta(days=RETENTION_POLICIES["metric_samples"]))
+            RETENTION_STATS["dropped_partitions"] += dropped
+        except Exception as e:
+            logger.error(f"[retention] ❌ Purge des segments mmap échouée : {e}")
+    RETENTION_STATS["last_run"] = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+_retention_started = False
+
+
+def start_retention_job(app, db):
+    """Lance la maintenance des partitions / la purge en thread séparé."""
+    global _retention_started
+    if _retention_started or not RETENTION_ENABLED:
+        return
+    _retention_started = True
+    logger.info(f"[retention] 🚀 Job de rétention démarré (toutes les {RETENTION_INTERVAL}s) : "
+                + ", ".join(f"{t}={d}j" for t, d in RETENTION_POLICIES.items()))
+
+    def loop():
+        while True:
+            with app.app_context():
+                try:
+                    apply_retention(db)
+                except Exception as e:
+                    logger.error(f"[retention] 💥 Erreur de maintenance : {e}")
+                finally:
+                    db.session.remove()
+            time.sleep(RETENTION_INTERVAL)
+
+    threading.Thread(target=loop, daemon=True, name="retention").start()
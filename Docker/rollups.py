@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+from sqlalchemy import insert
+from models import MetricSample, MetricRollup1m, MetricRollup5m, MetricRollup1h, RollupWatermark
+from retention import RETENTION_POLICIES
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Agrégats continus (1 min / 5 min / 1 h)
+# ─────────────────────────────────────────────
+# Chaque résolution est calculée depuis la précédente (brut → 1 min → 5 min
+# → 1 h), de façon incrémentale à partir d'un filigrane : seuls les
+# intervalles clos (antérieurs à maintenant - ROLLUP_LAG, et au filigrane de
+# la résolution source) sont agrégés, une seule fois.
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "1") == "1"
+ROLLUP_INTERVAL = int(os.getenv("ROLLUP_INTERVAL", "60"))   # secondes entre deux passes
+ROLLUP_LAG = int(os.getenv("ROLLUP_LAG", "120"))            # marge pour les écritures tardives
+# Nombre de points minimal par série pour qu'une résolution soit retenue à la lecture
+ROLLUP_MIN_POINTS = int(os.getenv("ROLLUP_MIN_POINTS", "200"))
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class RollupLevel(NamedTuple):
+    resolution: int            # secondes
+    model: type
+    source: Optional[int]      # résolution source (None : échantillons bruts)
+    max_span: int              # secondes de source traitées par passe
+
+
+ROLLUP_LEVELS = (
+    RollupLevel(60, MetricRollup1m, None, 3600),
+    RollupLevel(300, MetricRollup5m, 60, 6 * 3600),
+    RollupLevel(3600, MetricRollup1h, 300, 3 * 86400),
+)
+LEVELS = {level.resolution: level for level in ROLLUP_LEVELS}
+
+# Dernière passe, exposée par /healthz
+ROLLUP_STATS = {"last_run": None, "buckets_written": 0, "watermarks": {}}
+
+
+def bucket_start(ts, resolution):
+    """Début de l'intervalle de `resolution` secondes contenant `ts` (UTC naïf)."""
+    seconds = int((ts - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def aggregate(rows, resolution):
+    """
+    Agrège des lignes (clé, ts, min, max, moyenne, dernière, nombre), triées
+    par ts, en intervalles de `resolution` : {(clé, début): [min, max, somme, dernière, nombre]}.
+    Un échantillon brut est une ligne (clé, ts, v, v, v, v, 1).
+    """
+    buckets = {}
+    for key, ts, low, high, avg, last, count in rows:
+        slot = (key, bucket_start(ts, resolution))
+        bucket = buckets.get(slot)
+        if bucket is None:
+            buckets[slot] = [low, high, avg * count, last, count]
+            continue
+        if low < bucket[0]:
+            bucket[0] = low
+        if high > bucket[1]:
+            bucket[1] = high
+        bucket[2] += avg * count
+        bucket[3] = last
+        bucket[4] += count
+    return buckets
+
+
+def watermarks(db):
+    """Filigranes connus {résolution: datetime}."""
+    return dict(db.session.query(RollupWatermark.resolution, RollupWatermark.watermark).all())
+
+
+def _source_rows(db, level, start, end):
+    if level.source is None:
+        q = (db.session.query(MetricSample.series_id, MetricSample.ts, MetricSample.value)
+             .filter(MetricSample.ts >= start, MetricSample.ts < end)
+             .order_by(MetricSample.ts))
+        return ((sid, ts, v, v, v, v, 1) for sid, ts, v in q.yield_per(5000))
+    src = LEVELS[level.source].model
+    return (db.session.query(src.series_id, src.ts, src.min_value, src.max_value,
+                             src.avg_value, src.last_value, src.count)
+            .filter(src.ts >= start, src.ts < end)
+            .order_by(src.ts)
+            .yield_per(5000))
+
+
+def _first_source_ts(db, level):
+    src = MetricSample if level.source is None else LEVELS[level.source].model
+    return db.session.query(db.func.min(src.ts)).scalar()
+
+
+def roll_up(db, level, now, marks):
+    """
+    Une passe pour une résolution : agrège au plus `max_span` secondes de
+    source après le filigrane. Retourne False quand il n'y a plus rien à faire.
+    """
+    end_limit = bucket_start(now - timedelta(seconds=ROLLUP_LAG), level.resolution)
+    if level.source is not None:
+        if level.source not in marks:
+            return False
+        end_limit = min(end_limit, bucket_start(marks[level.source], level.resolution))
+
+    start = marks.get(level.resolution)
+    if start is None:
+        first = _first_source_ts(db, level)
+        if first is None:
+            return False
+        start = bucket_start(first, level.resolution)
+    if start >= end_limit:
+        return False
+    end = min(end_limit, start + timedelta(seconds=level.max_span))
+
+    buckets = aggregate(_source_rows(db, level, start, end), level.resolution)
+    if buckets:
+        stmt = (insert(level.model.__table__)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite"))
+        db.session.execute(stmt, [
+            {"series_id": sid, "ts": ts, "min_value": low, "max_value": high,
+             "avg_value": total / count, "last_value": last, "count": count}
+            for (sid, ts), (low, high, total, last, count) in buckets.items()
+        ])
+    # Agrégats et filigrane avancent dans la même transaction
+    mark = db.session.get(RollupWatermark, level.resolution)
+    if mark is None:
+        db.session.add(RollupWatermark(resolution=level.resolution, watermark=end))
+    else:
+        mark.watermark = end
+    db.session.commit()
+    marks[level.resolution] = end
+    ROLLUP_STATS["buckets_written"] += len(buckets)
+    return True
+
+
+def run_rollups(db, now=None):
+    """Rattrape toutes les résolutions, de la plus fine à la plus grossière."""
+    now = now or datetime.utcnow()
+    marks = watermarks(db)
+    for level in ROLLUP_LEVELS:
+        try:
+            while roll_up(db, level, now, marks):
+                pass
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[rollup] ❌ Agrégation {level.resolution}s échouée : {e}")
+            break
+    ROLLUP_STATS["last_run"] = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+    ROLLUP_STATS["watermarks"] = {res: ts.strftime("%Y-%m-%dT%H:%M:%SZ") for res, ts in marks.items()}
+
+
+def pick_resolution(window_seconds, marks):
+    """
+    Résolution la plus grossière qui donne encore ROLLUP_MIN_POINTS points sur
+    la fenêtre, déjà alimentée et conservée assez longtemps ; 0 = échantillons bruts.
+    """
+    for level in reversed(ROLLUP_LEVELS):
+        retention = RETENTION_POLICIES.get(level.model.__tablename__, 0) * 86400
+        if (level.resolution in marks
+                and window_seconds / level.resolution >= ROLLUP_MIN_POINTS
+                and retention >= window_seconds):
+            return level.resolution
+    return 0
+
+
+_rollup_started = False
+
+
+def start_rollup_job(app, db):
+    """Lance le downsampler (et le compacteur de chunks) en thread séparé."""
+    from chunk_store import run_compaction
+    global _rollup_started
+    if _rollup_started or not ROLLUP_ENABLED:
+        return
+    _rollup_started = True
+    logger.info(f"[rollup] 🚀 Downsampler démarré (toutes les {ROLLUP_INTERVAL}s, "
+                f"résolutions {', '.join(f'{l.resolution}s' for l in ROLLUP_LEVELS)})")
+
+    def loop():
+        while True:
+            with app.app_context():
+                try:
+                    run_rollups(db)
+                    # Les heures brutes agrégées (et assez anciennes) sont ensuite compressées
+                    run_compaction(db)
+                except Exception as e:
+                    logger.error(f"[rollup] 💥 Erreur du downsampler : {e}")
+                finally:
+                    db.session.remove()
+            time.sleep(ROLLUP_INTERVAL)
+
+    threading.Thread(target=loop, daemon=True, name="rollup").start()
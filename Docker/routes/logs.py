@@ -1,5 +1,8 @@
 from flask import Blueprint, render_template, request, send_file
-from models import db, Host, Group, Measurement
+from models import db, Host, Group, Measurement, MetricSeries, MetricSample
+from rollups import LEVELS, pick_resolution, watermarks
+from chunk_store import read_chunk_logs
+from series_store import SERIES_BACKEND, read_log_samples
 from datetime import datetime, timedelta
 from io import BytesIO
 import pandas as pd
@@ -8,6 +11,67 @@ import pandas as pd
 
 bp = Blueprint("logs", __name__)
 
+
+def _sample_query(host_id, group_id, category, start_time, limit, resolution):
+    """Séries numériques : brutes, ou moyennes de l'agrégat adapté sur une longue période."""
+    if resolution:
+        model = LEVELS[resolution].model
+        ts_col, value_col = model.ts, model.avg_value
+    else:
+        model, ts_col, value_col = MetricSample, MetricSample.ts, MetricSample.value
+    query = (
+        db.session.query(ts_col, Host, MetricSeries.category, MetricSeries.name, value_col)
+        .join(MetricSeries, MetricSeries.id == model.series_id)
+        .join(Host, Host.id == MetricSeries.host_id)
+        .filter(ts_col >= start_time)
+    )
+    if host_id:
+        query = query.filter(MetricSeries.host_id == host_id)
+    if group_id:
+        query = query.filter(Host.group_id == group_id)
+    if category:
+        query = query.filter(MetricSeries.category == category)
+    return query.order_by(ts_col.desc()).limit(limit)
+
+
+def _text_query(host_id, group_id, category, start_time, limit):
+    """Mesures texte ; (host_id, category, ts) est couvert par idx_meas_host_cat_ts."""
+    query = (
+        db.session.query(Measurement.ts, Host, Measurement.category, Measurement.metric,
+                         Measurement.value, Measurement.oid)
+        .join(Host, Host.id == Measurement.host_id)
+        .filter(Measurement.ts >= start_time)
+    )
+    if host_id:
+        query = query.filter(Measurement.host_id == host_id)
+    if group_id:
+        query = query.filter(Host.group_id == group_id)
+    if category:
+        query = query.filter(Measurement.category == category)
+    return query.order_by(Measurement.ts.desc()).limit(limit)
+
+
+def _fetch_logs(host_id, group_id, category, start_time, limit):
+    """
+    Lignes de log des deux stockages (séries numériques + mesures texte),
+    fusionnées par horodatage décroissant : [(ts, host, catégorie, métrique, valeur)].
+    """
+    if SERIES_BACKEND == "mmap":
+        # Séries numériques en fichiers colonnes : metric_samples reste vide
+        rows = read_log_samples(db, start_time, host_id, group_id, category, limit)
+    else:
+        resolution = pick_resolution((datetime.utcnow() - start_time).total_seconds(), watermarks(db))
+        rows = list(_sample_query(host_id, group_id, category, start_time, limit, resolution))
+        if not resolution and len(rows) < limit:
+            # Heures brutes déjà compactées (chunk_store.py), décodées à la volée
+            rows += read_chunk_logs(db, start_time, host_id, group_id, category)
+    rows += [
+        (ts, host, cat or "?", metric or oid, value)
+        for ts, host, cat, metric, value, oid in _text_query(host_id, group_id, category, start_time, limit)
+    ]
+    rows.sort(key=lambda r: r[0], reverse=True)
+    return rows[:limit]
+
 # ---------------------------------------------------------------------
 # 🧾 Page d'affichage des logs SNMP
 # ---------------------------------------------------------------------
@@ -32,29 +96,16 @@ def logs_view():
     }
     start_time = now - delta_map.get(duration, timedelta(hours=1))
 
-    # 🔹 Construction de la requête
-    query = Measurement.query.join(Host).filter(Measurement.ts >= start_time)
-    if host_id:
-        query = query.filter(Measurement.host_id == host_id)
-    if group_id:
-        query = query.filter(Host.group_id == group_id)
-    if category:
-        # ⚠️ Le champ "meta" contient la catégorie ("cpu", "storage", etc.)
-        query = query.filter(Measurement.meta.like(f'"{category}"'))
-
-    logs = query.order_by(Measurement.ts.desc()).limit(1000).all()
-
     # 🔹 Mise en forme pour l'affichage
     formatted_logs = []
-    for m in logs:
-        host = Host.query.get(m.host_id)
+    for ts, host, cat, metric, value in _fetch_logs(host_id, group_id, category, start_time, 1000):
         formatted_logs.append({
-            "ts": m.ts.strftime("%Y-%m-%d %H:%M:%S"),
-            "host": host.hostname if host else "?",
-            "ip": host.ip if host else "?",
-            "meta": m.meta.strip('"') if m.meta else "?",
-            "metric": m.metric or m.oid,
-            "value": m.value
+            "ts": ts.strftime("%Y-%m-%d %H:%M:%S"),
+            "host": host.hostname,
+            "ip": host.ip,
+            "meta": cat,
+            "metric": metric,
+            "value": value
         })
 
     filters = {
@@ -92,28 +143,16 @@ def logs_export():
     }
     start_time = now - delta_map.get(duration, timedelta(hours=1))
 
-    # 🔹 Requête filtrée
-    query = Measurement.query.join(Host).filter(Measurement.ts >= start_time)
-    if host_id:
-        query = query.filter(Measurement.host_id == host_id)
-    if group_id:
-        query = query.filter(Host.group_id == group_id)
-    if category:
-        query = query.filter(Measurement.meta.like(f'"{category}"'))
-
-    data = query.order_by(Measurement.ts.desc()).limit(5000).all()
-
     # 🔹 Construction du DataFrame
     rows = []
-    for m in data:
-        host = Host.query.get(m.host_id)
+    for ts, host, cat, metric, value in _fetch_logs(host_id, group_id, category, start_time, 5000):
         rows.append({
-            "Horodatage": m.ts.strftime("%Y-%m-%d %H:%M:%S"),
-            "Hôte": host.hostname if host else "?",
-            "IP": host.ip if host else "?",
-            "Catégorie": m.meta.strip('"') if m.meta else "?",
-            "Métrique": m.metric or m.oid,
-            "Valeur": m.value,
+            "Horodatage": ts.strftime("%Y-%m-%d %H:%M:%S"),
+            "Hôte": host.hostname,
+            "IP": host.ip,
+            "Catégorie": cat,
+            "Métrique": metric,
+            "Valeur": value,
         })
 
     if not rows:
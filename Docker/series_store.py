@@ -0,0 +1,251 @@
+import math
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from models import Host, MetricSeries, MetricSample
+from rollups import LEVELS, aggregate, pick_resolution, watermarks
+from recent_store import RECENT, RECENT_ENABLED
+from chunk_store import read_chunks
+from deadband import DEADBAND, DEADBAND_ENABLED, fill_steps, step_lookback
+from db_utils import after_commit
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Séries temporelles numériques
+# ─────────────────────────────────────────────
+# Dictionnaire metric_series : (host, catégorie, métrique) → id entier, et
+# échantillons compacts metric_samples (series_id, ts, DOUBLE). Les valeurs non
+# numériques (sysDescr, état d'interface…) restent dans `measurements`.
+#
+# Cache (host_id, catégorie, nom) → series_id. Seuls les ids relus en base y
+# entrent : une série créée dans une transaction annulée n'y reste jamais.
+SERIES_CACHE = {}
+
+# Plafond de lignes brutes renvoyées par read_history (fenêtres courtes)
+RAW_HISTORY_LIMIT = 5000
+
+# Stockage des échantillons : "mysql" (metric_samples) ou "mmap" (mmap_store.py,
+# fichiers colonnes locaux ; le dictionnaire et les agrégats MySQL ne servent alors pas)
+SERIES_BACKEND = os.getenv("SERIES_BACKEND", "mysql")
+
+
+def to_number(value):
+    """Valeur numérique d'un échantillon, ou None (texte, booléen, NaN…)."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    elif isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+    else:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def series_id(db, host_id, category, name, create=True):
+    """Id de la série (créée au besoin dans un savepoint), ou None."""
+    key = (host_id, category, name)
+    sid = SERIES_CACHE.get(key)
+    if sid is not None:
+        return sid
+
+    sid = db.session.query(MetricSeries.id).filter_by(
+        host_id=host_id, category=category, name=name
+    ).scalar()
+    if sid is not None:
+        SERIES_CACHE[key] = sid
+        return sid
+    if not create:
+        return None
+
+    try:
+        with db.session.begin_nested():
+            series = MetricSeries(host_id=host_id, category=category, name=name)
+            db.session.add(series)
+        return series.id
+    except IntegrityError:
+        # Créée entre-temps par un autre writer (poller / api_poll)
+        return db.session.query(MetricSeries.id).filter_by(
+            host_id=host_id, category=category, name=name
+        ).scalar()
+
+
+def forget_host(host_id):
+    """Oublie les séries d'un hôte supprimé (ON DELETE CASCADE côté base)."""
+    for key in [k for k in SERIES_CACHE if k[0] == host_id]:
+        del SERIES_CACHE[key]
+    RECENT.forget_host(host_id)
+    DEADBAND.forget_host(host_id)
+    if SERIES_BACKEND == "mmap":
+        from mmap_store import get_store
+        get_store().forget_host(host_id)
+
+
+def add_samples(db, host_id, category, samples, ts=None):
+    """
+    Enregistre des échantillons [(nom, valeur)] au même horodatage, en un seul
+    INSERT multi-lignes. Retourne les paires non numériques, laissées à l'appelant.
+    Les échantillons écartés par la politique de la catégorie (deadband.py)
+    ne sont ni écrits ni retournés.
+    """
+    ts = ts or datetime.utcnow().replace(microsecond=0)
+    if DEADBAND_ENABLED:
+        samples = DEADBAND.keep(host_id, category, ts, samples, to_number)
+        # Dernier échantillon stocké : mis à jour au commit seulement
+        after_commit(db, lambda: DEADBAND.record(host_id, category, ts, samples, to_number))
+    numeric, rest = [], []
+    for name, value in samples:
+        number = to_number(value)
+        if number is None:
+            rest.append((name, value))
+        else:
+            numeric.append((name, number))
+    if numeric and SERIES_BACKEND == "mmap":
+        from mmap_store import get_store
+        # Écriture disque au commit seulement, comme les tampons récents (rien après un rollback)
+        after_commit(db, lambda: get_store().append(host_id, category, ts, numeric))
+    elif numeric:
+        rows = [{"series_id": series_id(db, host_id, category, name), "ts": ts, "value": number}
+                for name, number in numeric]
+        # Un doublon (même série, même seconde) est ignoré plutôt que d'annuler le poll
+        stmt = (insert(MetricSample.__table__)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite"))
+        db.session.execute(stmt, rows)
+    if numeric and RECENT_ENABLED:
+        # Tampons récents : seulement une fois les lignes validées (rien après un rollback)
+        after_commit(db, lambda: RECENT.add(host_id, category, ts, numeric))
+    return rest
+
+
+def samples_query(db, host_id, category, since, until=None):
+    """Requête (nom, ts, valeur) : uq_series_host_cat_name puis la clé primaire (series_id, ts)."""
+    q = (
+        db.session.query(MetricSeries.name, MetricSample.ts, MetricSample.value)
+        .join(MetricSample, MetricSample.series_id == MetricSeries.id)
+        .filter(MetricSeries.host_id == host_id, MetricSeries.category == category)
+        .filter(MetricSample.ts >= since)
+    )
+    if until is not None:
+        q = q.filter(MetricSample.ts < until)
+    return q
+
+
+def read_samples(db, host_id, category, since, until=None, limit=None):
+    """
+    Échantillons d'un hôte / d'une catégorie depuis `since`, en ordre chronologique :
+    [(nom, ts, valeur)]. Avec `limit`, ce sont les plus récents qui sont gardés.
+    Les heures déjà compactées (chunk_store.py) sont décodées et placées devant.
+    """
+    q = samples_query(db, host_id, category, since, until)
+    if limit:
+        rows = list(reversed(q.order_by(MetricSample.ts.desc()).limit(limit).all()))
+    else:
+        rows = q.order_by(MetricSample.ts.asc()).all()
+    if limit and len(rows) >= limit:
+        return rows
+    # Les chunks ne couvrent que des heures antérieures à toute ligne brute restante
+    rows = read_chunks(db, host_id, category, since, until) + rows
+    return rows[-limit:] if limit else rows
+
+
+def read_log_samples(db, since, host_id=None, group_id=None, category=None, limit=1000):
+    """
+    Lignes de log du backend mmap [(ts, host, catégorie, nom, valeur)], les plus
+    récentes d'abord. Sur une longue période, moyennes par intervalle comme les
+    agrégats lus par /logs sur MySQL.
+    """
+    from mmap_store import get_store, downsample
+
+    store = get_store()
+    resolution = pick_resolution((datetime.utcnow() - since).total_seconds(), LEVELS)
+    hosts = db.session.query(Host)
+    if host_id:
+        hosts = hosts.filter(Host.id == host_id)
+    if group_id:
+        hosts = hosts.filter(Host.group_id == group_id)
+    rows = []
+    for host in hosts.all():
+        for cat in ([category] if category else store.categories(host.id)):
+            for name, (ts, values) in store.read(host.id, cat, since).items():
+                if resolution:
+                    ts, values = downsample(ts, values, resolution)
+                # Seuls les `limit` derniers points d'une série peuvent être retenus
+                rows.extend((t, host, cat, name, v)
+                            for t, v in zip(ts[-limit:].tolist(), values[-limit:].tolist()))
+    rows.sort(key=lambda r: r[0], reverse=True)
+    epoch = datetime(1970, 1, 1)
+    return [(epoch + timedelta(seconds=ts), host, cat, name, value)
+            for ts, host, cat, name, value in rows[:limit]]
+
+
+def read_history(db, host_id, category, since, until=None):
+    """
+    Historique d'une catégorie à la résolution adaptée à la fenêtre :
+    (résolution en secondes, [(nom, ts, valeur)]), 0 = échantillons bruts.
+    Sur un agrégat, la valeur est la moyenne de l'intervalle ; la fin de la
+    fenêtre pas encore agrégée est complétée depuis les échantillons bruts.
+    Une fenêtre couverte par les tampons en mémoire est servie sans la base.
+    Les catégories stockées sur changement sont relues depuis un battement de
+    cœur plus tôt et rendues en escalier.
+    """
+    until = until or datetime.utcnow()
+    lookback = step_lookback(category)
+    resolution, rows = _read_history(db, host_id, category, since - timedelta(seconds=lookback), until)
+    if lookback:
+        rows = fill_steps(rows, since, until, lookback)
+    return resolution, rows
+
+
+def _read_history(db, host_id, category, since, until):
+    if RECENT_ENABLED:
+        # Fenêtre récente entièrement en mémoire : aucune requête
+        rows = RECENT.read(host_id, category, since, until)
+        if rows is not None:
+            return 0, rows
+    if SERIES_BACKEND == "mmap":
+        return _read_history_mmap(host_id, category, since, until)
+    marks = watermarks(db)
+    resolution = pick_resolution((until - since).total_seconds(), marks)
+    if not resolution:
+        return 0, read_samples(db, host_id, category, since, until, limit=RAW_HISTORY_LIMIT)
+
+    model = LEVELS[resolution].model
+    watermark = marks[resolution]
+    rows = (
+        db.session.query(MetricSeries.name, model.ts, model.avg_value)
+        .join(model, model.series_id == MetricSeries.id)
+        .filter(MetricSeries.host_id == host_id, MetricSeries.category == category)
+        .filter(model.ts >= since, model.ts < min(until, watermark))
+        .order_by(model.ts.asc())
+        .all()
+    )
+    if watermark < until:
+        tail = read_samples(db, host_id, category, max(since, watermark), until)
+        buckets = aggregate(((name, ts, v, v, v, v, 1) for name, ts, v in tail), resolution)
+        rows += sorted(((name, ts, total / count) for (name, ts), (_, _, total, _, count) in buckets.items()),
+                       key=lambda r: r[1])
+    return resolution, rows
+
+
+def _read_history_mmap(host_id, category, since, until):
+    """read_history sur le backend mmap : moyennes par intervalle calculées à la volée."""
+    from mmap_store import get_store, downsample
+
+    # Même choix de résolution que sur MySQL, sans filigrane (tout est disponible)
+    resolution = pick_resolution((until - since).total_seconds(), LEVELS)
+    rows = []
+    for name, (ts, values) in get_store().read(host_id, category, since, until).items():
+        if resolution:
+            ts, values = downsample(ts, values, resolution)
+        rows.extend(zip([name] * len(ts), ts.tolist(), values.tolist()))
+    rows.sort(key=lambda r: r[1])
+    if not resolution:
+        rows = rows[-RAW_HISTORY_LIMIT:]
+    epoch = datetime(1970, 1, 1)
+    return resolution, [(name, epoch + timedelta(seconds=ts), value) for name, ts, value in rows]
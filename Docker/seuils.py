@@ -1,7 +1,7 @@
 import subprocess
 import platform
 import logging
-from db_utils import open_alert, resolve_alert
+from db_utils import open_alert, resolve_alert, commit_or_flush
 from models import CurrentMetric, Measurement, Alert
 
 logger = logging.getLogger(__name__)
@@ -104,7 +104,7 @@ def check_thresholds(db, host, category, oid, val, Alert):
                     a.severity = "warning"
                     a.message = f"{cat.upper()} élevé sur {host.hostname} - {metric_id} ({value:.1f}%)"
                     db.session.add(a)
-                db.session.commit()
+                commit_or_flush(db)
                 # Pas d'email lors d'un downgrade critical -> warning
             else:
                 open_alert(db, Alert, host.id, "warning", f"{cat.upper()} élevé sur {host.hostname} - {metric_id} ({value:.1f}%)")
@@ -0,0 +1,411 @@
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional
+from snmp_utils import (
+    SnmpTimeout, SnmpError, get_typed, bulk_walk_typed, text, oid_str, note_uptime,
+    static_lookup, static_store, format_sysuptime, calculate_rate, interface_counters,
+    interface_poll_oids, _detect_group, COUNTER_CACHE, SYS_DESCR_OID, SYS_UPTIME_OID, SYS_NAME_OID,
+)
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Registre déclaratif des catégories SNMP
+# ─────────────────────────────────────────────
+# Chaque catégorie décrit ses OID (scalaires lus par GET, colonnes parcourues
+# par GETBULK, statiques ou non) et une fonction `derive` qui met en forme les
+# valeurs. Les variantes par type d'équipement (linux / pfsense / windows)
+# remplacent la variante par défaut. Le planificateur fusionne les OID de
+# toutes les catégories d'un hôte : un seul GET (par lots) et un seul GETBULK
+# multi-colonnes par cycle, au lieu de requêtes séparées par catégorie.
+HR_PROCESSOR_LOAD_OID = (1, 3, 6, 1, 2, 1, 25, 3, 3, 1, 2)
+HR_STORAGE_DESCR_OID = (1, 3, 6, 1, 2, 1, 25, 2, 3, 1, 3)
+HR_STORAGE_UNITS_OID = (1, 3, 6, 1, 2, 1, 25, 2, 3, 1, 4)
+HR_STORAGE_SIZE_OID = (1, 3, 6, 1, 2, 1, 25, 2, 3, 1, 5)
+HR_STORAGE_USED_OID = (1, 3, 6, 1, 2, 1, 25, 2, 3, 1, 6)
+UCD_CPU_IDLE_OID = (1, 3, 6, 1, 4, 1, 2021, 11, 11, 0)
+UCD_MEM_TOTAL_OID = (1, 3, 6, 1, 4, 1, 2021, 4, 5, 0)
+UCD_MEM_AVAIL_OID = (1, 3, 6, 1, 4, 1, 2021, 4, 6, 0)
+UCD_DSK_PATH_OID = (1, 3, 6, 1, 4, 1, 2021, 9, 1, 2)
+UCD_DSK_TOTAL_OID = (1, 3, 6, 1, 4, 1, 2021, 9, 1, 6)
+UCD_DSK_USED_OID = (1, 3, 6, 1, 4, 1, 2021, 9, 1, 7)
+UCD_DSK_PERCENT_OID = (1, 3, 6, 1, 4, 1, 2021, 9, 1, 9)
+
+
+class Scalar(NamedTuple):
+    oid: tuple
+    static: bool = False        # servi depuis STATIC_CACHE jusqu'au redémarrage de l'agent
+
+
+class Column(NamedTuple):
+    oid: tuple
+    static: bool = False
+    limit: int = 50             # nombre maximal de lignes lues
+
+
+class Variant(NamedTuple):
+    derive: Callable            # derive(Fetched) -> dict de métriques
+    scalars: tuple = ()
+    columns: tuple = ()
+    plan: Optional[Callable] = None   # plan(ip, port) -> OID scalaires dynamiques (issus d'un cache)
+
+
+class CategoryDef(NamedTuple):
+    name: str
+    default: Variant
+    vendors: Optional[dict] = None
+
+    def variant(self, group):
+        return (self.vendors or {}).get(group, self.default)
+
+
+# Catégories connues : nom -> CategoryDef
+CATEGORIES = {}
+
+
+def register(definition: CategoryDef):
+    CATEGORIES[definition.name] = definition
+    return definition
+
+
+class Fetched:
+    """Valeurs décodées d'un cycle, partagées par les fonctions `derive`."""
+    __slots__ = ("ip", "community", "port", "group", "host_id", "scalars", "columns")
+
+    def __init__(self, ip, community, port, group, host_id):
+        self.ip = ip
+        self.community = community
+        self.port = port
+        self.group = group
+        self.host_id = host_id
+        self.scalars = {}
+        self.columns = {}
+
+    def scalar(self, oid):
+        return self.scalars.get(oid)
+
+    def column(self, oid):
+        return self.columns.get(oid, {})
+
+
+# ─────────────────────────────────────────────
+# 🔹 Planificateur
+# ─────────────────────────────────────────────
+class RequestPlan(NamedTuple):
+    scalars: tuple          # OID à lire par GET (dédoublonnés, sysUpTime en tête)
+    columns: dict           # {colonne: limite} à parcourir par GETBULK
+    statics: frozenset      # OID statiques lus par ce plan (mis en cache ensuite)
+    cached_scalars: dict    # statiques servis depuis le cache : {oid: valeur}
+    cached_columns: dict    # {colonne: (limite, {suffixe: valeur})}
+
+
+def plan_requests(ip, port, group, categories):
+    """
+    Compile les catégories en un plan de requêtes unique pour l'agent.
+    sysUpTime est toujours lu : il valide les valeurs statiques du cache.
+    """
+    scalars = {SYS_UPTIME_OID: None}
+    columns = {}
+    statics = set()
+    cached_scalars = {}
+    cached_columns = {}
+    for name in categories:
+        variant = CATEGORIES[name].variant(group)
+        for item in variant.scalars + variant.columns:
+            is_column = isinstance(item, Column)
+            if item.static:
+                hit, value = static_lookup(ip, port, item.oid)
+                if hit:
+                    if is_column:
+                        cached_columns[item.oid] = (item.limit, value)
+                    else:
+                        cached_scalars[item.oid] = value
+                    continue
+                statics.add(item.oid)
+            if is_column:
+                columns[item.oid] = max(columns.get(item.oid, 0), item.limit)
+            else:
+                scalars[item.oid] = None
+        if variant.plan is not None:
+            for oid in variant.plan(ip, port):
+                scalars[oid] = None
+    return RequestPlan(tuple(scalars), columns, frozenset(statics), cached_scalars, cached_columns)
+
+
+def _execute(ip, community, port, scalars, columns, fetched):
+    if scalars:
+        fetched.scalars.update(get_typed(ip, community, port, scalars))
+    if columns:
+        fetched.columns.update(bulk_walk_typed(ip, community, port, columns))
+
+
+def _store_statics(ip, port, oids, fetched):
+    for oid in oids:
+        if oid in fetched.columns:
+            static_store(ip, port, oid, fetched.columns[oid])
+        else:
+            static_store(ip, port, oid, fetched.scalars.get(oid))
+
+
+def execute_plan(ip, community, port, plan, fetched):
+    """Exécute le plan ; relit les valeurs statiques du cache si l'agent a redémarré."""
+    fetched.scalars.update(plan.cached_scalars)
+    fetched.columns.update({oid: value for oid, (_, value) in plan.cached_columns.items()})
+    _execute(ip, community, port, plan.scalars, plan.columns, fetched)
+
+    # sysUpTime d'abord : un redémarrage vide le cache statique de l'agent
+    restarted = note_uptime(ip, port, fetched.scalar(SYS_UPTIME_OID))
+    _store_statics(ip, port, plan.statics, fetched)
+    if restarted and (plan.cached_scalars or plan.cached_columns):
+        # Les statiques servies depuis le cache datent d'avant le redémarrage
+        stale_columns = {oid: limit for oid, (limit, _) in plan.cached_columns.items()}
+        _execute(ip, community, port, list(plan.cached_scalars), stale_columns, fetched)
+        _store_statics(ip, port, list(plan.cached_scalars) + list(stale_columns), fetched)
+
+
+# ─────────────────────────────────────────────
+# 🔹 Collecte multi-catégories
+# ─────────────────────────────────────────────
+def collect_metrics(ip: str, community: str, port: int, categories, host_id=None,
+                    group_name: Optional[str] = None):
+    """
+    Collecte toutes les catégories d'un hôte avec un plan de requêtes fusionné.
+    Retourne (résultats {catégorie: métriques}, erreurs {catégorie: exception}).
+    SnmpTimeout est propagé : l'agent est muet pour toutes les catégories.
+    """
+    group = (group_name or _detect_group(ip, community, port)).lower()
+    known = [c for c in dict.fromkeys(categories) if c in CATEGORIES]
+    results = {c: {} for c in categories if c not in CATEGORIES}
+    errors = {}
+    if not known:
+        return results, errors
+
+    fetched = Fetched(ip, community, port, group, host_id)
+    try:
+        execute_plan(ip, community, port, plan_requests(ip, port, group, known), fetched)
+    except SnmpError as e:
+        if len(known) == 1:
+            errors[known[0]] = e
+            return results, errors
+        # Une varbind refusée fait échouer toute la PDU : repli catégorie par catégorie
+        logger.info(f"[snmp] Plan fusionné refusé par {ip}:{port} ({e}) — collecte par catégorie")
+        for name in known:
+            sub_results, sub_errors = collect_metrics(ip, community, port, [name], host_id, group)
+            results.update(sub_results)
+            errors.update(sub_errors)
+        return results, errors
+
+    for name in known:
+        try:
+            results[name] = CATEGORIES[name].variant(group).derive(fetched)
+        except SnmpTimeout:
+            raise
+        except Exception as e:
+            errors[name] = e
+    return results, errors
+
+
+# ─────────────────────────────────────────────
+# 🔹 Définitions des catégories
+# ─────────────────────────────────────────────
+def _derive_system(f):
+    res = {}
+    uptime = f.scalar(SYS_UPTIME_OID)
+    if uptime is not None:
+        res[oid_str(SYS_UPTIME_OID)] = uptime
+        # Format lisible
+        res["Uptime"] = format_sysuptime(uptime)
+    for oid in (SYS_DESCR_OID, SYS_NAME_OID):
+        value = f.scalar(oid)
+        if value is not None:
+            res[oid_str(oid)] = text(value)
+    return res
+
+
+register(CategoryDef("system", Variant(
+    derive=_derive_system,
+    scalars=(Scalar(SYS_DESCR_OID, static=True), Scalar(SYS_NAME_OID, static=True)),
+)))
+
+
+def _derive_cpu(f):
+    loads = f.column(HR_PROCESSOR_LOAD_OID)
+    if loads:
+        return {oid_str(HR_PROCESSOR_LOAD_OID + index): load for index, load in loads.items()}
+    # Windows sans hrProcessorLoad : repli UCD-SNMP
+    idle = f.scalar(UCD_CPU_IDLE_OID)
+    return {oid_str(UCD_CPU_IDLE_OID): idle} if idle is not None else {}
+
+
+register(CategoryDef("cpu", Variant(
+    derive=_derive_cpu,
+    columns=(Column(HR_PROCESSOR_LOAD_OID, limit=10),),
+), vendors={
+    "windows": Variant(
+        derive=_derive_cpu,
+        columns=(Column(HR_PROCESSOR_LOAD_OID, limit=10),),
+        scalars=(Scalar(UCD_CPU_IDLE_OID),),
+    ),
+}))
+
+_HR_STORAGE_COLUMNS = (
+    Column(HR_STORAGE_DESCR_OID, static=True),
+    Column(HR_STORAGE_UNITS_OID, static=True),
+    Column(HR_STORAGE_SIZE_OID, static=True),
+    Column(HR_STORAGE_USED_OID),
+)
+
+
+def _hr_storage(f):
+    """Lignes hrStorageTable : [(description, octets utilisés, octets totaux, pct)]."""
+    alloc = f.column(HR_STORAGE_UNITS_OID)
+    size = f.column(HR_STORAGE_SIZE_OID)
+    used = f.column(HR_STORAGE_USED_OID)
+
+    rows = []
+    for index, raw_name in f.column(HR_STORAGE_DESCR_OID).items():
+        try:
+            block_size = alloc.get(index, 1)
+            total = size.get(index, 0) * block_size
+            used_val = used.get(index, 0) * block_size
+        except TypeError:
+            continue
+        pct = round(used_val / total * 100, 2) if total > 0 else 0
+        rows.append((text(raw_name), used_val, total, pct))
+    return rows
+
+
+def _derive_ram(f):
+    results = {}
+    for name, used_val, total, pct in _hr_storage(f):
+        # On garde uniquement la mémoire physique
+        if "physical memory" in name.lower():
+            results["Physical memory"] = {"used": used_val, "total": total, "pct": pct}
+    return results
+
+
+def _derive_ram_ucd(f):
+    # 🔹 UCD-SNMP (plus fiable sur pfSense)
+    mem_total = f.scalar(UCD_MEM_TOTAL_OID)
+    mem_avail = f.scalar(UCD_MEM_AVAIL_OID)
+    if not isinstance(mem_total, int) or not isinstance(mem_avail, int):
+        return {}
+    mem_used = mem_total - mem_avail
+    mem_pct = round(mem_used / mem_total * 100, 2) if mem_total > 0 else 0
+    return {"Memory": {
+        "used": mem_used * 1024,   # en octets
+        "total": mem_total * 1024,
+        "pct": mem_pct,
+    }}
+
+
+register(CategoryDef("ram", Variant(
+    derive=_derive_ram,
+    columns=_HR_STORAGE_COLUMNS,
+), vendors={
+    "pfsense": Variant(
+        derive=_derive_ram_ucd,
+        scalars=(Scalar(UCD_MEM_TOTAL_OID, static=True), Scalar(UCD_MEM_AVAIL_OID)),
+    ),
+}))
+
+
+def _storage_pct_keys(results):
+    # --- Normalisation finale (clé .pct pour graphe) ---
+    cleaned = {}
+    for name, info in results.items():
+        if name.startswith("/") or ":" in name:
+            cleaned[name + ".pct"] = info["pct"]
+        elif "mount" in info or "descr" in info:
+            label = info.get("mount") or info.get("descr")
+            if label:
+                cleaned[label + ".pct"] = info["pct"]
+    results.update(cleaned)
+    return results
+
+
+def _derive_storage(f):
+    results = {}
+    for name, used_val, total, pct in _hr_storage(f):
+        # On ignore la RAM et volumes système inutiles
+        if any(skip in name.lower() for skip in ("memory", "virtual", "uma", "devfs", "/run", "/tmp")):
+            continue
+        label = name.split(" ")[0] if ":" in name else name
+        results[label] = {"used": used_val, "total": total, "pct": pct}
+    return _storage_pct_keys(results)
+
+
+def _derive_storage_ucd(f):
+    results = {}
+    total = f.column(UCD_DSK_TOTAL_OID)
+    used = f.column(UCD_DSK_USED_OID)
+    pct = f.column(UCD_DSK_PERCENT_OID)
+    for index, raw_mount in f.column(UCD_DSK_PATH_OID).items():
+        mount = text(raw_mount)
+        if mount in ("/", "/var/run"):
+            results[mount] = {"used": used.get(index, 0) * 1024, "total": total.get(index, 0) * 1024,
+                              "pct": pct.get(index, 0)}
+    return _storage_pct_keys(results)
+
+
+register(CategoryDef("storage", Variant(
+    derive=_derive_storage,
+    columns=_HR_STORAGE_COLUMNS,
+), vendors={
+    "pfsense": Variant(
+        derive=_derive_storage_ucd,
+        columns=(
+            Column(UCD_DSK_PATH_OID, static=True),
+            Column(UCD_DSK_TOTAL_OID, static=True),
+            Column(UCD_DSK_USED_OID),
+            Column(UCD_DSK_PERCENT_OID),
+        ),
+    ),
+}))
+
+
+def _derive_interfaces(f):
+    # Table des interfaces en cache : l'état et les compteurs des interfaces
+    # retenues ont été lus dans le GET fusionné (voir interface_poll_oids)
+    table, values = interface_counters(f.ip, f.community, f.port, f.group, f.scalars)
+
+    results = {}
+    now = datetime.utcnow()
+    for entry in table.entries:
+        if not entry.selected:
+            continue
+        name = entry.name
+        oper_oid, in_oid, out_oid = entry.oids
+
+        state = "up" if values.get(oper_oid) == 1 else "down"
+        in_val = values.get(in_oid)
+        out_val = values.get(out_oid)
+        bits = 64 if entry.hc else 32
+
+        info = {"state": state, "in": in_val, "out": out_val}
+
+        prev = COUNTER_CACHE.get((f.ip, f.port, name))
+        if in_val is None or out_val is None:
+            # Compteur absent de la réponse : pas de débit, et la référence est
+            # oubliée (une valeur par défaut donnerait un faux pic au poll suivant)
+            info["in_mbps"], info["out_mbps"] = None, None
+            COUNTER_CACHE.pop((f.ip, f.port, name), None)
+            results[name] = info
+            continue
+        if prev:
+            # Compteurs précédents connus en mémoire (ou restaurés du snapshot)
+            prev_in_val, prev_out_val, prev_ts = prev
+            info["in_mbps"] = calculate_rate(in_val, prev_in_val, prev_ts, now, bits)
+            info["out_mbps"] = calculate_rate(out_val, prev_out_val, prev_ts, now, bits)
+        else:
+            # Première lecture : pas de débit (les compteurs bruts ne sont pas stockés)
+            info["in_mbps"], info["out_mbps"] = None, None
+        COUNTER_CACHE[(f.ip, f.port, name)] = (in_val, out_val, now)
+
+        results[name] = info
+    return results
+
+
+register(CategoryDef("interfaces", Variant(
+    derive=_derive_interfaces,
+    plan=interface_poll_oids,
+)))
@@ -1,10 +1,19 @@
 from pysnmp.hlapi import (
-    SnmpEngine, CommunityData, UdpTransportTarget,
-    ContextData, ObjectType, ObjectIdentity, getCmd, nextCmd
+    SnmpEngine, CommunityData, UsmUserData, UdpTransportTarget,
+    ContextData, ObjectType, ObjectIdentity, getCmd, nextCmd, bulkCmd,
+    usmNoAuthProtocol, usmHMACMD5AuthProtocol, usmHMACSHAAuthProtocol,
+    usmHMAC128SHA224AuthProtocol, usmHMAC192SHA256AuthProtocol,
+    usmHMAC256SHA384AuthProtocol, usmHMAC384SHA512AuthProtocol,
+    usmNoPrivProtocol, usmDESPrivProtocol, usm3DESEDEPrivProtocol,
+    usmAesCfb128Protocol, usmAesCfb192Protocol, usmAesCfb256Protocol,
 )
-from datetime import datetime
-from typing import Optional
-from models import Measurement
+from pysnmp.proto import errind
+from pysnmp.proto.rfc1905 import NoSuchObject, NoSuchInstance, EndOfMibView
+from pyasn1.type import univ
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
 from database import db
 import logging
 logger = logging.getLogger(__name__)
@@ -17,6 +26,230 @@ SYSTEM_OID_LABELS = {
     '1.3.6.1.2.1.1.5.0': 'Hostname',
 }
 
+SYS_DESCR_OID = (1, 3, 6, 1, 2, 1, 1, 1, 0)
+SYS_UPTIME_OID = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+SYS_NAME_OID = (1, 3, 6, 1, 2, 1, 1, 5, 0)
+
+# Type d'équipement détecté par agent : (ip, port) -> "linux" | "pfsense" | "windows"
+DEVICE_TYPE_CACHE = {}
+
+# Derniers compteurs d'octets par interface : (ip, port, interface) -> (in, out, ts)
+COUNTER_CACHE = {}
+
+
+class SnmpTimeout(Exception):
+    """L'agent SNMP n'a pas répondu avant le timeout."""
+
+
+class SnmpError(Exception):
+    """L'agent a répondu, mais avec une erreur (noSuchName, authorizationError...)."""
+
+
+# ─────────────────────────────────────────────
+# 🔹 Timeouts adaptatifs (RTT lissé par agent, façon RTO TCP)
+# ─────────────────────────────────────────────
+SNMP_TIMEOUT_FLOOR = float(os.getenv("SNMP_TIMEOUT_FLOOR", "0.2"))      # secondes
+SNMP_TIMEOUT_CEILING = float(os.getenv("SNMP_TIMEOUT_CEILING", "5"))    # secondes
+SNMP_DEFAULT_TIMEOUT = 1.0   # tant qu'aucun RTT n'a été mesuré
+
+
+class RttEstimator:
+    """
+    SRTT / RTTVAR (Jacobson-Karels, RFC 6298) pour un agent SNMP. Le timeout
+    dérivé est borné par SNMP_TIMEOUT_FLOOR / SNMP_TIMEOUT_CEILING. Les timeouts
+    et les vraies erreurs SNMP sont comptés séparément.
+    """
+    __slots__ = ("srtt", "rttvar", "rto", "timeouts", "errors", "consecutive_timeouts")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = SNMP_DEFAULT_TIMEOUT
+        self.timeouts = 0
+        self.errors = 0
+        self.consecutive_timeouts = 0
+
+    def _base_rto(self):
+        return min(max(self.srtt + 4 * self.rttvar, SNMP_TIMEOUT_FLOOR), SNMP_TIMEOUT_CEILING)
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = self._base_rto()
+        self.consecutive_timeouts = 0
+
+    def on_timeout(self):
+        self.timeouts += 1
+        self.consecutive_timeouts += 1
+        if self.srtt is not None:
+            # Backoff borné : un agent LAN mort reste rapide à déclarer en échec
+            self.rto = min(self.rto * 2, self._base_rto() * 8, SNMP_TIMEOUT_CEILING)
+
+    def on_error(self):
+        self.errors += 1
+
+    def budget(self):
+        """(timeout par tentative, nombre de retries) pour la prochaine requête."""
+        if self.srtt is None:
+            return SNMP_DEFAULT_TIMEOUT, 0
+        if self.consecutive_timeouts >= 2:
+            # Agent probablement mort : une seule tentative
+            return self.rto, 0
+        # Lien instable (gigue forte ou timeouts isolés) : une retransmission
+        jittery = self.rttvar > self.srtt / 2
+        lossy = self.timeouts > 0 and self.consecutive_timeouts == 0
+        return self.rto, (1 if jittery or lossy else 0)
+
+
+# RTT par agent : (ip, port) -> RttEstimator
+RTT_ESTIMATORS = {}
+
+
+def _estimator(ip, port):
+    est = RTT_ESTIMATORS.get((ip, port))
+    if est is None:
+        est = RTT_ESTIMATORS[(ip, port)] = RttEstimator()
+    return est
+
+
+def _target(ip, port):
+    timeout, retries = _estimator(ip, port).budget()
+    # Arrondi à 50 ms : chaque couple (timeout, retries) distinct crée une
+    # cible dans la configuration du moteur SNMP partagé
+    return UdpTransportTarget((ip, port), timeout=round(timeout * 20) / 20, retries=retries)
+
+
+def _observe(ip, port, target, elapsed):
+    """
+    Mesure RTT d'un aller-retour avec `target`. Règle de Karn : si la durée
+    atteint le timeout de la première tentative, une retransmission est
+    partie et la réponse peut appartenir à l'une ou l'autre : mesure écartée.
+    """
+    if target.retries and elapsed >= target.timeout:
+        return
+    _estimator(ip, port).observe(elapsed)
+
+
+def agent_stats(ip, port):
+    """Statistiques RTT de l'agent (ms) et compteurs timeouts / erreurs."""
+    est = RTT_ESTIMATORS.get((ip, port))
+    if est is None or est.srtt is None:
+        return {"srtt_ms": None, "rto_ms": None,
+                "timeouts": est.timeouts if est else 0, "errors": est.errors if est else 0}
+    return {
+        "srtt_ms": round(est.srtt * 1000, 1),
+        "rto_ms": round(est.rto * 1000, 1),
+        "timeouts": est.timeouts,
+        "errors": est.errors,
+    }
+
+
+def _raise_error_indication(ip, port, error_indication):
+    est = _estimator(ip, port)
+    if isinstance(error_indication, errind.RequestTimedOut):
+        est.on_timeout()
+        raise SnmpTimeout(str(error_indication))
+    est.on_error()
+    raise SnmpError(str(error_indication))
+
+
+def _raise_error_status(ip, port, error_status, error_index):
+    _estimator(ip, port).on_error()
+    raise SnmpError(f"{error_status.prettyPrint()} at {error_index}")
+
+
+# ─────────────────────────────────────────────
+# 🔹 Identifiants SNMP (v2c / v3) et moteur partagé
+# ─────────────────────────────────────────────
+# Le paramètre `community` des fonctions SNMP accepte une communauté v2c (str)
+# ou des identifiants USM (V3Credentials). Un SnmpEngine par thread est
+# réutilisé entre les requêtes : il garde l'engine-ID découvert de chaque agent
+# et les clés localisées (dérivation volontairement coûteuse), qui ne sont
+# donc calculés qu'une fois par agent et non à chaque requête.
+AUTH_PROTOCOLS = {
+    "none": usmNoAuthProtocol,
+    "MD5": usmHMACMD5AuthProtocol,
+    "SHA": usmHMACSHAAuthProtocol,
+    "SHA224": usmHMAC128SHA224AuthProtocol,
+    "SHA256": usmHMAC192SHA256AuthProtocol,
+    "SHA384": usmHMAC256SHA384AuthProtocol,
+    "SHA512": usmHMAC384SHA512AuthProtocol,
+}
+PRIV_PROTOCOLS = {
+    "none": usmNoPrivProtocol,
+    "DES": usmDESPrivProtocol,
+    "3DES": usm3DESEDEPrivProtocol,
+    "AES": usmAesCfb128Protocol,
+    "AES192": usmAesCfb192Protocol,
+    "AES256": usmAesCfb256Protocol,
+}
+
+
+class V3Credentials(NamedTuple):
+    user: str
+    auth_protocol: str = "SHA"
+    auth_key: Optional[str] = None
+    priv_protocol: str = "AES"
+    priv_key: Optional[str] = None
+
+
+def resolve_credentials(community, version=None, v3=None, template_version=None, template_params=None):
+    """
+    Identifiants effectifs d'un hôte : la version et les paramètres USM de
+    l'hôte priment sur ceux de son template. Retourne la communauté (v1/v2c)
+    ou un V3Credentials.
+    """
+    version = version or template_version or "v2c"
+    if version != "v3":
+        return community or "public"
+    params = v3 if isinstance(v3, dict) and v3.get("user") else (template_params or {}).get("v3") or {}
+    if not params.get("user"):
+        logger.warning("[snmp] SNMPv3 demandé sans utilisateur USM — repli sur la communauté v2c")
+        return community or "public"
+    return V3Credentials(
+        user=params["user"],
+        auth_protocol=params.get("auth_protocol") or ("SHA" if params.get("auth_key") else "none"),
+        auth_key=params.get("auth_key") or None,
+        priv_protocol=params.get("priv_protocol") or ("AES" if params.get("priv_key") else "none"),
+        priv_key=params.get("priv_key") or None,
+    )
+
+
+_local = threading.local()
+
+# Objets d'authentification hlapi par identifiants (réutilisés tels quels)
+_AUTH_DATA = {}
+
+
+def _engine():
+    """SnmpEngine du thread courant (pysnmp n'est pas thread-safe)."""
+    engine = getattr(_local, "engine", None)
+    if engine is None:
+        engine = _local.engine = SnmpEngine()
+    return engine
+
+
+def _auth_data(credentials):
+    data = _AUTH_DATA.get(credentials)
+    if data is None:
+        if isinstance(credentials, V3Credentials):
+            data = UsmUserData(
+                credentials.user,
+                authKey=credentials.auth_key,
+                privKey=credentials.priv_key,
+                authProtocol=AUTH_PROTOCOLS.get(credentials.auth_protocol, usmHMACSHAAuthProtocol),
+                privProtocol=PRIV_PROTOCOLS.get(credentials.priv_protocol, usmAesCfb128Protocol),
+            )
+        else:
+            data = CommunityData(credentials or "public", mpModel=1)  # SNMP v2c
+        _AUTH_DATA[credentials] = data
+    return data
+
+
 def format_sysuptime(ticks):
     seconds = int(ticks) / 100  # uptime = centièmes de secondes
     minutes, seconds = divmod(seconds, 60)
@@ -25,69 +258,307 @@ def format_sysuptime(ticks):
     return f"{int(days)}d {int(hours)}h {int(minutes)}m"
 
 
+# ─────────────────────────────────────────────
+# 🔹 Décodage typé des varbinds
+# ─────────────────────────────────────────────
+# Les requêtes retournent des valeurs natives : int pour les entiers, compteurs,
+# jauges et TimeTicks, bytes pour les OCTET STRING, tuple d'int pour les OID.
+# Les OID sont des tuples d'int ; les index de table sont des suffixes en tuple.
+# La conversion en texte ne se fait qu'en sortie (clés de get_metrics, libellés).
+_OID_CACHE = {}
+
+
+def oid_tuple(oid):
+    """'1.3.6.1...' ou tuple -> tuple d'int (conversions mémorisées)."""
+    if isinstance(oid, tuple):
+        return oid
+    parsed = _OID_CACHE.get(oid)
+    if parsed is None:
+        parsed = _OID_CACHE[oid] = tuple(int(part) for part in oid.strip(".").split("."))
+    return parsed
+
+
+def oid_str(oid):
+    """Tuple d'int -> notation pointée (présentation uniquement)."""
+    return oid if isinstance(oid, str) else ".".join(map(str, oid))
+
+
+def decode_value(val):
+    """Valeur pysnmp -> int / bytes / tuple ; None pour noSuchObject, noSuchInstance, endOfMibView."""
+    if isinstance(val, (NoSuchObject, NoSuchInstance, EndOfMibView)):
+        return None
+    if isinstance(val, univ.Integer):
+        return int(val)
+    if isinstance(val, univ.ObjectIdentifier):
+        return tuple(val)
+    if isinstance(val, univ.OctetString):
+        return val.asOctets()
+    return val.prettyPrint()
+
+
+def text(value):
+    """Valeur décodée -> texte affichable."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, tuple):
+        return oid_str(value)
+    return str(value)
+
+
 # ─────────────────────────────────────────────
 # 🔹 Fonctions SNMP génériques
 # ─────────────────────────────────────────────
-def snmp_get(ip: str, community: str, port: int, oid: str):
-    iterator = getCmd(
-        SnmpEngine(),
-        CommunityData(community, mpModel=1),  # SNMP v2c
-        UdpTransportTarget((ip, port), timeout=1, retries=0),
-        ContextData(),
-        ObjectType(ObjectIdentity(oid))
-    )
-    errorIndication, errorStatus, errorIndex, varBinds = next(iterator)
-    if errorIndication:
-        raise Exception(errorIndication)
-    if errorStatus:
-        raise Exception(f"{errorStatus.prettyPrint()} at {errorIndex}")
-    return {str(name): str(val) for name, val in varBinds}
+# Nombre maximal d'OID par PDU GET (reste sous la MTU avec des compteurs 64 bits)
+SNMP_MAX_OIDS_PER_GET = 20
 
 
-def snmp_walk(ip: str, community: str, port: int, oid: str, limit: int = 50):
+def get_typed(ip: str, community: str, port: int, oids, chunk: int = SNMP_MAX_OIDS_PER_GET):
+    """
+    GET multi-OID typé : {oid (tuple): valeur décodée}. Un seul aller-retour
+    par lot de `chunk` OID ; les OID absents sont omis du résultat.
+    """
+    oids = [oid_tuple(oid) for oid in oids]
+    results = {}
+    for start in range(0, len(oids), chunk):
+        target = _target(ip, port)
+        iterator = getCmd(
+            _engine(),
+            _auth_data(community),
+            target,
+            ContextData(),
+            *[ObjectType(ObjectIdentity(oid)) for oid in oids[start:start + chunk]]
+        )
+        started = time.monotonic()
+        errorIndication, errorStatus, errorIndex, varBinds = next(iterator)
+        if errorIndication:
+            _raise_error_indication(ip, port, errorIndication)
+        _observe(ip, port, target, time.monotonic() - started)
+        if errorStatus:
+            _raise_error_status(ip, port, errorStatus, errorIndex)
+        for name, val in varBinds:
+            value = decode_value(val)
+            if value is not None:
+                results[tuple(name)] = value
+    return results
+
+
+def walk_typed(ip: str, community: str, port: int, column, limit: int = 50):
+    """Parcours typé d'une colonne : {suffixe d'index (tuple): valeur décodée}."""
+    column = oid_tuple(column)
+    prefix = len(column)
     results = {}
     count = 0
+    target = _target(ip, port)
+    started = time.monotonic()
     for (errInd, errStat, errIdx, varBinds) in nextCmd(
-        SnmpEngine(),
-        CommunityData(community, mpModel=1),
-        UdpTransportTarget((ip, port), timeout=1, retries=0),
+        _engine(),
+        _auth_data(community),
+        target,
         ContextData(),
-        ObjectType(ObjectIdentity(oid)),
+        ObjectType(ObjectIdentity(column)),
         lexicographicMode=False
     ):
         if errInd:
-            raise Exception(errInd)
+            _raise_error_indication(ip, port, errInd)
+        # Chaque itération correspond à un aller-retour GETNEXT
+        _observe(ip, port, target, time.monotonic() - started)
         if errStat:
-            raise Exception(f"{errStat.prettyPrint()} at {errIdx}")
+            _raise_error_status(ip, port, errStat, errIdx)
         for name, val in varBinds:
-            results[str(name)] = str(val)
+            value = decode_value(val)
+            if value is not None:
+                results[tuple(name)[prefix:]] = value
         count += 1
         if count >= limit:
             break
+        started = time.monotonic()
+    return results
+
+
+# Répétitions par PDU GETBULK (lignes renvoyées par colonne et par aller-retour)
+SNMP_BULK_REPETITIONS = 25
+
+
+def bulk_walk_typed(ip: str, community: str, port: int, columns, max_repetitions: int = SNMP_BULK_REPETITIONS):
+    """
+    Parcours GETBULK de plusieurs colonnes dans les mêmes PDU.
+    `columns` : {colonne: nombre maximal de lignes}. Retourne
+    {colonne (tuple): {suffixe d'index: valeur décodée}}.
+    """
+    columns = [(oid_tuple(column), limit) for column, limit in columns.items()]
+    results = {column: {} for column, _ in columns}
+    if not columns:
+        return results
+    max_rows = max(limit for _, limit in columns)
+    rows = 0
+    target = _target(ip, port)
+    started = time.monotonic()
+    for (errInd, errStat, errIdx, varBinds) in bulkCmd(
+        _engine(),
+        _auth_data(community),
+        target,
+        ContextData(),
+        0, max_repetitions,
+        *[ObjectType(ObjectIdentity(column)) for column, _ in columns],
+        lexicographicMode=False
+    ):
+        if errInd:
+            _raise_error_indication(ip, port, errInd)
+        # Une PDU GETBULK rapporte `max_repetitions` lignes : un aller-retour par lot
+        if rows % max_repetitions == 0:
+            _observe(ip, port, target, time.monotonic() - started)
+        if errStat:
+            _raise_error_status(ip, port, errStat, errIdx)
+        for (column, limit), (name, val) in zip(columns, varBinds):
+            name = tuple(name)
+            # Les colonnes plus courtes débordent sur la suivante : ignorées
+            if name[:len(column)] != column or len(results[column]) >= limit:
+                continue
+            value = decode_value(val)
+            if value is not None:
+                results[column][name[len(column):]] = value
+        rows += 1
+        if rows >= max_rows:
+            break
+        if rows % max_repetitions == 0:
+            started = time.monotonic()
     return results
 
 
+# Variantes texte ({oid pointé: str}) pour les appelants historiques (routes, outils)
+def snmp_get_many(ip: str, community: str, port: int, oids, chunk: int = SNMP_MAX_OIDS_PER_GET):
+    return {oid_str(oid): text(val) for oid, val in get_typed(ip, community, port, oids, chunk).items()}
+
+
+def snmp_get(ip: str, community: str, port: int, oid: str):
+    return snmp_get_many(ip, community, port, [oid])
+
+
+def snmp_walk(ip: str, community: str, port: int, oid: str, limit: int = 50):
+    column = oid_tuple(oid)
+    return {oid_str(column + suffix): text(val)
+            for suffix, val in walk_typed(ip, community, port, column, limit).items()}
+
+
+# ─────────────────────────────────────────────
+# 🔹 Cache des colonnes statiques (invalidé au redémarrage de l'agent)
+# ─────────────────────────────────────────────
+# sysDescr, sysName, hrStorageDescr, unités d'allocation, tailles... ne changent
+# pas entre deux redémarrages : ils sont lus une fois puis servis depuis
+# STATIC_CACHE. Une entrée est invalidée quand sysUpTime recule (l'agent a
+# redémarré) ou après SNMP_STATIC_TTL secondes.
+SNMP_STATIC_TTL = float(os.getenv("SNMP_STATIC_TTL", "21600"))
+UPTIME_MAX_AGE = 10  # secondes : une mesure de sysUpTime récente est réutilisée
+
+# (ip, port, oid) -> (valeur, expiration time.monotonic())
+STATIC_CACHE = {}
+
+# Dernier sysUpTime observé par agent : (ip, port) -> (ticks, time.monotonic())
+AGENT_UPTIME = {}
+
+
+def note_uptime(ip, port, ticks):
+    """
+    Enregistre un sysUpTime lu pour l'agent (par n'importe quelle requête).
+    S'il a reculé, l'agent a redémarré : ses colonnes statiques, son type
+    d'équipement et ses compteurs d'interfaces sont oubliés (pas de débit
+    calculé par-dessus la remise à zéro) et la fonction retourne True.
+    """
+    try:
+        ticks = int(ticks)
+    except (TypeError, ValueError):
+        return False
+    previous = AGENT_UPTIME.get((ip, port))
+    AGENT_UPTIME[(ip, port)] = (ticks, time.monotonic())
+    if previous is None or ticks >= previous[0]:
+        return False
+    # Copie des clés : le poller, les routes web et le récepteur de traps
+    # écrivent dans ces caches en parallèle
+    stale = [key for key in list(STATIC_CACHE) if key[0] == ip and key[1] == port]
+    for key in stale:
+        STATIC_CACHE.pop(key, None)
+    DEVICE_TYPE_CACHE.pop((ip, port), None)
+    for key in [key for key in list(COUNTER_CACHE) if key[0] == ip and key[1] == port]:
+        COUNTER_CACHE.pop(key, None)
+    logger.info(f"[snmp] Redémarrage de {ip}:{port} détecté (sysUpTime) — "
+                f"{len(stale)} colonne(s) statique(s) invalidée(s)")
+    return True
+
+
+def _check_uptime(ip, community, port):
+    """Relit sysUpTime si aucune mesure récente n'est connue pour l'agent."""
+    observed = AGENT_UPTIME.get((ip, port))
+    if observed is not None and time.monotonic() - observed[1] < UPTIME_MAX_AGE:
+        return
+    values = get_typed(ip, community, port, [SYS_UPTIME_OID])
+    note_uptime(ip, port, values.get(SYS_UPTIME_OID))
+
+
+def static_lookup(ip, port, oid):
+    """(trouvé, valeur) pour une entrée statique encore valide (sans relire sysUpTime)."""
+    entry = STATIC_CACHE.get((ip, port, oid))
+    if entry is not None and time.monotonic() < entry[1]:
+        return True, entry[0]
+    return False, None
+
+
+def static_store(ip, port, oid, value):
+    STATIC_CACHE[(ip, port, oid)] = (value, time.monotonic() + SNMP_STATIC_TTL)
+
+
+def _static(ip, community, port, oid, fetch):
+    _check_uptime(ip, community, port)
+    hit, value = static_lookup(ip, port, oid)
+    if hit:
+        return value
+    value = fetch()
+    static_store(ip, port, oid, value)
+    return value
+
+
+def static_get(ip: str, community: str, port: int, oid):
+    """Valeur scalaire statique (décodée, None si absente), servie depuis STATIC_CACHE."""
+    oid = oid_tuple(oid)
+    return _static(ip, community, port, oid, lambda: get_typed(ip, community, port, [oid]).get(oid))
+
+
+def static_walk(ip: str, community: str, port: int, column, limit: int = 50):
+    """Colonne statique {suffixe: valeur}, servie depuis STATIC_CACHE tant qu'elle est valide."""
+    column = oid_tuple(column)
+    return _static(ip, community, port, column, lambda: walk_typed(ip, community, port, column, limit=limit))
+
+
 # ─────────────────────────────────────────────
 # 🔹 Détection automatique du type d’équipement
 # ─────────────────────────────────────────────
 def _detect_group(ip: str, community: str, port: int) -> str:
+    cached = DEVICE_TYPE_CACHE.get((ip, port))
+    if cached:
+        return cached
     try:
-        sysdescr = snmp_get(ip, community, port, "1.3.6.1.2.1.1.1.0")
-        val = next(iter(sysdescr.values()), "").lower()
+        val = text(static_get(ip, community, port, SYS_DESCR_OID) or b"").lower()
         if "pfsense" in val or "freebsd" in val:
-            return "pfsense"
-        if "windows" in val or "microsoft" in val:
-            return "windows"
+            group = "pfsense"
+        elif "windows" in val or "microsoft" in val:
+            group = "windows"
+        else:
+            group = "linux"
     except Exception:
-        pass
-    return "linux"
+        # Détection impossible : valeur par défaut, non mise en cache
+        return "linux"
+    DEVICE_TYPE_CACHE[(ip, port)] = group
+    return group
 
 
 # ─────────────────────────────────────────────
 # 🔹 Calcul du débit en Mbps entre deux sondes
 # ─────────────────────────────────────────────
-def calculate_rate(current_value, previous_value, previous_ts, current_ts):
-    """Convertit la différence d’octets en Mbps (bits/sec / 1e6)."""
+def calculate_rate(current_value, previous_value, previous_ts, current_ts, counter_bits=32):
+    """
+    Convertit la différence d’octets en Mbps (bits/sec / 1e6).
+    Un Counter32 qui recule a rebouclé ; un Counter64 ne reboucle pas en
+    pratique : un recul est une remise à zéro et la mesure est écartée (None).
+    """
     try:
         current = int(current_value)
         previous = int(previous_value)
@@ -100,241 +571,169 @@ def calculate_rate(current_value, previous_value, previous_ts, current_ts):
 
     delta_bytes = current - previous
     if delta_bytes < 0:
-        delta_bytes += 2**32  # overflow
+        if counter_bits >= 64:
+            return None  # remise à zéro (redémarrage, clear counters)
+        delta_bytes += 2**counter_bits  # rebouclage Counter32
 
     return round((delta_bytes * 8) / (delta_t * 1_000_000), 3)
 
 
 # ─────────────────────────────────────────────
-# 🔹 Fonction principale multi-équipement
+# 🔹 Cache de la table des interfaces
 # ─────────────────────────────────────────────
-def get_metrics(ip: str, community: str, port: int, category: str,
-                host_id=None, group_name: Optional[str] = None):
-    """
-    Récupère les métriques SNMP selon la catégorie et le type d'équipement :
-    linux / pfsense / windows
-    """
-    group = (group_name or _detect_group(ip, community, port)).lower()
-
-    # 1️) SYSTEM
-    if category == "system":
-        res = {}
-        for oid in ("1.3.6.1.2.1.1.1.0", "1.3.6.1.2.1.1.3.0", "1.3.6.1.2.1.1.5.0"):
-            try:
-                res.update(snmp_get(ip, community, port, oid))
-            except Exception:
-                continue
-        # Format lisible
-        if "1.3.6.1.2.1.1.3.0" in res:
-            res["Uptime"] = format_sysuptime(res["1.3.6.1.2.1.1.3.0"])
-        return res
-
-    # 2️) CPU
-    elif category == "cpu":
-        if group in ("linux", "pfsense"):
-            return snmp_walk(ip, community, port, "1.3.6.1.2.1.25.3.3.1.2", limit=10)
-        if group == "windows":
-            try:
-                data = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.3.3.1.2", limit=10)
-                if not data:
-                    data = snmp_get(ip, community, port, "1.3.6.1.4.1.2021.11.11.0")
-                return data
-            except Exception:
-                return {}
-        return {}
-
-    # 3) RAM 
-    elif category == "ram":
-        results = {}
-
-        if group == "pfsense":
-            # 🔹 Utilise UCD-SNMP (plus fiable sur pfSense)
-            try:
-                mem_total = int(snmp_get(ip, community, port, "1.3.6.1.4.1.2021.4.5.0")["1.3.6.1.4.1.2021.4.5.0"])
-                mem_avail = int(snmp_get(ip, community, port, "1.3.6.1.4.1.2021.4.6.0")["1.3.6.1.4.1.2021.4.6.0"])           
-            except Exception:
-                return {}
-
-            mem_used = mem_total - mem_avail
-            mem_pct = round(mem_used / mem_total * 100, 2) if mem_total > 0 else 0
-
-            results["Memory"] = {
-                "used": mem_used * 1024,   # en octets
-                "total": mem_total * 1024,
-                "pct": mem_pct
-            }
-            return results
-
-        # 🔹 Linux / Windows : HOST-RESOURCES-MIB
-        else:
-            descr = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.3")   # hrStorageDescr
-            alloc = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.4")   # hrStorageAllocationUnits
-            size  = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.5")   # hrStorageSize
-            used  = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.6")   # hrStorageUsed
-
-            for oid, name in descr.items():
-                # On garde uniquement la mémoire physique
-                if "physical memory" not in name.lower():
-                    continue
-
-                idx = oid.split(".")[-1]
-                try:
-                    block_size = int(alloc.get(f"1.3.6.1.2.1.25.2.3.1.4.{idx}", 1))
-                    total = int(size.get(f"1.3.6.1.2.1.25.2.3.1.5.{idx}", 0)) * block_size
-                    used_val = int(used.get(f"1.3.6.1.2.1.25.2.3.1.6.{idx}", 0)) * block_size
-                    pct = round(used_val / total * 100, 2) if total > 0 else 0
-
-                    results["Physical memory"] = {"used": used_val, "total": total, "pct": pct}
-                except Exception:
-                    continue
-
-            return results
-
-
-    # 4) STORAGE (UCD-SNMP pour pfSense)
-    elif category == "storage":
-        results = {}
-
-        # --- pfSense ---
-        if group == "pfsense":
-            try:
-                descr = snmp_walk(ip, community, port, "1.3.6.1.4.1.2021.9.1.2")
-                used  = snmp_walk(ip, community, port, "1.3.6.1.4.1.2021.9.1.7")
-                total = snmp_walk(ip, community, port, "1.3.6.1.4.1.2021.9.1.6")
-                pct   = snmp_walk(ip, community, port, "1.3.6.1.4.1.2021.9.1.9")
-            except Exception:
-                return {}
-
-            for oid, mount in descr.items():
-                idx = oid.split(".")[-1]
-                if mount in ("/", "/var/run"):
-                    try:
-                        t = int(total.get(f"1.3.6.1.4.1.2021.9.1.6.{idx}", 0))
-                        u = int(used.get(f"1.3.6.1.4.1.2021.9.1.7.{idx}", 0))
-                        p = int(pct.get(f"1.3.6.1.4.1.2021.9.1.9.{idx}", 0))
-                        results[mount] = {"used": u * 1024, "total": t * 1024, "pct": p}
-                    except Exception:
-                        continue
-
-        # --- Windows / Linux : HOST-RESOURCES-MIB ---
-        else:
-            descr = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.3")
-            alloc = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.4")
-            size  = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.5")
-            used  = snmp_walk(ip, community, port, "1.3.6.1.2.1.25.2.3.1.6")
-
-            for oid, name in descr.items():
-                # On ignore la RAM et volumes système inutiles
-                if any(skip in name.lower() for skip in ("memory", "virtual", "uma", "devfs", "/run", "/tmp")):
-                    continue
-
-                idx = oid.split(".")[-1]
-                try:
-                    block_size = int(alloc.get(f"1.3.6.1.2.1.25.2.3.1.4.{idx}", 1))
-                    total = int(size.get(f"1.3.6.1.2.1.25.2.3.1.5.{idx}", 0)) * block_size
-                    used_val = int(used.get(f"1.3.6.1.2.1.25.2.3.1.6.{idx}", 0)) * block_size
-                    pct = round(used_val / total * 100, 2) if total > 0 else 0
-
-                    label = name.split(" ")[0] if ":" in name else name
-                    results[label] = {"used": used_val, "total": total, "pct": pct}
-                except Exception:
-                    continue
-
-        # --- Normalisation finale (clé .pct pour graphe) ---
-        cleaned = {}
-        for name, info in results.items():
-            if name.startswith("/") or ":" in name:
-                cleaned[name + ".pct"] = info["pct"]
-            elif "mount" in info or "descr" in info:
-                label = info.get("mount") or info.get("descr")
-                if label:
-                    cleaned[label + ".pct"] = info["pct"]
-
-        results.update(cleaned)
-        return results
-
-
-    # 5️) INTERFACES
-    elif category == "interfaces":
-        ifDescr = snmp_walk(ip, community, port, "1.3.6.1.2.1.2.2.1.2")
-        ifOperStatus = snmp_walk(ip, community, port, "1.3.6.1.2.1.2.2.1.8")
-
-        # Tentative haute capacité
-        ifInOctets = snmp_walk(ip, community, port, "1.3.6.1.2.1.31.1.1.1.6")
-        ifOutOctets = snmp_walk(ip, community, port, "1.3.6.1.2.1.31.1.1.1.10")
-
-        # WINDOWS ne supporte pas ifXTable la plupart du temps → forcer les OID standard
-        if group == "windows":
-            ifInOctets = snmp_walk(ip, community, port, "1.3.6.1.2.1.2.2.1.10")
-            ifOutOctets = snmp_walk(ip, community, port, "1.3.6.1.2.1.2.2.1.16")
-
-        # fallback si ifXTable vide
-        if not ifInOctets:
-            ifInOctets = snmp_walk(ip, community, port, "1.3.6.1.2.1.2.2.1.10")
-        if not ifOutOctets:
-            ifOutOctets = snmp_walk(ip, community, port, "1.3.6.1.2.1.2.2.1.16")
-
-        results = {}
-
-        for descr_oid, name in ifDescr.items():
-            idx = descr_oid.split(".")[-1]
-            lname = name.lower()
-
-            ignored_keywords = [
-                "miniport", "virtual", "npcap", "filter", "adapter-wfp", "qos",
-                "native wifi", "teredo", "6to4", "wan", "debug", "kernel",
-                "isatap", "vmware", "vbox", "pppoe", "bluetooth", "loopback", "microsoft"
-            ]
-            if any(k in lname for k in ignored_keywords):
-                continue
-
-            state_raw = ifOperStatus.get(f"1.3.6.1.2.1.2.2.1.8.{idx}", "2")
-            state = "up" if state_raw.endswith("1") else "down"
-
-            try:
-                in_val = int(ifInOctets.get(f"1.3.6.1.2.1.31.1.1.1.6.{idx}", "0"))
-                out_val = int(ifOutOctets.get(f"1.3.6.1.2.1.31.1.1.1.10.{idx}", "0"))
-            except ValueError:
-                in_val, out_val = 0, 0
+# La liste des interfaces ne change presque jamais : elle est parcourue une
+# fois (ifDescr, vitesse, filtre des noms, largeur des compteurs), puis chaque
+# cycle ne lit que l'état et les compteurs des interfaces retenues par GET
+# multi-OID. La table est reparcourue si ifTableLastChange change, si
+# sysUpTime recule (redémarrage) ou, sans ifTableLastChange, après IF_TABLE_TTL.
+IF_DESCR_OID = (1, 3, 6, 1, 2, 1, 2, 2, 1, 2)
+IF_SPEED_OID = (1, 3, 6, 1, 2, 1, 2, 2, 1, 5)
+IF_OPER_STATUS_OID = (1, 3, 6, 1, 2, 1, 2, 2, 1, 8)
+IF_IN_OCTETS_OID = (1, 3, 6, 1, 2, 1, 2, 2, 1, 10)
+IF_OUT_OCTETS_OID = (1, 3, 6, 1, 2, 1, 2, 2, 1, 16)
+IF_HC_IN_OCTETS_OID = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 6)
+IF_HC_OUT_OCTETS_OID = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 10)
+IF_HIGH_SPEED_OID = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 15)
+IF_TABLE_LAST_CHANGE_OID = (1, 3, 6, 1, 2, 1, 31, 1, 5, 0)
+IF_TABLE_TTL = 3600  # secondes, agents sans ifTableLastChange
+
+IGNORED_INTERFACE_KEYWORDS = (
+    "miniport", "virtual", "npcap", "filter", "adapter-wfp", "qos",
+    "native wifi", "teredo", "6to4", "wan", "debug", "kernel",
+    "isatap", "vmware", "vbox", "pppoe", "bluetooth", "loopback", "microsoft"
+)
 
-            # Si forçage Windows → lecture des OID standard avec l'index correct
-            if group == "windows":
-                try:
-                    in_val = int(ifInOctets.get(f"1.3.6.1.2.1.2.2.1.10.{idx}", "0"))
-                    out_val = int(ifOutOctets.get(f"1.3.6.1.2.1.2.2.1.16.{idx}", "0"))
-                except ValueError:
-                    in_val, out_val = 0, 0
 
-            info = {"state": state, "in": in_val, "out": out_val}
+class IfEntry(NamedTuple):
+    index: tuple            # suffixe d'index (ifIndex,)
+    name: str
+    selected: bool          # False si le nom correspond à IGNORED_INTERFACE_KEYWORDS
+    hc: bool                # compteurs 64 bits (ifXTable) disponibles
+    speed_mbps: Optional[float]
+    oids: tuple             # (ifOperStatus, in, out) pour le GET de chaque cycle
+
+
+class IfTable(NamedTuple):
+    entries: tuple
+    uptime: int             # sysUpTime au dernier passage (centièmes de seconde)
+    last_change: Optional[int]
+    built_at: float         # time.monotonic()
+
+
+# Table des interfaces par agent : (ip, port) -> IfTable
+IF_TABLE_CACHE = {}
+
+
+def _if_table_stale(table, uptime, last_change):
+    if table is None:
+        return True
+    if uptime is not None and uptime < table.uptime:
+        return True         # redémarrage de l'agent : index potentiellement renumérotés
+    if last_change is not None or table.last_change is not None:
+        return last_change != table.last_change
+    return time.monotonic() - table.built_at > IF_TABLE_TTL
+
+
+def _interface_oids(index, hc):
+    if hc:
+        return (IF_OPER_STATUS_OID + index, IF_HC_IN_OCTETS_OID + index, IF_HC_OUT_OCTETS_OID + index)
+    return (IF_OPER_STATUS_OID + index, IF_IN_OCTETS_OID + index, IF_OUT_OCTETS_OID + index)
+
+
+def _build_if_table(ip, community, port, group, uptime, last_change):
+    """Parcourt la table des interfaces de l'agent et la met en cache."""
+    descr = walk_typed(ip, community, port, IF_DESCR_OID)
+    speeds = walk_typed(ip, community, port, IF_HIGH_SPEED_OID)
+    speed_factor = 1
+    if not speeds:
+        speeds = walk_typed(ip, community, port, IF_SPEED_OID)
+        speed_factor = 1_000_000
+
+    rows = []
+    for index, raw_name in descr.items():
+        name = text(raw_name)
+        selected = not any(k in name.lower() for k in IGNORED_INTERFACE_KEYWORDS)
+        speed = speeds.get(index)
+        rows.append((index, name, selected, speed / speed_factor if isinstance(speed, int) else None))
+
+    # WINDOWS ne supporte pas ifXTable la plupart du temps → compteurs 32 bits
+    hc = False
+    first = next((r[0] for r in rows if r[2]), None)
+    if group != "windows" and first is not None:
+        hc = bool(get_typed(ip, community, port, [IF_HC_IN_OCTETS_OID + first]))
+
+    table = IfTable(
+        entries=tuple(IfEntry(index, name, selected, hc, speed, _interface_oids(index, hc))
+                      for index, name, selected, speed in rows),
+        uptime=uptime or 0,
+        last_change=last_change,
+        built_at=time.monotonic(),
+    )
+    IF_TABLE_CACHE[(ip, port)] = table
+    logger.info(f"[snmp] Table des interfaces de {ip}:{port} reconstruite "
+                f"({sum(e.selected for e in table.entries)}/{len(table.entries)} retenues, "
+                f"compteurs {'64' if hc else '32'} bits)")
+    return table
 
-            if host_id:
-                now = datetime.utcnow()
 
-                prev_in = Measurement.query.filter_by(
-                    host_id=host_id, oid=f"{name}.in"
-                ).order_by(Measurement.ts.desc()).first()
+def interface_poll_oids(ip, port):
+    """
+    OID à lire à chaque cycle pour les interfaces de l'agent : ifTableLastChange
+    puis état et compteurs des interfaces retenues de la table en cache.
+    (sysUpTime est ajouté par le planificateur.)
+    """
+    table = IF_TABLE_CACHE.get((ip, port))
+    oids = [IF_TABLE_LAST_CHANGE_OID]
+    if table is not None:
+        oids.extend(oid for e in table.entries if e.selected for oid in e.oids)
+    return oids
 
-                prev_out = Measurement.query.filter_by(
-                    host_id=host_id, oid=f"{name}.out"
-                ).order_by(Measurement.ts.desc()).first()
 
-                info["in_mbps"] = calculate_rate(
-                    in_val, prev_in.value, prev_in.ts, now
-                ) if prev_in else 0.0
+def interface_counters(ip, community, port, group, values=None):
+    """
+    Retourne (table, valeurs) : état et compteurs des interfaces retenues.
+    `values` contient le résultat du GET de interface_poll_oids (et sysUpTime)
+    s'il a déjà été fait ; si la table a changé, elle est reconstruite puis relue.
+    """
+    table = IF_TABLE_CACHE.get((ip, port))
+    if values is None:
+        values = get_typed(ip, community, port, [SYS_UPTIME_OID] + interface_poll_oids(ip, port))
 
-                info["out_mbps"] = calculate_rate(
-                    out_val, prev_out.value, prev_out.ts, now
-                ) if prev_out else 0.0
-            else:
-                info["in_mbps"], info["out_mbps"] = 0.0, 0.0
+    uptime = values.get(SYS_UPTIME_OID)
+    if uptime is not None:
+        note_uptime(ip, port, uptime)
+    last_change = values.get(IF_TABLE_LAST_CHANGE_OID)
+    # Une interface retenue qui disparaît signale aussi une table obsolète
+    vanished = table is not None and any(e.oids[0] not in values for e in table.entries if e.selected)
+    if vanished or _if_table_stale(table, uptime, last_change):
+        table = _build_if_table(ip, community, port, group, uptime, last_change)
+        values = get_typed(ip, community, port, [oid for e in table.entries if e.selected for oid in e.oids])
+    else:
+        IF_TABLE_CACHE[(ip, port)] = table._replace(uptime=uptime or table.uptime)
+    return table, values
 
-            results[name] = info
 
-        return results
+def interface_table(ip, port):
+    """Table des interfaces en cache pour l'agent (None si jamais parcourue)."""
+    return IF_TABLE_CACHE.get((ip, port))
 
 
-    # fallback
-    return {}
+# ─────────────────────────────────────────────
+# 🔹 Fonction principale multi-équipement
+# ─────────────────────────────────────────────
+def get_metrics(ip: str, community: str, port: int, category: str,
+                host_id=None, group_name: Optional[str] = None):
+    """
+    Récupère les métriques SNMP d'une catégorie selon le type d'équipement
+    (linux / pfsense / windows). Les catégories sont définies dans
+    snmp_registry ; pour plusieurs catégories d'un même hôte, préférer
+    `collect_metrics` qui fusionne les requêtes.
+    """
+    from snmp_registry import collect_metrics
+    results, errors = collect_metrics(ip, community, port, [category], host_id, group_name)
+    if category in errors:
+        raise errors[category]
+    return results.get(category, {})
 
 
 # ─────────────────────────────────────────────
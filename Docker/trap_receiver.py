@@ -0,0 +1,170 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+from db_utils import open_alert, resolve_alert, unit_of_work
+from snmp_utils import decode_value, text, oid_str
+import logging
+logger = logging.getLogger(__name__)
+
+# ─────────────────────────────────────────────
+# 🔹 Récepteur de traps / informs SNMP (v2c)
+# ─────────────────────────────────────────────
+# Écoute UDP asyncio dans un thread dédié. Les traps linkDown / linkUp /
+# coldStart / warmStart sont rattachés à un hôte via l'index IP de l'inventaire
+# du poller, alimentent les fonctions d'alerte habituelles et déclenchent un
+# poll immédiat de l'hôte (détection sans attendre l'intervalle de poll).
+TRAP_ENABLED = os.getenv("TRAP_ENABLED", "1") == "1"
+TRAP_LISTEN_ADDR = os.getenv("TRAP_LISTEN_ADDR", "0.0.0.0")
+TRAP_PORT = int(os.getenv("TRAP_PORT", "162"))
+
+SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+IF_INDEX_OID = (1, 3, 6, 1, 2, 1, 2, 2, 1, 1)
+IF_DESCR_OID = (1, 3, 6, 1, 2, 1, 2, 2, 1, 2)
+IF_NAME_OID = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 1)
+
+TRAP_NAMES = {
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 1): "coldStart",
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 2): "warmStart",
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 3): "linkDown",
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 4): "linkUp",
+}
+
+# Compteurs exposés par /healthz
+TRAP_STATS = {"received": 0, "handled": 0, "ignored": 0, "unknown_source": 0, "errors": 0}
+
+
+def _interface_label(varbinds):
+    """Nom de l'interface concernée (ifName / ifDescr si fournis, sinon ifIndex)."""
+    index = None
+    for oid, value in varbinds.items():
+        if oid[:len(IF_NAME_OID)] == IF_NAME_OID or oid[:len(IF_DESCR_OID)] == IF_DESCR_OID:
+            return text(value)
+        if oid[:len(IF_INDEX_OID)] == IF_INDEX_OID:
+            index = value
+        elif index is None and len(oid) == 11 and oid[:9] == IF_INDEX_OID[:9]:
+            # ifAdminStatus.N / ifOperStatus.N : l'index est le dernier sous-identifiant
+            index = oid[-1]
+    return f"ifIndex {index}" if index is not None else "inconnue"
+
+
+def handle_trap(app, db, Alert, host, trap, varbinds):
+    """Applique un trap décodé à l'hôte `host` (PollSpec) : alertes + poll immédiat."""
+    from poller import request_poll
+
+    with app.app_context():
+        with unit_of_work(db):
+            if trap == "linkDown":
+                label = _interface_label(varbinds)
+                open_alert(db, Alert, host.id, "warning",
+                           f"Interface {label} down (trap linkDown) sur {host.hostname}")
+            elif trap == "linkUp":
+                label = _interface_label(varbinds)
+                resolve_alert(db, Alert, host.id, message_contains=f"Interface {label} down", force=True)
+            elif trap in ("coldStart", "warmStart"):
+                open_alert(db, Alert, host.id, "info",
+                           f"Redémarrage de l'agent SNMP ({trap}) sur {host.hostname} ({host.ip})")
+    request_poll(host.id)
+    logger.info(f"[trap] {trap} de {host.hostname} ({host.ip}) — poll immédiat demandé")
+
+
+class TrapProtocol(asyncio.DatagramProtocol):
+    """Décode les PDU SNMPv2-Trap / InformRequest et répond aux informs."""
+
+    def __init__(self, app, db, Alert, inventory, executor):
+        self.app = app
+        self.db = db
+        self.Alert = Alert
+        self.inventory = inventory
+        self.executor = executor
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        TRAP_STATS["received"] += 1
+        try:
+            self._process(data, addr)
+        except Exception as e:
+            TRAP_STATS["errors"] += 1
+            logger.warning(f"[trap] ⚠️ Datagramme invalide de {addr[0]} : {e}")
+
+    def _process(self, data, addr):
+        if int(api.decodeMessageVersion(data)) != api.protoVersion2c:
+            TRAP_STATS["ignored"] += 1
+            logger.debug(f"[trap] Version SNMP non gérée (v2c uniquement) depuis {addr[0]}")
+            return
+        pMod = api.protoModules[api.protoVersion2c]
+        message, _ = decoder.decode(data, asn1Spec=pMod.Message())
+        pdu = pMod.apiMessage.getPDU(message)
+        is_inform = pdu.isSameTypeWith(pMod.InformRequestPDU())
+        if not is_inform and not pdu.isSameTypeWith(pMod.SNMPv2TrapPDU()):
+            TRAP_STATS["ignored"] += 1
+            return
+
+        # Source → hôte (index IP de l'inventaire), avec contrôle de la communauté
+        community = text(decode_value(pMod.apiMessage.getCommunity(message)))
+        candidates = self.inventory.by_ip(addr[0])
+        host = next((h for h in candidates if (h.snmp_community or "public") == community), None)
+        if host is None:
+            TRAP_STATS["unknown_source"] += 1
+            logger.info(f"[trap] Source inconnue ou communauté invalide : {addr[0]}")
+            return
+
+        raw_varbinds = pMod.apiPDU.getVarBinds(pdu)
+        if is_inform:
+            # Accusé de réception : l'agent cesse de réémettre l'inform
+            response = pMod.apiMessage.getResponse(message)
+            pMod.apiPDU.setVarBinds(pMod.apiMessage.getPDU(response), raw_varbinds)
+            self.transport.sendto(encoder.encode(response), addr)
+
+        varbinds = {tuple(name): decode_value(value) for name, value in raw_varbinds}
+        trap = TRAP_NAMES.get(varbinds.get(SNMP_TRAP_OID))
+        if trap is None:
+            TRAP_STATS["ignored"] += 1
+            logger.debug(f"[trap] Trap non géré {oid_str(varbinds.get(SNMP_TRAP_OID) or ())} de {host.hostname}")
+            return
+
+        TRAP_STATS["handled"] += 1
+        # Écritures en base hors de la boucle asyncio, une à la fois
+        self.executor.submit(self._handle, host, trap, varbinds)
+
+    def _handle(self, host, trap, varbinds):
+        try:
+            handle_trap(self.app, self.db, self.Alert, host, trap, varbinds)
+        except Exception as e:
+            TRAP_STATS["errors"] += 1
+            logger.warning(f"[trap] ⚠️ Traitement du trap {trap} de {host.hostname} échoué : {e}")
+
+
+_receiver_started = False
+
+
+def start_trap_receiver(app, db, Alert):
+    """Démarre l'écoute des traps dans un thread séparé (boucle asyncio dédiée)."""
+    global _receiver_started
+    if _receiver_started or not TRAP_ENABLED:
+        return
+    _receiver_started = True
+
+    from poller import INVENTORY
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trap-handler")
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(loop.create_datagram_endpoint(
+                lambda: TrapProtocol(app, db, Alert, INVENTORY, executor),
+                local_addr=(TRAP_LISTEN_ADDR, TRAP_PORT),
+            ))
+        except OSError as e:
+            logger.error(f"[trap] ❌ Écoute impossible sur {TRAP_LISTEN_ADDR}:{TRAP_PORT}/udp : {e}")
+            return
+        logger.info(f"[trap] 🚀 Récepteur de traps v2c à l'écoute sur {TRAP_LISTEN_ADDR}:{TRAP_PORT}/udp")
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True, name="trap-receiver").start()